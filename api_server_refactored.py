@@ -3,18 +3,52 @@ KMart ML API Server - Refactored Version
 Clean, modular, and organized structure
 """
 
-from fastapi import FastAPI
+import threading
+from contextlib import asynccontextmanager
+import anyio
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from src.data.data_manager import DataManager
-from src.api.api_routes import router, init_services
+from fastapi.responses import JSONResponse
+from src.api import api_routes
+from src.api.api_routes import router, load_services, close_services
+from src.metrics import MetricsMiddleware
+from src import config
+
+# Routes that answer while models are still loading
+ALWAYS_AVAILABLE_PATHS = {"/", "/health", "/ready", "/metrics", "/docs", "/openapi.json", "/redoc"}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start serving at once and load data and models in the background"""
+    # Size the thread pool that runs the sync route handlers
+    if config.THREADPOOL_SIZE:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = config.THREADPOOL_SIZE
+    threading.Thread(target=load_services, name="kmart-startup", daemon=True).start()
+    yield
+    close_services()
 
 # Create FastAPI app
 app = FastAPI(
-    title="KMart ML API", 
-    description="API for product recommendations, search, and trending products"
+    title="KMart ML API",
+    description="API for product recommendations, search, and trending products",
+    lifespan=lifespan
 )
 
-# Add CORS middleware for Flutter app
+@app.middleware("http")
+async def require_ready(request: Request, call_next):
+    """Answer 503 instead of failing while models are still loading"""
+    if not api_routes.services_ready.is_set() and request.url.path not in ALWAYS_AVAILABLE_PATHS:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Service is starting, models are still loading"},
+            headers={"Retry-After": "5"}
+        )
+    return await call_next(request)
+
+# Request counts and latency per route, including requests turned away while loading
+app.add_middleware(MetricsMiddleware)
+
+# Add CORS middleware for Flutter app (added last, so the readiness 503s carry CORS headers)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # In production, specify your Flutter app's domain
@@ -23,14 +57,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize data manager and services
-data_manager = DataManager()
-data_manager.load_models()
-init_services(data_manager)
-
 # Include all routes
 app.include_router(router)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+"""
+In-process benchmark for KMart ML API
+
+Replays a JSONL request trace against the ASGI app (no network, no server)
+with a configurable number of concurrent clients, and times every
+MLServices / InteractionServices method directly. Each line of a trace is
+one request:
+
+    {"method": "POST", "path": "/search", "json": {"query": "laptop"}}
+    {"method": "GET", "path": "/trending", "params": {"limit": 10}}
+
+Usage:
+
+    python benchmark.py                                 # synthetic trace, real data
+    python benchmark.py --trace trace.jsonl --concurrency 32
+    python benchmark.py --scales 10000,100000,1000000 --output bench.json
+    python benchmark.py --write-trace trace.jsonl --requests 5000
+
+With --scales, the catalog and interaction tables are replaced by synthetic
+ones of each size (in a temporary directory, the repository data is not
+touched) so the per-method timings show how each service degrades with data
+size. Compare two commits by diffing their --output files.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+# Weighted mix of the synthetic trace, roughly what the Flutter app sends
+TRACE_MIX = [
+    ('search', 30),
+    ('recommendations', 20),
+    ('product_view', 20),
+    ('trending', 10),
+    ('similar_products', 8),
+    ('product_details', 6),
+    ('user_interactions', 4),
+    ('search_batch', 1),
+    ('recommendations_batch', 1),
+]
+
+SEARCH_TERMS = [
+    'laptop', 'study table', 'chair', 'shoes', 'phone', 'desk lamp', 'bag',
+    'cup board', 'dining set', 'headphones', 'mattress', 'fridge', 'books', 'kettle'
+]
+INTERACTION_TYPES = ['view', 'view_details', 'like', 'unlike', 'add_to_cart', 'chat_message', 'rating', 'search']
+CATEGORY_WORDS = ['Furniture', 'Electronics', 'Kitchen', 'Books', 'Fashion', 'Bedding', 'Stationery', 'Sports']
+
+
+def percentile_summary(latencies, elapsed=None):
+    """Count, mean and p50/p95/p99 in milliseconds (and throughput if elapsed is given)"""
+    values = np.asarray(latencies, dtype=np.float64) * 1000.0
+    if len(values) == 0:
+        return {'count': 0}
+    summary = {
+        'count': int(len(values)),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+    }
+    if elapsed:
+        summary['throughput_rps'] = round(len(values) / elapsed, 1)
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------------------------
+
+def synthesize_catalog(size: int, seed: int = 0) -> pd.DataFrame:
+    """Product table with the columns of data_csv/product_data_cleaned.csv"""
+    rng = np.random.default_rng(seed)
+    terms = np.array(SEARCH_TERMS + ['wooden', 'new', 'used', 'portable', 'large', 'small', 'student', 'premium'])
+    categories = np.array(CATEGORY_WORDS)
+    first = terms[rng.integers(len(terms), size=size)]
+    second = terms[rng.integers(len(terms), size=size)]
+    names = pd.Series(first).str.title() + ' ' + pd.Series(second)
+    prices = rng.integers(5, 5000, size=size) * 1000
+    return pd.DataFrame({
+        'id': [f'prod_{row}' for row in range(size)],
+        'name': names,
+        'description': 'Quality ' + pd.Series(second) + ' for ' + pd.Series(first) + ' use',
+        'ownerId': rng.integers(1, 500, size=size),
+        'priceAndDiscount': ['Ugx' + str(price) for price in prices],
+        'originalPrice': ['Ugx' + str(price * 5 // 4) for price in prices],
+        'condition': np.where(rng.random(size) < 0.6, 'New', 'Used'),
+        'location': 'Campus',
+        'rating': np.round(rng.uniform(2.5, 5.0, size=size), 1),
+        'category': categories[rng.integers(len(categories), size=size)],
+        'imageUrl': '',
+    })
+
+
+def synthesize_interactions(size: int, product_ids, users: int, seed: int = 0) -> pd.DataFrame:
+    """Interaction log rows over the last 30 days, skewed towards popular products"""
+    from src.data.interaction_log import INTERACTION_COLUMNS
+
+    rng = np.random.default_rng(seed + 1)
+    product_ids = np.asarray(product_ids, dtype=object)
+    # Zipf-like popularity so trending and co-interaction have a head and a tail
+    product_rows = np.minimum(rng.zipf(1.3, size=size) - 1, len(product_ids) - 1)
+    user_ids = rng.integers(1, users + 1, size=size).astype(str)
+    offsets = rng.uniform(0, 30 * 24 * 3600, size=size)
+    now = datetime.now()
+    timestamps = [(now - timedelta(seconds=float(offset))).isoformat() for offset in offsets]
+    types = np.array(INTERACTION_TYPES[:-1])[rng.integers(len(INTERACTION_TYPES) - 1, size=size)]
+    frame = pd.DataFrame({
+        'interactionId': [f'int_bench_{row}' for row in range(size)],
+        'userId': user_ids,
+        'productId': product_ids[product_rows],
+        'interactionType': types,
+        'timestamp': timestamps,
+        'metadata': '{}',
+    })
+    return frame.reindex(columns=INTERACTION_COLUMNS)
+
+
+def prepare_workdir(scale: int, seed: int) -> str:
+    """Temporary directory laid out like the repository, with synthetic data of ``scale`` rows"""
+    workdir = tempfile.mkdtemp(prefix=f'kmart-bench-{scale}-')
+    os.makedirs(os.path.join(workdir, 'data_csv'))
+    catalog = synthesize_catalog(scale, seed)
+    catalog.to_csv(os.path.join(workdir, 'data_csv', 'product_data_cleaned.csv'), index=False)
+    interactions = synthesize_interactions(scale, catalog['id'], users=max(10, scale // 20), seed=seed)
+    interactions.to_csv(os.path.join(workdir, 'data_csv', 'product_interactions_data_fixed.csv'), index=False, header=False)
+    return workdir
+
+
+# ---------------------------------------------------------------------------
+# Traces
+# ---------------------------------------------------------------------------
+
+def synthesize_trace(count: int, product_ids, user_ids, seed: int = 0):
+    """Mixed request trace over the loaded catalog and users"""
+    rng = random.Random(seed)
+    product_ids = list(product_ids) or ['unknown']
+    user_ids = list(user_ids) or ['1']
+    kinds = [kind for kind, _ in TRACE_MIX]
+    weights = [weight for _, weight in TRACE_MIX]
+
+    trace = []
+    for _ in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        product_id = rng.choice(product_ids)
+        user_id = rng.choice(user_ids)
+        if kind == 'search':
+            trace.append({'method': 'POST', 'path': '/search', 'json': {'query': rng.choice(SEARCH_TERMS), 'num_results': 10}})
+        elif kind == 'recommendations':
+            trace.append({'method': 'POST', 'path': '/recommendations', 'json': {'user_id': user_id, 'num_recommendations': 10}})
+        elif kind == 'product_view':
+            trace.append({'method': 'POST', 'path': '/interactions/product-view', 'json': {
+                'user_id': user_id, 'product_id': product_id,
+                'interaction_type': rng.choice(['view', 'view_details']), 'metadata': {'source': 'benchmark'}
+            }})
+        elif kind == 'trending':
+            trace.append({'method': 'GET', 'path': '/trending', 'params': {'days': rng.choice([1, 7, 30]), 'limit': 10}})
+        elif kind == 'similar_products':
+            trace.append({'method': 'GET', 'path': f'/similar-products/{product_id}', 'params': {'limit': 5}})
+        elif kind == 'product_details':
+            trace.append({'method': 'GET', 'path': f'/products/{product_id}'})
+        elif kind == 'user_interactions':
+            trace.append({'method': 'GET', 'path': f'/interactions/user/{user_id}', 'params': {'limit': 50}})
+        elif kind == 'search_batch':
+            trace.append({'method': 'POST', 'path': '/search/batch', 'json': {'queries': rng.sample(SEARCH_TERMS, 8), 'num_results': 10}})
+        elif kind == 'recommendations_batch':
+            trace.append({'method': 'POST', 'path': '/recommendations/batch', 'json': {
+                'user_ids': [rng.choice(user_ids) for _ in range(16)], 'num_recommendations': 10
+            }})
+    return trace
+
+
+def read_trace(path: str):
+    trace = []
+    with open(path, 'r') as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if 'method' not in entry or 'path' not in entry:
+                raise SystemExit(f"{path}:{number}: trace entries need 'method' and 'path'")
+            trace.append(entry)
+    return trace
+
+
+def write_trace(path: str, trace):
+    with open(path, 'w') as f:
+        for entry in trace:
+            f.write(json.dumps(entry) + '\n')
+
+
+# ---------------------------------------------------------------------------
+# Replay
+# ---------------------------------------------------------------------------
+
+def _flat_routes(routes):
+    for route in routes:
+        # Included routers are wrapped by newer FastAPI versions
+        included = getattr(route, 'original_router', None)
+        if included is not None:
+            yield from _flat_routes(included.routes)
+        else:
+            yield route
+
+
+def route_label(app, method: str, path: str) -> str:
+    """Route template for a request path, so /products/a and /products/b group together"""
+    for route in _flat_routes(app.routes):
+        regex = getattr(route, 'path_regex', None)
+        if regex is not None and regex.match(path) and method in getattr(route, 'methods', {method}):
+            return f"{method} {route.path}"
+    return f"{method} {path}"
+
+
+async def replay(app, trace, concurrency: int):
+    """Send every trace entry through the ASGI app with ``concurrency`` clients"""
+    import httpx
+
+    labels = [route_label(app, entry['method'].upper(), entry['path']) for entry in trace]
+    latencies = {label: [] for label in labels}
+    errors = {}
+    position = iter(range(len(trace)))
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+        async def worker():
+            for index in position:
+                entry = trace[index]
+                started = time.perf_counter()
+                response = await client.request(
+                    entry['method'].upper(), entry['path'],
+                    json=entry.get('json'), params=entry.get('params')
+                )
+                latencies[labels[index]].append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors[labels[index]] = errors.get(labels[index], 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+        elapsed = time.perf_counter() - started
+
+    endpoints = {label: percentile_summary(values) for label, values in sorted(latencies.items())}
+    for label, count in errors.items():
+        endpoints[label]['errors'] = count
+    return {
+        'requests': len(trace),
+        'concurrency': concurrency,
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(trace) / elapsed, 1) if elapsed else None,
+        'endpoints': endpoints,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Direct service timings
+# ---------------------------------------------------------------------------
+
+def time_call(function, arguments, repeat: int):
+    latencies = []
+    for index in range(repeat):
+        started = time.perf_counter()
+        function(*arguments[index % len(arguments)])
+        latencies.append(time.perf_counter() - started)
+    return percentile_summary(latencies)
+
+
+def time_services(ml_services, interaction_services, product_ids, user_ids, repeat: int, seed: int = 0):
+    """Latency of each public service method, called directly without HTTP"""
+    from src.models.models import ProductViewInteraction, SearchInteraction
+
+    rng = random.Random(seed)
+    products = [rng.choice(product_ids) for _ in range(64)]
+    users = [rng.choice(user_ids) for _ in range(64)]
+    queries = [rng.choice(SEARCH_TERMS) for _ in range(64)]
+    # Cache misses for search: every call sees a query it has not seen before
+    fresh_queries = [f"{rng.choice(SEARCH_TERMS)} {rng.choice(SEARCH_TERMS)} {index}" for index in range(repeat)]
+    fresh_batches = [
+        [f"{rng.choice(SEARCH_TERMS)} batch {index} {position}" for position in range(16)]
+        for index in range(max(1, repeat // 10))
+    ]
+    # Warm the cache so the cached timings only see hits
+    for query in set(queries):
+        ml_services.search_products(query, 10)
+
+    ml = {
+        'search_products (cached)': time_call(ml_services.search_products, [(query, 10) for query in queries], repeat),
+        'search_products (uncached)': time_call(ml_services.search_products, [(query, 10) for query in fresh_queries], repeat),
+        'search_products_batch': time_call(ml_services.search_products_batch, [(batch, 10) for batch in fresh_batches], len(fresh_batches)),
+        'get_recommendations': time_call(ml_services.get_recommendations, [(user, 10) for user in users], repeat),
+        'get_recommendations_batch': time_call(ml_services.get_recommendations_batch, [(users[:16], 10)], max(1, repeat // 10)),
+        'get_trending_products': time_call(ml_services.get_trending_products, [(7, 10)], repeat),
+        'get_similar_products': time_call(ml_services.get_similar_products, [(product, 5) for product in products], repeat),
+    }
+    views = [
+        (ProductViewInteraction(user_id=user, product_id=product, interaction_type='view', metadata={'source': 'benchmark'}),)
+        for user, product in zip(users, products)
+    ]
+    searches = [(SearchInteraction(user_id=user, interaction_type='search', metadata={'query': 'laptop'}),) for user in users]
+    bulk = '\n'.join(
+        json.dumps({'user_id': user, 'product_id': product, 'interaction_type': 'view'})
+        for user, product in zip(users, products)
+    ).encode('utf-8')
+    interactions = {
+        'track_product_view': time_call(interaction_services.track_product_view, views, repeat),
+        'track_search': time_call(interaction_services.track_search, searches, repeat),
+        'track_batch (64 events)': time_call(interaction_services.track_batch, [(bulk,)], max(1, repeat // 10)),
+        'get_user_interactions': time_call(interaction_services.get_user_interactions, [(user, 50) for user in users], repeat),
+        'get_product_interactions': time_call(interaction_services.get_product_interactions, [(product, 50) for product in products], repeat),
+    }
+    return {'MLServices': ml, 'InteractionServices': interactions}
+
+
+# ---------------------------------------------------------------------------
+# Runs
+# ---------------------------------------------------------------------------
+
+def run_once(args, label: str):
+    """Load the app's services in the current directory, then replay and time them"""
+    from api_server_refactored import app
+    from src.api import api_routes
+    from src.startup import startup_report
+
+    api_routes.close_services()
+    api_routes.services_ready.clear()
+    started = time.perf_counter()
+    api_routes.load_services()
+    load_seconds = time.perf_counter() - started
+    if not api_routes.services_ready.is_set():
+        raise SystemExit(f"Services failed to load: {api_routes.startup_error}")
+
+    catalog = api_routes.data_manager.catalog
+    product_ids = list(catalog.ids)
+    user_ids = list(api_routes.data_manager.interaction_index.by_user.keys()) or ['1']
+
+    if args.trace:
+        trace = read_trace(args.trace)
+    else:
+        trace = synthesize_trace(args.requests, product_ids, user_ids, args.seed)
+        if args.write_trace:
+            write_trace(args.write_trace, trace)
+            print(f"Trace written: {args.write_trace} ({len(trace)} requests)")
+
+    result = {
+        'products': len(catalog),
+        'interactions': len(api_routes.data_manager.interaction_index.records),
+        'load_seconds': round(load_seconds, 3),
+        'startup': startup_report.as_dict(),
+    }
+    if not args.skip_methods:
+        print(f"[{label}] Timing service methods ({args.repeat} calls each)...")
+        result['methods'] = time_services(
+            api_routes.ml_services, api_routes.interaction_services, product_ids, user_ids, args.repeat, args.seed
+        )
+    print(f"[{label}] Replaying {len(trace)} requests with concurrency {args.concurrency}...")
+    result['replay'] = asyncio.run(replay(app, trace, args.concurrency))
+    # Events tracked during the run are only queued; write them to this run's log
+    api_routes.close_services()
+    return result
+
+
+def print_result(label: str, result):
+    print(f"\n=== {label}: {result['products']} products, {result['interactions']} interactions, "
+          f"loaded in {result['load_seconds']}s ===")
+    for group, methods in result.get('methods', {}).items():
+        print(f"\n  {group}")
+        for name, summary in methods.items():
+            print(f"    {name:<32} p50 {summary['p50_ms']:>9.3f} ms  p95 {summary['p95_ms']:>9.3f} ms  p99 {summary['p99_ms']:>9.3f} ms")
+    replay_result = result['replay']
+    print(f"\n  Replay: {replay_result['requests']} requests in {replay_result['elapsed_seconds']}s "
+          f"({replay_result['throughput_rps']} req/s, concurrency {replay_result['concurrency']})")
+    for label, summary in replay_result['endpoints'].items():
+        errors = f"  errors {summary['errors']}" if summary.get('errors') else ''
+        print(f"    {label:<40} n {summary['count']:>6}  p50 {summary['p50_ms']:>9.3f} ms  "
+              f"p95 {summary['p95_ms']:>9.3f} ms  p99 {summary['p99_ms']:>9.3f} ms{errors}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process benchmark for KMart ML API")
+    parser.add_argument('--trace', help="JSONL request trace to replay (default: synthesize one)")
+    parser.add_argument('--write-trace', help="Save the synthesized trace to this file")
+    parser.add_argument('--requests', type=int, default=2000, help="Requests in a synthesized trace")
+    parser.add_argument('--concurrency', type=int, default=16, help="Concurrent in-process clients")
+    parser.add_argument('--repeat', type=int, default=200, help="Calls per service method")
+    parser.add_argument('--scales', default='', help="Comma-separated synthetic table sizes, e.g. 10000,100000,1000000")
+    parser.add_argument('--skip-methods', action='store_true', help="Only replay the trace")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write all results to this JSON file")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(',') if scale.strip()]
+    results = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'runs': {},
+    }
+
+    original_dir = os.getcwd()
+    if not scales:
+        os.chdir(REPO_DIR)
+        # Benchmark interactions go to a scratch log, never to the repository's data
+        from src.data import data_manager as data_manager_module
+        scratch = tempfile.mkdtemp(prefix='kmart-bench-log-')
+        log_copy = os.path.join(scratch, 'interactions.csv')
+        if os.path.exists(data_manager_module.INTERACTION_LOG_PATH):
+            shutil.copyfile(data_manager_module.INTERACTION_LOG_PATH, log_copy)
+        data_manager_module.INTERACTION_LOG_PATH = log_copy
+        try:
+            results['runs']['repository data'] = run_once(args, 'repository data')
+            print_result('repository data', results['runs']['repository data'])
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+            os.chdir(original_dir)
+
+    for scale in scales:
+        label = f"{scale} rows"
+        print(f"\n[{label}] Synthesizing catalog and interactions...")
+        workdir = prepare_workdir(scale, args.seed)
+        os.chdir(workdir)
+        try:
+            results['runs'][label] = run_once(args, label)
+            print_result(label, results['runs'][label])
+        finally:
+            os.chdir(original_dir)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
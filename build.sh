@@ -11,4 +11,30 @@ python -m pip install --upgrade pip setuptools wheel
 echo "Installing dependencies..."
 pip install -r requirements.txt --verbose
 
+# Typed Parquet copy of the product catalog, loaded instead of parsing the CSV
+echo "Converting product catalog to Parquet..."
+python -m src.data.catalog
+
+# Fit the TF-IDF search index now so workers load it instead of refitting
+echo "Building TF-IDF artifact..."
+python -m src.services.tfidf_index
+
+# Quantized copy of the product embeddings, when the service is set to scan one
+if [ "${KMART_EMBEDDING_PRECISION:-float32}" != "float32" ]; then
+    echo "Quantizing product embeddings to ${KMART_EMBEDDING_PRECISION}..."
+    python -m src.data.embedding_store --precision "${KMART_EMBEDDING_PRECISION}"
+fi
+
+# IVF index for approximate similar-product search on large catalogs
+echo "Building ANN index..."
+python -m src.data.ann_index --if-needed
+
+# Top-N recommendations per user, served without scoring on the request path
+echo "Materializing recommendations..."
+python -m src.services.materialized_recommendations
+
+# Publish the worker-shared arrays now; workers attach to them in the background at start
+echo "Building shared state..."
+KMART_SHARED_STATE_DIR=${KMART_SHARED_STATE_DIR:-.shared_state} python -m src.data.shared_state
+
 echo "Build completed successfully!" 
\ No newline at end of file
@@ -2,61 +2,222 @@
 API routes for KMart ML API
 """
 
-from fastapi import APIRouter, HTTPException
+import importlib
+import secrets
+import threading
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
 from typing import List
 from src.models.models import (
     RecommendationRequest, SearchRequest, ProductRecommendation, SearchResult,
-    TrendingProduct, SimilarProduct, ProductViewInteraction, FavoritesInteraction,
-    CartInteraction, ChatInteraction, ReviewInteraction, SearchInteraction, InteractionResponse
+    BatchRecommendationRequest, BatchSearchRequest, BatchRecommendationResult, BatchSearchResult,
+    TrendingProduct, SimilarProduct, AlsoInteractedProduct, ProductViewInteraction, FavoritesInteraction,
+    CartInteraction, ChatInteraction, ReviewInteraction, SearchInteraction, InteractionResponse,
+    BatchInteractionResponse
 )
-from src.services.ml_services import MLServices
-from src.services.interaction_services import InteractionServices
+from src.startup import startup_report
+from src.metrics import registry
+from src.api.responses import RawJSONResponse
+from src.api.profiling import ProfilingRoute, list_profiles, profile_summary
+from src import config
 
-router = APIRouter()
+# Profiling wraps every endpoint, so routes only use it when it is switched on
+router = APIRouter(route_class=ProfilingRoute) if config.PROFILING_ENABLED else APIRouter()
 
-# Global services (will be initialized in main app)
+# Global services (initialized by load_services once the app has started)
+data_manager = None
 ml_services = None
 interaction_services = None
+# Set once every service is loaded; /ready and the readiness gate check it
+services_ready = threading.Event()
+startup_error = None
+
+ADMIN_TOKEN_HEADER = "X-KMart-Admin-Token"
+
+# Third-party modules behind the services, imported (and timed) on the load path only
+HEAVY_MODULES = ["numpy", "pandas", "scipy.sparse", "sklearn.feature_extraction.text"]
 
 def init_services(data_manager):
     """Initialize services with data manager"""
     global ml_services, interaction_services
+    from src.services.ml_services import MLServices
+    from src.services.interaction_services import InteractionServices
     ml_services = MLServices(data_manager)
     interaction_services = InteractionServices(data_manager)
 
+def load_services():
+    """Import the ML stack, load every artifact and log the startup report"""
+    global data_manager, startup_error
+    try:
+        for module in HEAVY_MODULES:
+            with startup_report.phase('import', module):
+                importlib.import_module(module)
+        with startup_report.phase('import', 'src.data.data_manager'):
+            from src.data.data_manager import DataManager
+        with startup_report.phase('import', 'src.services'):
+            importlib.import_module('src.services.ml_services')
+            importlib.import_module('src.services.interaction_services')
+        
+        manager = DataManager()
+        manager.load_models()
+        init_services(manager)
+        data_manager = manager
+        if config.CATALOG_WATCH_SECONDS > 0:
+            manager.watch_catalog(config.CATALOG_WATCH_SECONDS)
+        startup_report.mark_ready()
+        services_ready.set()
+    except Exception as e:
+        startup_error = str(e)
+        print(f"Error loading services: {e}")
+    finally:
+        startup_report.log()
+
+def close_services():
+    """Write queued interactions before the worker exits"""
+    if data_manager is not None:
+        data_manager.close()
+
 @router.get("/")
 def read_root():
     return {"message": "KMart ML API is running!"}
 
-@router.post("/recommendations", response_model=List[ProductRecommendation])
+@router.get("/health")
+def health_check():
+    """Liveness: the process is up, whether or not models have loaded"""
+    return {"status": "ok"}
+
+@router.get("/ready")
+def readiness_check():
+    """Readiness: 200 once models are loaded, 503 while loading or after a failed load"""
+    if services_ready.is_set():
+        # Appends keep being retried, so a failing log is reported but keeps the worker ready
+        return {
+            "status": "ready",
+            "startup": startup_report.as_dict(),
+            "interaction_log": data_manager.interaction_writer.status()
+        }
+    if startup_error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "detail": startup_error})
+    return JSONResponse(status_code=503, content={"status": "loading"})
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Request counts, latency histograms and service stage timers in Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/debug/profiles")
+def get_profiles(request: Request, limit: int = 50):
+    """Most recent request profiles, newest first (requires KMART_PROFILING_ENABLED and the admin token)"""
+    _require_profile_access(request, limit)
+    return {"profiles": list_profiles(limit)}
+
+@router.get("/debug/profiles/{profile_id}")
+def get_profile_summary(request: Request, profile_id: str, limit: int = 30):
+    """Top functions of a saved request profile by cumulative time"""
+    _require_profile_access(request, limit)
+    summary = profile_summary(profile_id, limit)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return summary
+
+def _require_profile_access(request: Request, limit: int):
+    """Profiles name source files and functions, so reading them takes the admin token"""
+    if not config.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    _require_admin(request)
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+
+def _require_admin(request: Request):
+    """404 unless admin endpoints are enabled, 403 unless the request carries the admin token"""
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    token = request.headers.get(ADMIN_TOKEN_HEADER, "")
+    if not secrets.compare_digest(token, config.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@router.post("/admin/catalog/reload")
+def reload_catalog(request: Request, force: bool = False):
+    """Reload the product catalog and its indexes in the background, without a restart"""
+    _require_admin(request)
+    started = data_manager.reload_catalog_in_background(force)
+    return JSONResponse(status_code=202, content={"started": started, "status": data_manager.reload_status})
+
+@router.get("/admin/catalog/reload")
+def get_catalog_reload_status(request: Request):
+    """Status of the last catalog reload and the catalog currently being served"""
+    _require_admin(request)
+    snapshot = data_manager.snapshot
+    return {
+        "status": data_manager.reload_status,
+        "catalog": {
+            "version": snapshot.version,
+            "fingerprint": snapshot.fingerprint,
+            "products": len(snapshot.catalog)
+        }
+    }
+
+@router.post("/recommendations", response_model=List[ProductRecommendation], response_class=RawJSONResponse)
 def get_recommendations(request: RecommendationRequest):
     """Get product recommendations for a user"""
     try:
-        return ml_services.get_recommendations(request.user_id, request.num_recommendations)
+        return RawJSONResponse(ml_services.recommendations_json(request.user_id, request.num_recommendations))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/search", response_model=List[SearchResult])
+@router.post("/recommendations/batch", response_model=List[BatchRecommendationResult], response_class=RawJSONResponse)
+def get_recommendations_batch(request: BatchRecommendationRequest):
+    """Get recommendations for several users in one call, in request order"""
+    try:
+        return RawJSONResponse(ml_services.recommendations_batch_json(request.user_ids, request.num_recommendations))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/search", response_model=List[SearchResult], response_class=RawJSONResponse)
 def search_products(request: SearchRequest):
     """Search products using semantic search"""
     try:
-        return ml_services.search_products(request.query, request.num_results)
+        return RawJSONResponse(ml_services.search_products_json(request.query, request.num_results))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/search/batch", response_model=List[BatchSearchResult], response_class=RawJSONResponse)
+def search_products_batch(request: BatchSearchRequest):
+    """Run several searches in one call, in request order"""
+    try:
+        return RawJSONResponse(ml_services.search_products_batch_json(request.queries, request.num_results))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/trending", response_model=List[TrendingProduct])
+@router.get("/search/cache-stats")
+def get_search_cache_stats():
+    """Hit/miss counters and occupancy of the search result cache"""
+    return ml_services.search_cache.stats()
+
+@router.get("/trending", response_model=List[TrendingProduct], response_class=RawJSONResponse)
 def get_trending_products(days: int = 7, limit: int = 10):
     """Get trending products based on recent interactions"""
     try:
-        return ml_services.get_trending_products(days, limit)
+        return RawJSONResponse(ml_services.trending_products_json(days, limit))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/similar-products/{product_id}", response_model=List[SimilarProduct])
+@router.get("/similar-products/{product_id}", response_model=List[SimilarProduct], response_class=RawJSONResponse)
 def get_similar_products(product_id: str, limit: int = 5):
     """Get similar products based on product embeddings"""
     try:
-        return ml_services.get_similar_products(product_id, limit)
+        return RawJSONResponse(ml_services.similar_products_json(product_id, limit))
+    except Exception as e:
+        if "Product not found" in str(e):
+            raise HTTPException(status_code=404, detail="Product not found")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/also-interacted/{product_id}", response_model=List[AlsoInteractedProduct], response_class=RawJSONResponse)
+def get_also_interacted(product_id: str, limit: int = 10):
+    """Products that users who viewed, liked or carted this one also interacted with"""
+    try:
+        return RawJSONResponse(ml_services.also_interacted_json(product_id, limit))
     except Exception as e:
         if "Product not found" in str(e):
             raise HTTPException(status_code=404, detail="Product not found")
@@ -147,6 +308,15 @@ def track_search_interaction(interaction: SearchInteraction):
             raise HTTPException(status_code=400, detail=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/interactions/batch", response_model=BatchInteractionResponse)
+async def track_interaction_batch(request: Request):
+    """Track a newline-delimited JSON body of mixed interactions in one append"""
+    payload = await request.body()
+    try:
+        return await run_in_threadpool(interaction_services.track_batch, payload)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/interactions/user/{user_id}")
 def get_user_interactions(user_id: str, limit: int = 50):
     """Get all interactions for a specific user"""
@@ -176,6 +346,7 @@ def user_interactions_endpoint():
             "chat": "POST /interactions/chat",
             "review": "POST /interactions/review",
             "search": "POST /interactions/search",
+            "batch": "POST /interactions/batch",
             "get_user_interactions": "GET /interactions/user/{user_id}",
             "get_product_interactions": "GET /interactions/product/{product_id}"
         }
@@ -0,0 +1,229 @@
+"""
+Opt-in request profiling for KMart ML API
+
+With ``KMART_PROFILING_ENABLED`` set, every route is built from
+``ProfilingRoute``. A request is profiled when it carries an
+``X-KMart-Profile`` header equal to ``KMART_PROFILE_TOKEN`` (the header is
+ignored while no token is set) or is picked by ``KMART_PROFILE_SAMPLE_RATE``;
+its endpoint function then runs under cProfile in the thread that executes
+it, so pandas, Pydantic and sklearn calls made by the services all show up.
+An async endpoint is profiled from its call to its return, so its profile
+also includes whatever other tasks the event loop runs while it awaits.
+Before Python 3.12 cProfile only sees the thread that enabled it, so work
+an async endpoint hands to the thread pool is missing; since 3.12 it sees
+every thread, so work of requests running at the same time can appear.
+
+Profiles are written to ``KMART_PROFILE_DIR`` as ``.pstats`` dumps (open
+them with ``python -m pstats`` or snakeviz), of which the newest
+``KMART_PROFILE_MAX_KEPT`` are kept, and the response names the profile in
+an ``X-KMart-Profile-Id`` header.
+
+With profiling disabled, routes are plain ``APIRoute`` objects and nothing
+here runs.
+"""
+
+import contextvars
+import cProfile
+import functools
+import hmac
+import inspect
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from itertools import count
+from typing import Any, Dict, List, Optional
+
+from fastapi.routing import APIRoute
+
+from src import config
+
+PROFILE_HEADER = "X-KMart-Profile"
+PROFILE_ID_HEADER = "X-KMart-Profile-Id"
+PROFILE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+# Capture for the request being handled, visible in the threadpool thread
+# that runs a sync endpoint because Starlette copies the context there
+_active_capture = contextvars.ContextVar("kmart_profile_capture", default=None)
+# cProfile allows a single active profiler per interpreter; requests that
+# arrive while one is running are served unprofiled
+_profiler_lock = threading.Lock()
+_sequence = count()
+
+
+class ProfileCapture:
+    """Profiles one endpoint call and saves it under the profile directory"""
+
+    def __init__(self, route_path: str):
+        self.route_path = route_path
+        self.profile_id: Optional[str] = None
+
+    def run_sync(self, function, args, kwargs):
+        if not _profiler_lock.acquire(blocking=False):
+            return function(*args, **kwargs)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.disable()
+                self._save(profiler, time.perf_counter() - started)
+        finally:
+            _profiler_lock.release()
+
+    async def run_async(self, function, args, kwargs):
+        if not _profiler_lock.acquire(blocking=False):
+            return await function(*args, **kwargs)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            # Stays enabled across awaits: other tasks on the loop are included
+            profiler.enable()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                profiler.disable()
+                self._save(profiler, time.perf_counter() - started)
+        finally:
+            _profiler_lock.release()
+
+    def _save(self, profiler, seconds: float):
+        route = re.sub(r"[^A-Za-z0-9]+", "-", self.route_path).strip("-") or "root"
+        profile_id = (
+            f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{route}_"
+            f"{int(seconds * 1000)}ms_{os.getpid()}_{next(_sequence)}"
+        )
+        try:
+            os.makedirs(config.PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(config.PROFILE_DIR, f"{profile_id}.pstats"))
+            self.profile_id = profile_id
+        except OSError as e:
+            print(f"Warning: Could not write request profile: {e}")
+            return
+        _prune_profiles(config.PROFILE_MAX_KEPT)
+
+
+def _profiled(endpoint):
+    """Wrap an endpoint so it runs under the request's capture, if any"""
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            capture = _active_capture.get()
+            if capture is None:
+                return await endpoint(*args, **kwargs)
+            return await capture.run_async(endpoint, args, kwargs)
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def sync_wrapper(*args, **kwargs):
+        capture = _active_capture.get()
+        if capture is None:
+            return endpoint(*args, **kwargs)
+        return capture.run_sync(endpoint, args, kwargs)
+    return sync_wrapper
+
+
+def should_profile(request) -> bool:
+    """Header-requested with the configured token, or sampled"""
+    requested = request.headers.get(PROFILE_HEADER)
+    if requested and config.PROFILE_TOKEN:
+        return hmac.compare_digest(requested.encode(), config.PROFILE_TOKEN.encode())
+    return config.PROFILE_SAMPLE_RATE > 0 and random.random() < config.PROFILE_SAMPLE_RATE
+
+
+class ProfilingRoute(APIRoute):
+    """APIRoute that profiles the endpoint call of selected requests"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        route_path = self.path
+
+        async def profiling_handler(request):
+            if not should_profile(request):
+                return await handler(request)
+            capture = ProfileCapture(route_path)
+            token = _active_capture.set(capture)
+            try:
+                response = await handler(request)
+            finally:
+                _active_capture.reset(token)
+            if capture.profile_id is not None:
+                response.headers[PROFILE_ID_HEADER] = capture.profile_id
+            return response
+
+        return profiling_handler
+
+
+def _short_path(filename: str) -> str:
+    """Library paths from their package down, repository paths relative to the repository"""
+    if "site-packages" + os.sep in filename:
+        return filename.split("site-packages" + os.sep, 1)[1]
+    if filename.startswith(os.sep):
+        return os.path.relpath(filename)
+    return filename
+
+
+def _profile_paths() -> List[str]:
+    """Paths of the saved profiles, newest first"""
+    try:
+        names = [name for name in os.listdir(config.PROFILE_DIR) if name.endswith(".pstats")]
+    except OSError:
+        return []
+    modified = {}
+    for name in names:
+        path = os.path.join(config.PROFILE_DIR, name)
+        try:
+            modified[path] = os.path.getmtime(path)
+        except OSError:
+            continue  # removed by another worker meanwhile
+    return sorted(modified, key=modified.get, reverse=True)
+
+
+def _prune_profiles(keep: int):
+    """Remove all but the newest ``keep`` saved profiles"""
+    if keep <= 0:
+        return
+    for path in _profile_paths()[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def list_profiles(limit: int = 50) -> List[str]:
+    """Ids of the most recent saved profiles, newest first"""
+    return [os.path.basename(path)[:-len(".pstats")] for path in _profile_paths()[:max(limit, 0)]]
+
+
+def profile_summary(profile_id: str, limit: int = 30) -> Optional[Dict[str, Any]]:
+    """Top functions of a saved profile by cumulative time, or None if it does not exist"""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    path = os.path.join(config.PROFILE_DIR, f"{profile_id}.pstats")
+    if not os.path.exists(path):
+        return None
+
+    stats = pstats.Stats(path)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return {
+        "profile_id": profile_id,
+        "total_seconds": round(stats.total_tt, 6),
+        "calls": stats.total_calls,
+        "functions": [
+            {
+                "function": f"{_short_path(filename)}:{line}({name})",
+                "calls": primitive_calls if primitive_calls == total_calls else f"{total_calls}/{primitive_calls}",
+                "own_seconds": round(own_time, 6),
+                "cumulative_seconds": round(cumulative_time, 6),
+            }
+            for (filename, line, name), (primitive_calls, total_calls, own_time, cumulative_time, _) in rows
+        ],
+    }
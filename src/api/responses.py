@@ -0,0 +1,18 @@
+"""
+Response classes for KMart ML API
+"""
+
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+
+class RawJSONResponse(JSONResponse):
+    """JSON body that is already encoded, sent as is.
+
+    Routes returning it skip ``response_model`` validation and
+    re-serialization; ``response_model`` still documents the schema.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return content.encode("utf-8") if isinstance(content, str) else content
@@ -0,0 +1,84 @@
+"""
+Runtime settings for KMart ML API, read from environment variables
+"""
+
+import os
+
+# "embeddings" answers /similar-products from product_embeddings.npy,
+# "heuristic" keeps the category/price scoring for every product
+SIMILAR_PRODUCTS_MODE = os.getenv("KMART_SIMILAR_PRODUCTS_MODE", "embeddings")
+
+# Precision of the embeddings scanned by /similar-products: "float32" reads
+# product_embeddings.npy, "float16" or "int8" read the quantized copy written
+# by `python -m src.data.embedding_store`, rescoring the best
+# limit * KMART_EMBEDDING_RESCORE_FACTOR candidates at full precision
+EMBEDDING_PRECISION = os.getenv("KMART_EMBEDDING_PRECISION", "float32")
+EMBEDDING_RESCORE_FACTOR = int(os.getenv("KMART_EMBEDDING_RESCORE_FACTOR", "4"))
+
+# Approximate nearest-neighbour search for /similar-products: with at least
+# KMART_ANN_MIN_CATALOG_SIZE embedded products, the IVF index written by
+# `python -m src.data.ann_index` is used and KMART_ANN_PROBES lists are scanned
+ANN_MIN_CATALOG_SIZE = int(os.getenv("KMART_ANN_MIN_CATALOG_SIZE", "100000"))
+ANN_PROBES = int(os.getenv("KMART_ANN_PROBES", "16"))
+
+# Item-item co-interaction model: neighbours kept per product, pending
+# incremental updates before they are folded into a new sparse base, and the
+# weight of co-interaction in /similar-products (0 keeps content similarity only)
+CO_INTERACTION_NEIGHBOURS = int(os.getenv("KMART_CO_INTERACTION_NEIGHBOURS", "50"))
+CO_INTERACTION_COMPACT_AFTER = int(os.getenv("KMART_CO_INTERACTION_COMPACT_AFTER", "10000"))
+SIMILAR_PRODUCTS_CO_INTERACTION_WEIGHT = float(os.getenv("KMART_SIMILAR_PRODUCTS_CO_INTERACTION_WEIGHT", "0.3"))
+
+# Precomputed recommendations written by
+# `python -m src.services.materialized_recommendations` (empty disables them):
+# items kept per user, and the age in seconds after which entries are scored
+# live again (0: only a changed catalog or model makes them stale)
+MATERIALIZED_RECS_DIR = os.getenv("KMART_MATERIALIZED_RECS_DIR", "artifacts/recommendations")
+MATERIALIZED_RECS_TOP_N = int(os.getenv("KMART_MATERIALIZED_RECS_TOP_N", "50"))
+MATERIALIZED_RECS_MAX_AGE_SECONDS = float(os.getenv("KMART_MATERIALIZED_RECS_MAX_AGE_SECONDS", "0"))
+
+# Concurrent identical /recommendations, /search and /trending calls share one
+# computation instead of each recomputing it
+SINGLE_FLIGHT_ENABLED = os.getenv("KMART_SINGLE_FLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# /search result cache: entry count, estimated size in bytes and time-to-live
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("KMART_SEARCH_CACHE_MAX_ENTRIES", "1024"))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("KMART_SEARCH_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("KMART_SEARCH_CACHE_TTL_SECONDS", "300"))
+
+# Saved interactions are appended to the log on a background thread once this
+# many rows are waiting or the oldest has waited this many seconds
+INTERACTION_LOG_BATCH_SIZE = int(os.getenv("KMART_INTERACTION_LOG_BATCH_SIZE", "100"))
+INTERACTION_LOG_FLUSH_SECONDS = float(os.getenv("KMART_INTERACTION_LOG_FLUSH_SECONDS", "1.0"))
+
+# Threads available to the sync route handlers (anyio's default is 40); the
+# data layer publishes snapshots, so readers never block on writers
+THREADPOOL_SIZE = int(os.getenv("KMART_THREADPOOL_SIZE", "0")) or None
+
+# Directory for memory-mapped state shared by all worker processes (catalog
+# numeric arrays, TF-IDF matrix); empty keeps a private copy in every worker.
+# Text columns, search indexes and all interaction state stay per worker
+# (see src.data.shared_state)
+SHARED_STATE_DIR = os.getenv("KMART_SHARED_STATE_DIR", "")
+
+# Directory for the persisted TF-IDF index, one subdirectory per catalog
+# fingerprint; empty refits TF-IDF on every start
+TFIDF_ARTIFACT_DIR = os.getenv("KMART_TFIDF_ARTIFACT_DIR", "artifacts/tfidf")
+
+# Opt-in request profiling. When enabled, requests sent with an
+# "X-KMart-Profile" header matching KMART_PROFILE_TOKEN (the header is ignored
+# while no token is set) and a random KMART_PROFILE_SAMPLE_RATE share of all
+# requests are run under cProfile, and the newest KMART_PROFILE_MAX_KEPT
+# profiles are kept in KMART_PROFILE_DIR (0 keeps them all)
+PROFILING_ENABLED = os.getenv("KMART_PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("KMART_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("KMART_PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("KMART_PROFILE_DIR", "profiles")
+PROFILE_MAX_KEPT = int(os.getenv("KMART_PROFILE_MAX_KEPT", "200"))
+
+# Hot catalog reload: seconds between checks of the product files for changes
+# (0 disables watching; POST /admin/catalog/reload works either way), the
+# largest share of appended products still handled incrementally, and the
+# token the admin endpoints require (empty disables them)
+CATALOG_WATCH_SECONDS = float(os.getenv("KMART_CATALOG_WATCH_SECONDS", "0"))
+CATALOG_INCREMENTAL_MAX_FRACTION = float(os.getenv("KMART_CATALOG_INCREMENTAL_MAX_FRACTION", "0.1"))
+ADMIN_TOKEN = os.getenv("KMART_ADMIN_TOKEN", "")
@@ -0,0 +1,203 @@
+"""
+Inverted-file (IVF) nearest-neighbour index over the product embeddings
+
+Rows are clustered around spherical k-means centroids; a query scores the
+centroids, then only the rows in its ``probes`` nearest lists. Build it
+offline next to the embeddings, and compare recall and latency with exact
+search for a range of probe counts:
+
+    python -m src.data.ann_index
+    python -m src.data.ann_index --report --probes 1,4,16,64
+
+The API attaches it to the embedding store once the catalog has at least
+``KMART_ANN_MIN_CATALOG_SIZE`` embedded products.
+"""
+
+import argparse
+import copy
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from typing import Optional
+
+from src import config
+
+IVF_FORMAT = 1
+# Rows per block when assigning rows to lists, bounding the score matrix
+ASSIGN_BLOCK_ROWS = 16384
+# Training rows per list; k-means runs on a sample, every row is then assigned
+TRAINING_ROWS_PER_LIST = 64
+
+
+def ivf_path(embeddings_path: str) -> str:
+    """Index directory for an embedding file"""
+    base = embeddings_path[:-len('.npy')] if embeddings_path.endswith('.npy') else embeddings_path
+    return f"{base}.ivf"
+
+
+def default_list_count(num_rows: int) -> int:
+    """About 4 * sqrt(rows) lists, the usual IVF starting point"""
+    return int(min(max(round(4 * np.sqrt(num_rows)), 1), max(num_rows, 1)))
+
+
+def _unit_rows(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def assign_lists(vectors, centroids) -> np.ndarray:
+    """Nearest centroid (by cosine) of every row, computed block by block"""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+        block = _unit_rows(vectors[start:start + ASSIGN_BLOCK_ROWS])
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(vectors, num_lists: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of the rows; unit-length centroids"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), num_lists * TRAINING_ROWS_PER_LIST)
+    sample = _unit_rows(vectors[np.sort(rng.choice(len(vectors), size=sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, size=num_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = assign_lists(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=num_lists)
+        # Empty lists restart from a random training row
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = sample[rng.choice(sample_size, size=len(empty))]
+        centroids = _unit_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """Coarse centroids plus the rows of each list, stored contiguously.
+
+    ``list_rows[list_offsets[i]:list_offsets[i + 1]]`` are the embedding
+    rows assigned to centroid ``i``.
+    """
+
+    def __init__(self, centroids, list_offsets, list_rows):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+
+    def __len__(self):
+        return len(self.list_rows)
+
+    @property
+    def num_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, num_lists: Optional[int] = None, iterations: int = 10, seed: int = 0) -> "IVFIndex":
+        num_lists = num_lists or default_list_count(len(vectors))
+        centroids = train_centroids(vectors, num_lists, iterations, seed)
+        labels = assign_lists(vectors, centroids)
+        list_rows = np.argsort(labels, kind='stable').astype(np.int64)
+        list_offsets = np.zeros(num_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=num_lists), out=list_offsets[1:])
+        return cls(centroids.astype(np.float32), list_offsets, list_rows)
+
+    def candidates(self, query, probes: int) -> np.ndarray:
+        """Rows of the ``probes`` lists whose centroids are nearest a unit query vector"""
+        probes = min(probes, self.num_lists)
+        centroid_scores = self.centroids @ np.asarray(query, dtype=np.float32)
+        nearest = np.argpartition(-centroid_scores, probes - 1)[:probes]
+        return np.concatenate([
+            self.list_rows[self.list_offsets[position]:self.list_offsets[position + 1]]
+            for position in nearest
+        ])
+
+    def save(self, directory: str):
+        """Write the index directory atomically"""
+        parent = os.path.dirname(os.path.abspath(directory))
+        staging = tempfile.mkdtemp(prefix='.ivf-', dir=parent)
+        try:
+            np.save(os.path.join(staging, 'centroids.npy'), self.centroids)
+            np.save(os.path.join(staging, 'list_offsets.npy'), self.list_offsets)
+            np.save(os.path.join(staging, 'list_rows.npy'), self.list_rows)
+            with open(os.path.join(staging, 'meta.json'), 'w') as f:
+                json.dump({'format': IVF_FORMAT, 'rows': len(self), 'lists': self.num_lists}, f)
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(staging, directory)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["IVFIndex"]:
+        """Memory-map a saved index, or None if there is none in the current format"""
+        try:
+            with open(os.path.join(directory, 'meta.json')) as f:
+                meta = json.load(f)
+            if meta.get('format') != IVF_FORMAT:
+                return None
+            return cls(
+                np.load(os.path.join(directory, 'centroids.npy')),
+                np.load(os.path.join(directory, 'list_offsets.npy')),
+                np.load(os.path.join(directory, 'list_rows.npy'), mmap_mode='r')
+            )
+        except (OSError, ValueError):
+            return None
+
+
+def main():
+    """Build the IVF index for the product embeddings, or report recall per probe count"""
+    from src.data.embedding_store import EmbeddingStore, compare_to_exact
+
+    parser = argparse.ArgumentParser(description="IVF index for KMart ML API product embeddings")
+    parser.add_argument('--embeddings', default='product_embeddings.npy', help="Embedding .npy file")
+    parser.add_argument('--lists', type=int, default=0, help="Inverted lists (default: about 4 * sqrt(rows))")
+    parser.add_argument('--iterations', type=int, default=10, help="k-means iterations")
+    parser.add_argument('--report', action='store_true', help="Compare an existing index with exact search")
+    parser.add_argument('--if-needed', action='store_true',
+                        help="Skip catalogs below KMART_ANN_MIN_CATALOG_SIZE, which the API scans exactly")
+    parser.add_argument('--probes', default='1,2,4,8,16,32,64', help="Probe counts to report")
+    parser.add_argument('--k', type=int, default=10, help="Neighbours compared for recall")
+    parser.add_argument('--queries', type=int, default=200, help="Products sampled as queries")
+    args = parser.parse_args()
+
+    directory = ivf_path(args.embeddings)
+    if not os.path.exists(args.embeddings):
+        if args.if_needed:
+            print(f"Skipping ANN index: {args.embeddings} not found")
+            return
+        raise SystemExit(f"{args.embeddings} not found")
+    vectors = np.load(args.embeddings, mmap_mode='r')
+    if args.if_needed and len(vectors) < config.ANN_MIN_CATALOG_SIZE:
+        print(f"Skipping ANN index: {len(vectors)} embeddings, exact search below {config.ANN_MIN_CATALOG_SIZE}")
+        return
+    if not args.report:
+        index = IVFIndex.build(vectors, args.lists or None, args.iterations)
+        index.save(directory)
+        sizes = np.diff(index.list_offsets)
+        print(f"Wrote {directory}: {len(index)} rows in {index.num_lists} lists "
+              f"(median {int(np.median(sizes))}, largest {int(sizes.max())})")
+        return
+
+    index = IVFIndex.load(directory)
+    if index is None or len(index) != len(vectors):
+        raise SystemExit(f"No current index at {directory}; build it first")
+    # Rows stand in for product ids
+    product_ids = [str(row) for row in range(len(vectors))]
+    exact = EmbeddingStore(vectors, product_ids)
+    stores = {}
+    for probes in (int(value) for value in args.probes.split(',') if value):
+        store = copy.copy(exact)
+        store.use_ann_index(index, probes)
+        stores[f'ivf_probes_{probes}'] = store
+    rows = np.random.default_rng(0).choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+    print(f"{len(vectors)} rows, {index.num_lists} lists, recall@{args.k} vs exact float32 search")
+    for name, value in compare_to_exact(exact, stores, rows, args.k).items():
+        print(f"  {name:<32} {value}")
+
+
+if __name__ == "__main__":
+    main()
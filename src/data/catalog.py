@@ -0,0 +1,246 @@
+"""
+Columnar product catalog for KMart ML API
+"""
+
+import os
+import re
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional
+
+try:
+    import pyarrow  # noqa: F401 - pandas' Parquet engine
+except ImportError:  # pragma: no cover - CSV-only deployments
+    pyarrow = None
+
+# Typed product schema shared by the CSV and Parquet loaders
+TEXT_COLUMNS = ['id', 'name', 'description']
+PRICE_COLUMNS = ['price', 'original_price']
+CATEGORICAL_COLUMNS = ['category', 'condition', 'location']
+PRODUCT_COLUMNS = TEXT_COLUMNS + PRICE_COLUMNS + ['rating'] + CATEGORICAL_COLUMNS
+
+# Raw CSV columns the schema is built from; everything else is never parsed
+RAW_PRODUCT_COLUMNS = set(PRODUCT_COLUMNS) | {'priceAndDiscount', 'originalPrice'}
+
+
+# Currency labels and thousands separators around the digits of a price string
+PRICE_NOISE = re.compile(r'[^0-9.]')
+
+
+def parse_prices(values) -> np.ndarray:
+    """Parse prices such as ``Ugx120000``, ``UGX 1,200,000`` or ``89.99`` in one pass; NaN if unparseable.
+
+    Numbers and numeric strings are converted as they are; only the strings
+    that do not parse are stripped down to their digits.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        return pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+    prices = np.array(pd.to_numeric(series.astype(object), errors='coerce'), dtype=np.float64)
+    retry = np.isnan(prices) & np.fromiter((isinstance(value, str) for value in series), dtype=bool, count=len(series))
+    if retry.any():
+        digits = series[retry].astype(str).str.replace(PRICE_NOISE.pattern, '', regex=True)
+        prices[retry] = pd.to_numeric(digits, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    return prices
+
+
+def parse_price(value) -> float:
+    """parse_prices for a single value, without building a Series; NaN if unparseable"""
+    if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, str):
+        return float('nan')
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return float(PRICE_NOISE.sub('', value))
+    except ValueError:
+        return float('nan')
+
+
+def _text(raw_df, column: str, default: str = '') -> pd.Series:
+    if column not in raw_df.columns:
+        return pd.Series(default, index=raw_df.index, dtype=object)
+    values = raw_df[column].astype(object)
+    return values.where(values.notna(), default).astype(str).astype(object)
+
+
+def _prices(raw_df, *columns) -> np.ndarray:
+    """First parseable price among ``columns``, row by row"""
+    prices = np.full(len(raw_df), np.nan)
+    for column in columns:
+        if column in raw_df.columns:
+            prices = np.where(np.isnan(prices), parse_prices(raw_df[column]), prices)
+    return prices
+
+
+def normalize_products(raw_df: pd.DataFrame) -> pd.DataFrame:
+    """Typed product table: text as str, prices and rating as float64, labels as categoricals"""
+    # The current (discounted) price is what buyers pay; the original price is the fallback
+    prices = _prices(raw_df, 'price', 'priceAndDiscount', 'originalPrice')
+    original_prices = _prices(raw_df, 'original_price', 'originalPrice')
+    original_prices = np.where(np.isnan(original_prices), prices, original_prices)
+
+    if 'rating' in raw_df.columns:
+        ratings = pd.to_numeric(raw_df['rating'], errors='coerce').to_numpy(dtype=np.float64)
+    else:
+        ratings = np.zeros(len(raw_df))
+
+    product_df = pd.DataFrame({
+        'id': _text(raw_df, 'id'),
+        'name': _text(raw_df, 'name', 'Unknown Product'),
+        'description': _text(raw_df, 'description'),
+        'price': np.nan_to_num(prices, nan=0.0),
+        'original_price': np.nan_to_num(original_prices, nan=0.0),
+        'rating': np.nan_to_num(ratings, nan=0.0),
+        **{column: _text(raw_df, column) for column in CATEGORICAL_COLUMNS},
+    })
+    return _apply_schema(product_df.reset_index(drop=True))
+
+
+def _apply_schema(product_df: pd.DataFrame) -> pd.DataFrame:
+    """Cast to the schema's dtypes so CSV and Parquet loads hash identically"""
+    product_df = product_df[PRODUCT_COLUMNS].copy()
+    for column in TEXT_COLUMNS:
+        product_df[column] = product_df[column].astype(object)
+    for column in PRICE_COLUMNS + ['rating']:
+        product_df[column] = product_df[column].astype(np.float64)
+    for column in CATEGORICAL_COLUMNS:
+        product_df[column] = pd.Categorical(product_df[column].astype(object))
+    return product_df
+
+
+def load_products(csv_path: str, parquet_path: Optional[str] = None,
+                  columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Load the typed product table, from Parquet when it is present and not older than the CSV"""
+    use_parquet = (
+        pyarrow is not None and parquet_path is not None and os.path.exists(parquet_path)
+        and (not os.path.exists(csv_path) or os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path))
+    )
+    if use_parquet:
+        product_df = _apply_schema(pd.read_parquet(parquet_path, columns=PRODUCT_COLUMNS))
+    else:
+        product_df = normalize_products(pd.read_csv(csv_path, usecols=lambda column: column in RAW_PRODUCT_COLUMNS))
+    return product_df[columns] if columns is not None else product_df
+
+
+def write_products_parquet(product_df: pd.DataFrame, parquet_path: str):
+    """Write the typed product table as Parquet, replacing any previous file atomically"""
+    if pyarrow is None:
+        raise RuntimeError("pyarrow is required to write Parquet")
+    temporary_path = f"{parquet_path}.{os.getpid()}.tmp"
+    product_df.to_parquet(temporary_path, index=False)
+    os.replace(temporary_path, parquet_path)
+
+
+class ProductCatalog:
+    """Read-only column arrays built once from the product table.
+
+    Services score whole columns with NumPy instead of walking
+    ``product_df`` row by row.
+    """
+
+    def __init__(self, product_df: pd.DataFrame):
+        size = len(product_df)
+
+        self.ids = self._text_column(product_df, 'id', size)
+        self.names = self._text_column(product_df, 'name', size, 'Unknown Product')
+        self.descriptions = self._text_column(product_df, 'description', size)
+        self.conditions = self._text_column(product_df, 'condition', size)
+        self.locations = self._text_column(product_df, 'location', size)
+
+        self.prices = self._numeric_column(product_df, 'price', size)
+        self.original_prices = self._numeric_column(product_df, 'original_price', size)
+        self.ratings = self._numeric_column(product_df, 'rating', size)
+
+        category = product_df['category'] if 'category' in product_df.columns else None
+        if category is not None and isinstance(category.dtype, pd.CategoricalDtype) and not category.isna().any():
+            # Already coded by the loader
+            self.category_codes = category.cat.codes.to_numpy(dtype=np.int32)
+            self.categories = np.asarray(category.cat.categories.astype(object), dtype=object)
+        else:
+            codes, uniques = pd.factorize(self._text_column(product_df, 'category', size))
+            self.category_codes = codes.astype(np.int32)
+            self.categories = np.asarray(uniques, dtype=object)
+
+        # First occurrence wins, matching the old linear scan
+        self.id_to_row: Dict[str, int] = {}
+        for row, product_id in enumerate(self.ids):
+            self.id_to_row.setdefault(product_id, row)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _text_column(product_df, column, size, default=''):
+        if column not in product_df.columns:
+            return np.full(size, default, dtype=object)
+        values = product_df[column].astype(object)
+        return values.where(values.notna(), default).astype(str).to_numpy(dtype=object)
+
+    @staticmethod
+    def _numeric_column(product_df, column, size):
+        if column not in product_df.columns:
+            return np.zeros(size, dtype=np.float64)
+        values = pd.to_numeric(product_df[column], errors='coerce')
+        return values.fillna(0.0).to_numpy(dtype=np.float64)
+
+    def numeric_arrays(self) -> Dict[str, np.ndarray]:
+        """Numeric columns, as published to worker-shared state"""
+        return {
+            'prices': self.prices,
+            'original_prices': self.original_prices,
+            'ratings': self.ratings,
+            'category_codes': self.category_codes,
+        }
+
+    def use_arrays(self, arrays: Dict[str, np.ndarray]):
+        """Swap numeric columns for (memory-mapped) arrays with the same contents"""
+        for name in ('prices', 'original_prices', 'ratings', 'category_codes'):
+            if len(arrays[name]) != len(self):
+                raise ValueError(f"Shared '{name}' has {len(arrays[name])} rows, catalog has {len(self)}")
+        self.prices = arrays['prices']
+        self.original_prices = arrays['original_prices']
+        self.ratings = arrays['ratings']
+        self.category_codes = arrays['category_codes']
+
+    def row_of(self, product_id: str) -> Optional[int]:
+        """Row position of a product id, or None if unknown"""
+        return self.id_to_row.get(product_id)
+
+    def category_of(self, row: int) -> str:
+        """Category label for a row"""
+        return self.categories[self.category_codes[row]]
+
+    def record(self, row: int) -> Dict[str, Any]:
+        """Typed fields of one product, read from the column arrays"""
+        return {
+            'id': self.ids[row],
+            'name': self.names[row],
+            'description': self.descriptions[row],
+            'price': float(self.prices[row]),
+            'original_price': float(self.original_prices[row]),
+            'rating': float(self.ratings[row]),
+            'category': self.category_of(row),
+            'condition': self.conditions[row],
+            'location': self.locations[row],
+        }
+
+
+def main():
+    """Convert the product CSV to the typed Parquet file the API loads"""
+    from src.data.data_manager import PRODUCT_DATA_PATH, PRODUCT_PARQUET_PATH
+
+    if pyarrow is None:
+        raise SystemExit("Install pyarrow to write Parquet")
+    product_df = normalize_products(pd.read_csv(PRODUCT_DATA_PATH, usecols=lambda column: column in RAW_PRODUCT_COLUMNS))
+    write_products_parquet(product_df, PRODUCT_PARQUET_PATH)
+    priced = int((product_df['price'] > 0).sum())
+    print(f"Wrote {PRODUCT_PARQUET_PATH}: {len(product_df)} products, {priced} with a price")
+
+
+if __name__ == "__main__":
+    main()
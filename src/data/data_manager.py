@@ -2,18 +2,61 @@
 Data management for KMart ML API - Optimized for Render deployment
 """
 
+import hashlib
 import pickle
 import numpy as np
 import pandas as pd
 from datetime import datetime
 import os
 import json
-from typing import Dict, Any
+import threading
+import time
+import uuid
+from typing import Dict, Any, List, Optional
+from src.data.catalog import ProductCatalog, load_products, normalize_products, parse_price
+from src.data.embedding_store import EmbeddingStore, QuantizedEmbeddingStore, quantized_paths
+from src.data.ann_index import IVFIndex, ivf_path
+from src.data.factor_model import FactorModel
+from src.data.interaction_log import INTERACTION_COLUMNS, InteractionLogWriter, read_interaction_log
+from src.data.interaction_index import InteractionIndex
+from src.data.snapshot import DataSnapshot
+from src.data.shared_state import shared_state_store
+from src.startup import StartupReport, startup_report
+from src.metrics import stage
+from src import config
+
+PRODUCT_DATA_PATH = "data_csv/product_data_cleaned.csv"
+# Typed copy of the CSV written by `python -m src.data.catalog`; used when not older than the CSV
+PRODUCT_PARQUET_PATH = "data_csv/product_data_cleaned.parquet"
+INTERACTION_LOG_PATH = "data_csv/product_interactions_data_fixed.csv"
+# Exported with the models together with its row ids (product_embeddings.ids.json);
+# float16/int8 copies sit next to it (see src.data.embedding_store)
+EMBEDDINGS_PATH = "product_embeddings.npy"
+INTERACTION_CHUNK_SIZE = 1000
 
 class DataManager:
     def __init__(self):
-        self.product_df = None
-        self.interaction_df = None
+        # Current DataSnapshot; replaced as a whole, never mutated in place
+        self._snapshot = DataSnapshot()
+        # Serializes every writer: loads, saved interactions, table materialization
+        self._write_lock = threading.RLock()
+        # Rows saved since the table was last materialized, folded in as one chunk
+        self._pending_rows = []
+        self.interaction_writer = InteractionLogWriter(
+            INTERACTION_LOG_PATH,
+            batch_size=config.INTERACTION_LOG_BATCH_SIZE,
+            flush_interval=config.INTERACTION_LOG_FLUSH_SECONDS
+        )
+        self.interaction_index = InteractionIndex()
+        # Callbacks run with (record, event_time) for every saved interaction
+        self.interaction_listeners = []
+        # Builds the services' indexes for a catalog before it is published
+        self.index_builder = None
+        # One catalog reload at a time; readers and interaction writers never wait on it
+        self._reload_lock = threading.Lock()
+        self._reload_thread = None
+        self.reload_status: Dict[str, Any] = {'state': 'idle'}
+        self._watch_stop = threading.Event()
         
     def load_models(self):
         """Load all data and initialize lightweight models"""
@@ -21,31 +64,312 @@ class DataManager:
         
         try:
             # Load product data
-            if os.path.exists("data_csv/product_data_cleaned.csv"):
-                self.product_df = pd.read_csv("data_csv/product_data_cleaned.csv")
-            else:
-                # Create sample data if file doesn't exist
-                self.product_df = self._create_sample_data()
+            with startup_report.phase('load', 'product_data'):
+                product_df = self._read_products()
             
             # Load interaction data if available
-            if os.path.exists("data_csv/product_interactions_data_fixed.csv"):
-                self.interaction_df = pd.read_csv("data_csv/product_interactions_data_fixed.csv")
-                self.interaction_df['timestamp'] = pd.to_datetime(self.interaction_df['timestamp'], errors='coerce')
-            else:
-                # Create empty interaction dataframe
-                self.interaction_df = pd.DataFrame(columns=[
-                    'interactionId', 'userId', 'productId', 'interactionType', 
-                    'timestamp', 'quantity', 'value', 'rating', 'review', 
-                    'sentiment', 'socialSharePlatform', 'metadata'
-                ])
+            with startup_report.phase('load', 'interaction_log'):
+                if os.path.exists(INTERACTION_LOG_PATH):
+                    interaction_df = read_interaction_log(INTERACTION_LOG_PATH)
+                else:
+                    # Create empty interaction dataframe
+                    interaction_df = pd.DataFrame(columns=INTERACTION_COLUMNS)
+            
+            with startup_report.phase('load', 'interaction_index'):
+                interaction_index = InteractionIndex.from_dataframe(interaction_df)
+            fingerprint = self._fingerprint(product_df)
+            with startup_report.phase('load', 'catalog'):
+                catalog = self._build_catalog(product_df, fingerprint)
+            with startup_report.phase('load', 'embeddings'):
+                embedding_store = self._load_embeddings()
+            with startup_report.phase('load', 'factor_model'):
+                factor_model = self._load_factor_model(catalog)
             
             print("Models loaded successfully!")
             
         except Exception as e:
             print(f"Warning: Error loading data: {e}")
             # Create minimal sample data
-            self.product_df = self._create_sample_data()
-            self.interaction_df = pd.DataFrame()
+            product_df = normalize_products(self._create_sample_data())
+            interaction_df = pd.DataFrame(columns=INTERACTION_COLUMNS)
+            interaction_index = InteractionIndex()
+            fingerprint = self._fingerprint(product_df)
+            catalog = ProductCatalog(product_df)
+            embedding_store = None
+            factor_model = None
+        
+        with self._write_lock:
+            self._pending_rows = []
+            self.interaction_index = interaction_index
+            self._snapshot = DataSnapshot(
+                version=self._snapshot.version + 1,
+                fingerprint=fingerprint,
+                product_df=product_df,
+                catalog=catalog,
+                embedding_store=embedding_store,
+                factor_model=factor_model,
+                interaction_df=interaction_df
+            )
+        self.interaction_writer.start()
+    
+    @property
+    def snapshot(self) -> DataSnapshot:
+        """Current consistent view of the data; safe to read without locking"""
+        return self._snapshot
+    
+    def publish(self, **changes) -> DataSnapshot:
+        """Atomically replace fields of the current snapshot"""
+        with self._write_lock:
+            self._snapshot = self._snapshot.evolve(**changes)
+            return self._snapshot
+    
+    @property
+    def product_df(self):
+        return self._snapshot.product_df
+    
+    @property
+    def catalog(self):
+        return self._snapshot.catalog
+    
+    @property
+    def embedding_store(self):
+        return self._snapshot.embedding_store
+    
+    @property
+    def factor_model(self):
+        return self._snapshot.factor_model
+    
+    @property
+    def catalog_version(self):
+        """Bumped on every catalog load so caches keyed on it are dropped"""
+        return self._snapshot.version
+    
+    @property
+    def interaction_df(self):
+        """Interaction table including rows saved since it was last read"""
+        if self._pending_rows:
+            with self._write_lock:
+                self._materialize_pending()
+        return self._snapshot.interaction_df
+    
+    def _materialize_pending(self):
+        """Fold rows saved since the last read into the interaction table; caller holds _write_lock"""
+        if not self._pending_rows:
+            return
+        chunk = pd.DataFrame(self._pending_rows, columns=INTERACTION_COLUMNS)
+        chunk['timestamp'] = pd.to_datetime(chunk['timestamp'], errors='coerce')
+        current = self._snapshot.interaction_df
+        frames = [df for df in (current, chunk) if df is not None and not df.empty]
+        # concat builds a new frame, so readers of the old one are unaffected
+        self._snapshot = self._snapshot.evolve(
+            interaction_df=pd.concat(frames, ignore_index=True) if frames else chunk
+        )
+        self._pending_rows = []
+    
+    def set_index_builder(self, builder):
+        """Register ``builder(snapshot, previous, first_new_row, report)``, run for every reloaded catalog"""
+        self.index_builder = builder
+    
+    def add_interaction_listener(self, listener):
+        """Register a callback for newly saved interactions"""
+        self.interaction_listeners.append(listener)
+    
+    def close(self):
+        """Stop watching the catalog and flush queued interactions to disk"""
+        self._watch_stop.set()
+        self.interaction_writer.close()
+    
+    def _read_products(self):
+        """Typed product table from the Parquet/CSV files, or sample data if there are none"""
+        if os.path.exists(PRODUCT_DATA_PATH) or os.path.exists(PRODUCT_PARQUET_PATH):
+            return load_products(PRODUCT_DATA_PATH, PRODUCT_PARQUET_PATH)
+        # Create sample data if file doesn't exist
+        return normalize_products(self._create_sample_data())
+    
+    def reload_catalog(self, force: bool = False) -> Dict[str, Any]:
+        """Load the product files again and swap in the new catalog and everything derived from it.
+        
+        The catalog, embedding alignment, factor model and the services'
+        indexes are all built before anything is published, then replace the
+        old ones in a single snapshot swap. Requests already running keep the
+        snapshot they started with, so the old version lives until they finish.
+        """
+        with self._reload_lock:
+            started = time.perf_counter()
+            self.reload_status = {'state': 'running', 'started_at': datetime.now().isoformat()}
+            # Timed separately so reloads never overwrite the startup report
+            timings = StartupReport()
+            try:
+                previous = self._snapshot
+                with timings.phase('load', 'product_data'):
+                    product_df = self._read_products()
+                fingerprint = self._fingerprint(product_df)
+                
+                if fingerprint == previous.fingerprint and not force:
+                    mode = 'unchanged'
+                else:
+                    first_new_row = self._first_appended_row(previous.product_df, product_df)
+                    mode = 'full' if first_new_row is None else 'incremental'
+                    with timings.phase('load', 'catalog'):
+                        catalog = self._build_catalog(product_df, fingerprint)
+                    with timings.phase('load', 'embeddings'):
+                        embedding_store = self._load_embeddings()
+                    with timings.phase('load', 'factor_model'):
+                        factor_model = self._load_factor_model(catalog)
+                    fields = dict(
+                        fingerprint=fingerprint,
+                        product_df=product_df,
+                        catalog=catalog,
+                        embedding_store=embedding_store,
+                        factor_model=factor_model
+                    )
+                    candidate = previous.evolve(version=previous.version + 1, indexes=None, **fields)
+                    if self.index_builder is not None:
+                        fields['indexes'] = self.index_builder(candidate, previous, first_new_row, timings)
+                    
+                    with self._write_lock:
+                        # Built from `previous`, but the interaction table may have moved on since
+                        self._snapshot = self._snapshot.evolve(version=self._snapshot.version + 1, **fields)
+                
+                snapshot = self._snapshot
+                self.reload_status = {
+                    'state': 'done',
+                    'mode': mode,
+                    'version': snapshot.version,
+                    'fingerprint': snapshot.fingerprint,
+                    'products': len(snapshot.catalog),
+                    'seconds': round(time.perf_counter() - started, 3),
+                    'phases': timings.as_dict()['phases'],
+                    'finished_at': datetime.now().isoformat()
+                }
+            except Exception as e:
+                print(f"Warning: Catalog reload failed: {e}")
+                self.reload_status = {
+                    'state': 'failed',
+                    'error': str(e),
+                    'seconds': round(time.perf_counter() - started, 3),
+                    'finished_at': datetime.now().isoformat()
+                }
+            return self.reload_status
+    
+    def reload_catalog_in_background(self, force: bool = False) -> bool:
+        """Start reload_catalog on a background thread; False if a reload is already running"""
+        with self._write_lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return False
+            self.reload_status = {'state': 'queued'}
+            self._reload_thread = threading.Thread(
+                target=self.reload_catalog, kwargs={'force': force}, name="kmart-catalog-reload", daemon=True
+            )
+            self._reload_thread.start()
+            return True
+    
+    def watch_catalog(self, interval: float):
+        """Reload the catalog whenever the product files change, checking every ``interval`` seconds"""
+        def signature():
+            return tuple(
+                (os.path.getmtime(path), os.path.getsize(path)) if os.path.exists(path) else None
+                for path in (PRODUCT_DATA_PATH, PRODUCT_PARQUET_PATH)
+            )
+        
+        def watch():
+            loaded = seen = signature()
+            while not self._watch_stop.wait(interval):
+                current = signature()
+                if current != seen:
+                    # Still being written: wait until the files stop changing
+                    seen = current
+                    continue
+                if current != loaded:
+                    loaded = current
+                    self.reload_catalog()
+        
+        threading.Thread(target=watch, name="kmart-catalog-watch", daemon=True).start()
+    
+    @staticmethod
+    def _first_appended_row(previous_df, product_df) -> Optional[int]:
+        """Row where appended products start, if the new table only adds a few rows to the old one"""
+        if previous_df is None or list(previous_df.columns) != list(product_df.columns):
+            return None
+        appended = len(product_df) - len(previous_df)
+        if appended <= 0 or appended > config.CATALOG_INCREMENTAL_MAX_FRACTION * len(previous_df):
+            return None
+        old_rows = pd.util.hash_pandas_object(previous_df, index=False).to_numpy()
+        kept_rows = pd.util.hash_pandas_object(product_df.iloc[:len(previous_df)], index=False).to_numpy()
+        return len(previous_df) if np.array_equal(old_rows, kept_rows) else None
+    
+    @staticmethod
+    def _fingerprint(product_df) -> str:
+        """Content hash of the product table"""
+        row_hashes = pd.util.hash_pandas_object(product_df, index=False).to_numpy()
+        columns = ','.join(map(str, product_df.columns)).encode('utf-8')
+        return hashlib.sha256(columns + row_hashes.tobytes()).hexdigest()[:16]
+    
+    def _build_catalog(self, product_df, fingerprint: str):
+        """Build the catalog, mapping its numeric columns from worker-shared state if enabled"""
+        catalog = ProductCatalog(product_df)
+        store = shared_state_store()
+        if store is not None:
+            try:
+                catalog.use_arrays(store.attach_or_build('catalog', fingerprint, catalog.numeric_arrays))
+            except Exception as e:
+                print(f"Warning: Could not attach shared catalog arrays: {e}")
+        return catalog
+    
+    def _load_embeddings(self):
+        """Memory-map product embeddings if they were exported with the models"""
+        store = None
+        if config.EMBEDDING_PRECISION != 'float32':
+            store = self._load_quantized_embeddings()
+        if store is None and os.path.exists(EMBEDDINGS_PATH):
+            try:
+                store = EmbeddingStore.load(EMBEDDINGS_PATH)
+            except Exception as e:
+                print(f"Warning: Could not load product embeddings: {e}")
+        if store is not None and len(store) >= config.ANN_MIN_CATALOG_SIZE:
+            self._attach_ann_index(store)
+        return store
+    
+    def _attach_ann_index(self, store):
+        """Answer similarity queries from the IVF index, if one was built for these embeddings"""
+        directory = ivf_path(EMBEDDINGS_PATH)
+        index = IVFIndex.load(directory)
+        if index is None or os.path.getmtime(directory) < os.path.getmtime(EMBEDDINGS_PATH):
+            print(f"Warning: No current ANN index for {len(store)} embeddings, run `python -m src.data.ann_index`")
+            return
+        try:
+            store.use_ann_index(index, config.ANN_PROBES)
+        except ValueError as e:
+            print(f"Warning: Could not use ANN index: {e}")
+    
+    def _load_quantized_embeddings(self):
+        """The float16/int8 copy of the embeddings, or None (full precision is used) if it is missing or stale"""
+        precision = config.EMBEDDING_PRECISION
+        codes_path, _ = quantized_paths(EMBEDDINGS_PATH, precision)
+        if not os.path.exists(codes_path):
+            print(f"Warning: {codes_path} not found, run `python -m src.data.embedding_store --precision {precision}`")
+            return None
+        if os.path.exists(EMBEDDINGS_PATH) and os.path.getmtime(EMBEDDINGS_PATH) > os.path.getmtime(codes_path):
+            print(f"Warning: {codes_path} is older than {EMBEDDINGS_PATH}, using full-precision embeddings")
+            return None
+        try:
+            return QuantizedEmbeddingStore.load(
+                EMBEDDINGS_PATH, precision, rescore_factor=config.EMBEDDING_RESCORE_FACTOR
+            )
+        except Exception as e:
+            print(f"Warning: Could not load {precision} embeddings: {e}")
+            return None
+    
+    def _load_factor_model(self, catalog):
+        """Load the collaborative filtering factors if the model was exported"""
+        paths = ["collaborative_filtering_model.pkl", "user_id_map.pkl", "product_id_map.pkl"]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        try:
+            return FactorModel.load(*paths, catalog=catalog)
+        except Exception as e:
+            print(f"Warning: Could not load collaborative filtering model: {e}")
+            return None
     
     def _create_sample_data(self):
         """Create sample product data for testing"""
@@ -105,50 +429,89 @@ class DataManager:
         return pd.DataFrame(sample_products)
     
     def save_interaction(self, interaction_data: Dict[str, Any]) -> str:
-        """Save interaction to CSV file"""
+        """Queue an interaction for the append-only log and the in-memory table"""
+        return self.save_interactions([interaction_data])[0]
+    
+    def save_interactions(self, interactions: List[Dict[str, Any]]) -> List[str]:
+        """Queue several interactions as a single append to the log"""
         try:
-            # Generate unique interaction ID
-            interaction_id = f"int_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{interaction_data['user_id']}"
+            now = datetime.now()
+            interaction_ids = []
+            csv_rows = []
+            event_times = []
+            second = now.strftime('%Y%m%d_%H%M%S')
+            for interaction_data in interactions:
+                # Generate unique interaction ID; the random suffix keeps IDs distinct across
+                # batches, processes and saves within the same second
+                interaction_id = f"int_{second}_{interaction_data['user_id']}_{uuid.uuid4().hex[:12]}"
+                interaction_ids.append(interaction_id)
+                event_time = self._event_time(interaction_data.get('timestamp'), now)
+                event_times.append(event_time)
+                
+                # Prepare data for CSV
+                csv_rows.append({
+                    'interactionId': interaction_id,
+                    'userId': interaction_data['user_id'],
+                    'productId': interaction_data.get('product_id', ''),
+                    'interactionType': interaction_data['interaction_type'],
+                    'timestamp': event_time.isoformat(),
+                    'quantity': interaction_data.get('quantity', ''),
+                    'value': interaction_data.get('value', ''),
+                    'rating': interaction_data.get('rating', ''),
+                    'review': interaction_data.get('review', ''),
+                    'sentiment': interaction_data.get('sentiment', ''),
+                    'socialSharePlatform': interaction_data.get('socialSharePlatform', ''),
+                    'metadata': json.dumps(interaction_data.get('metadata', {}))
+                })
             
-            # Prepare data for CSV
-            csv_data = {
-                'interactionId': interaction_id,
-                'userId': interaction_data['user_id'],
-                'productId': interaction_data.get('product_id', ''),
-                'interactionType': interaction_data['interaction_type'],
-                'timestamp': datetime.now().isoformat(),
-                'quantity': interaction_data.get('quantity', ''),
-                'value': interaction_data.get('value', ''),
-                'rating': interaction_data.get('rating', ''),
-                'review': interaction_data.get('review', ''),
-                'sentiment': interaction_data.get('sentiment', ''),
-                'socialSharePlatform': interaction_data.get('socialSharePlatform', ''),
-                'metadata': json.dumps(interaction_data.get('metadata', {}))
-            }
+            # One writer at a time, so the log, the index and the table agree on order
+            with stage('data', 'save_interactions', 'persist'), self._write_lock:
+                self.interaction_writer.append_many(csv_rows)
+                self._pending_rows.extend(csv_rows)
+                interaction_index = self.interaction_index
+                positions = interaction_index.add_many([
+                    {
+                        **csv_data,
+                        'timestamp': event_time,
+                        'metadata': interaction_data.get('metadata', {})
+                    }
+                    for csv_data, interaction_data, event_time in zip(csv_rows, interactions, event_times)
+                ])
+                if len(self._pending_rows) >= INTERACTION_CHUNK_SIZE:
+                    self._materialize_pending()
             
-            # Append to interaction dataframe
-            new_row = pd.DataFrame([csv_data])
-            self.interaction_df = pd.concat([self.interaction_df, new_row], ignore_index=True)
+            for position in positions:
+                record = interaction_index.records[position]
+                for listener in self.interaction_listeners:
+                    try:
+                        listener(record, interaction_index.times[position])
+                    except Exception as e:
+                        print(f"Warning: Interaction listener failed: {e}")
             
-            # Save to CSV (optional - for persistence)
-            try:
-                self.interaction_df.to_csv("data_csv/product_interactions_data_fixed.csv", index=False)
-            except Exception as e:
-                print(f"Warning: Could not save interactions to file: {e}")
-            
-            return interaction_id
+            return interaction_ids
             
         except Exception as e:
             raise Exception(f"Error saving interaction: {str(e)}")
     
+    @staticmethod
+    def _event_time(timestamp, now: datetime) -> datetime:
+        """Client-supplied event time as local naive time like the log, never later than ``now``"""
+        if not isinstance(timestamp, datetime):
+            return now
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone().replace(tzinfo=None)
+        return min(timestamp, now)
+    
     def get_product_info(self, product_id: str):
         """Get product information by ID"""
         try:
-            if self.product_df is not None:
-                product = self.product_df[self.product_df['id'] == product_id]
-                if not product.empty:
-                    return product.iloc[0].to_dict()
-            return None
+            snapshot = self._snapshot
+            with stage('data', 'product_info', 'lookup'):
+                if snapshot.catalog is not None:
+                    row = snapshot.catalog.row_of(product_id)
+                    if row is not None:
+                        return snapshot.catalog.record(row)
+                return None
         except Exception as e:
             print(f"Error getting product info: {e}")
             return None
@@ -156,37 +519,33 @@ class DataManager:
     def extract_price(self, product_info):
         """Extract price from product information"""
         try:
-            if isinstance(product_info, dict):
-                return float(product_info.get('price', 0.0))
-            elif hasattr(product_info, 'get'):
-                return float(product_info.get('price', 0.0))
-            else:
-                return 0.0
+            if isinstance(product_info, dict) or hasattr(product_info, 'get'):
+                # Catalog records carry a parsed price; raw rows only the "Ugx..." strings
+                for key in ('price', 'priceAndDiscount', 'originalPrice'):
+                    value = product_info.get(key)
+                    if value is None:
+                        continue
+                    price = parse_price(value)
+                    if not np.isnan(price):
+                        return float(price)
+            return 0.0
         except (ValueError, TypeError):
             return 0.0
     
     def get_user_interactions(self, user_id: str, limit: int = 50):
-        """Get all interactions for a specific user"""
+        """Get the most recent interactions for a specific user"""
         try:
-            if self.interaction_df is not None and not self.interaction_df.empty:
-                user_interactions = self.interaction_df[
-                    self.interaction_df['userId'] == user_id
-                ].head(limit)
-                return user_interactions.to_dict('records')
-            return []
+            with stage('data', 'user_interactions', 'lookup'):
+                return self.interaction_index.recent_for_user(user_id, limit)
         except Exception as e:
             print(f"Error getting user interactions: {e}")
             return []
     
     def get_product_interactions(self, product_id: str, limit: int = 50):
-        """Get all interactions for a specific product"""
+        """Get the most recent interactions for a specific product"""
         try:
-            if self.interaction_df is not None and not self.interaction_df.empty:
-                product_interactions = self.interaction_df[
-                    self.interaction_df['productId'] == product_id
-                ].head(limit)
-                return product_interactions.to_dict('records')
-            return []
+            with stage('data', 'product_interactions', 'lookup'):
+                return self.interaction_index.recent_for_product(product_id, limit)
         except Exception as e:
             print(f"Error getting product interactions: {e}")
-            return [] 
\ No newline at end of file
+            return []
@@ -0,0 +1,334 @@
+"""
+Memory-mapped product embeddings for KMart ML API
+
+``product_embeddings.npy`` holds the full-precision vectors and
+``product_embeddings.ids.json`` the product id of each of its rows, as a
+JSON list exported with it (null for rows without a product). Running
+
+    python -m src.data.embedding_store --precision int8
+
+writes a quantized copy next to it (``product_embeddings.int8.npy`` plus
+per-vector scales) and reports how closely quantized top-k results match
+exact float32 search; set ``KMART_EMBEDDING_PRECISION`` to serve from it.
+"""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple
+
+PRECISIONS = ('float32', 'float16', 'int8')
+# Rows decoded and scored per block of a quantized scan; small enough for the
+# float32 copy of a block to stay in cache between decoding and scoring
+SCAN_BLOCK_ROWS = 512
+# Rows quantized per block when writing a copy
+WRITE_BLOCK_ROWS = 65536
+
+
+def quantized_paths(embeddings_path: str, precision: str) -> Tuple[str, str]:
+    """Code and scale files of a quantized copy of ``embeddings_path``"""
+    base = embeddings_path[:-len('.npy')] if embeddings_path.endswith('.npy') else embeddings_path
+    return f"{base}.{precision}.npy", f"{base}.{precision}.scales.npy"
+
+
+def quantize_block(vectors, precision: str):
+    """Unit-normalize rows and encode them as float16, or int8 with one scale per row"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+    if precision == 'float16':
+        return unit.astype(np.float16), np.ones(len(unit), dtype=np.float32)
+    peaks = np.abs(unit).max(axis=1) if unit.shape[1] else np.zeros(len(unit), dtype=np.float32)
+    scales = np.where(peaks > 0, peaks / 127.0, 1.0).astype(np.float32)
+    return np.rint(unit / scales[:, None]).astype(np.int8), scales
+
+
+def write_quantized(embeddings_path: str, precision: str) -> Tuple[str, str]:
+    """Write the quantized copy block by block, replacing any previous one atomically"""
+    if precision not in ('float16', 'int8'):
+        raise ValueError(f"Unsupported precision '{precision}', expected float16 or int8")
+    vectors = np.load(embeddings_path, mmap_mode='r')
+    codes_path, scales_path = quantized_paths(embeddings_path, precision)
+    temporary_codes, temporary_scales = f"{codes_path}.{os.getpid()}.tmp", f"{scales_path}.{os.getpid()}.tmp"
+
+    codes = np.lib.format.open_memmap(temporary_codes, mode='w+', dtype=precision, shape=vectors.shape)
+    scales = np.lib.format.open_memmap(temporary_scales, mode='w+', dtype=np.float32, shape=(vectors.shape[0],))
+    for start in range(0, vectors.shape[0], WRITE_BLOCK_ROWS):
+        stop = start + WRITE_BLOCK_ROWS
+        codes[start:stop], scales[start:stop] = quantize_block(vectors[start:stop], precision)
+    codes.flush()
+    scales.flush()
+    del codes, scales
+
+    # Scales first: the codes file's mtime is what marks the copy as current
+    os.replace(temporary_scales, scales_path)
+    os.replace(temporary_codes, codes_path)
+    return codes_path, scales_path
+
+
+def _top_rows(scores, exclude_row: int, unnamed_rows, k: int, candidates=None):
+    """Best ``k`` rows by score, skipping the query row and rows without a product id.
+
+    ``scores`` covers every row, or with ``candidates`` just those rows.
+    """
+    if candidates is None:
+        scores[exclude_row] = -np.inf
+        scores[unnamed_rows] = -np.inf
+    else:
+        scores[(candidates == exclude_row) | unnamed_rows[candidates]] = -np.inf
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float32)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    top = top[np.isfinite(scores[top])]
+    return (top if candidates is None else candidates[top]), scores[top]
+
+
+def product_ids_path(embeddings_path: str) -> str:
+    """Row -> product id file exported with ``embeddings_path``"""
+    base = embeddings_path[:-len('.npy')] if embeddings_path.endswith('.npy') else embeddings_path
+    return f"{base}.ids.json"
+
+
+def read_product_ids(ids_path: str, num_rows: int) -> List[str]:
+    """Product id of every embedding row ('' for rows without a product).
+
+    Raises ValueError when the file is missing or names a different number
+    of rows than the matrix has; rows are never matched up by guessing.
+    """
+    try:
+        with open(ids_path, 'r') as f:
+            product_ids = json.load(f)
+    except OSError as e:
+        raise ValueError(f"Cannot read {ids_path}, export it with the embeddings: {e}")
+    if not isinstance(product_ids, list) or len(product_ids) != num_rows:
+        count = len(product_ids) if isinstance(product_ids, list) else 'no'
+        raise ValueError(f"{ids_path} names {count} rows, the embeddings have {num_rows}; export them together")
+    return ['' if product_id is None else str(product_id) for product_id in product_ids]
+
+
+class EmbeddingStore:
+    """Cosine top-k over a read-only, memory-mapped embedding matrix.
+
+    The matrix stays an ``np.memmap`` so every worker process reads the
+    same page-cache pages; only the per-row inverse norms (one float per
+    product) are computed and held in process memory.
+    """
+
+    precision = 'float32'
+    # Optional IVF index (see src.data.ann_index); None scans every row
+    ann_index = None
+    ann_probes = 0
+
+    def __init__(self, vectors, product_ids: Sequence[str]):
+        self.vectors = vectors
+        self._index_ids(product_ids)
+
+        norms = np.sqrt(np.einsum('ij,ij->i', vectors, vectors, dtype=np.float32))
+        self.inverse_norms = np.divide(
+            1.0, norms, out=np.zeros_like(norms), where=norms > 0
+        ).astype(np.float32)
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def _index_ids(self, product_ids: Sequence[str]):
+        self.product_ids = list(product_ids)
+        self.id_to_row: Dict[str, int] = {}
+        for row, product_id in enumerate(self.product_ids):
+            if product_id:
+                self.id_to_row.setdefault(product_id, row)
+        self.unnamed_rows = np.array([not product_id for product_id in self.product_ids], dtype=bool)
+
+    @classmethod
+    def load(cls, embeddings_path: str, product_ids: Optional[Sequence[str]] = None) -> "EmbeddingStore":
+        """Open the embedding file with its row ids (read from its ``.ids.json`` unless given)"""
+        vectors = np.load(embeddings_path, mmap_mode='r')
+        if product_ids is None:
+            product_ids = read_product_ids(product_ids_path(embeddings_path), vectors.shape[0])
+        return cls(vectors, product_ids)
+
+    def row_of(self, product_id: str) -> Optional[int]:
+        """Embedding row of a product id, or None if it has no vector"""
+        return self.id_to_row.get(product_id)
+
+    def use_ann_index(self, index, probes: int):
+        """Score only the rows in the ``probes`` inverted lists nearest each query"""
+        if len(index) != len(self):
+            raise ValueError(f"ANN index has {len(index)} rows, embeddings have {len(self)}")
+        self.ann_index = index
+        self.ann_probes = max(int(probes), 1)
+
+    def _candidates(self, query):
+        """Rows to score for a unit query vector, or None to scan them all"""
+        if self.ann_index is None:
+            return None
+        return self.ann_index.candidates(query, self.ann_probes)
+
+    def similar(self, product_id: str, limit: int = 5):
+        """Return (product_ids, scores) of the nearest products by cosine similarity"""
+        row = self.id_to_row.get(product_id)
+        if row is None or limit <= 0:
+            return [], np.zeros(0, dtype=np.float32)
+
+        query = np.asarray(self.vectors[row], dtype=np.float32) * self.inverse_norms[row]
+        candidates = self._candidates(query)
+        if candidates is None:
+            scores = (self.vectors @ query) * self.inverse_norms
+        else:
+            scores = (np.asarray(self.vectors[candidates], dtype=np.float32) @ query) * self.inverse_norms[candidates]
+        top, top_scores = _top_rows(scores, row, self.unnamed_rows, limit, candidates)
+        return [self.product_ids[i] for i in top], top_scores
+
+
+class QuantizedEmbeddingStore(EmbeddingStore):
+    """Cosine top-k over float16 or int8 embeddings, rescored at full precision.
+
+    The scan reads the quantized codes (a half or a quarter of the float32
+    bytes) in blocks. The best ``limit * rescore_factor`` candidates are then
+    scored again against the full-precision file, which is only read at those
+    rows, so results match exact search unless a true neighbour falls
+    outside the candidate set. Without the full-precision file the
+    approximate scores are returned as they are.
+    """
+
+    def __init__(self, codes, scales, product_ids: Sequence[str], vectors=None, rescore_factor: int = 4):
+        self.codes = codes
+        self.scales = scales
+        self.vectors = vectors
+        self.precision = str(codes.dtype)
+        self.rescore_factor = max(int(rescore_factor), 1)
+        self._index_ids(product_ids)
+
+    @classmethod
+    def load(cls, embeddings_path: str, precision: str = 'int8', product_ids: Optional[Sequence[str]] = None,
+             rescore_factor: int = 4) -> "QuantizedEmbeddingStore":
+        """Open the quantized copy of ``embeddings_path`` and, if present, the file itself for rescoring"""
+        codes_path, scales_path = quantized_paths(embeddings_path, precision)
+        codes = np.load(codes_path, mmap_mode='r')
+        scales = np.load(scales_path, mmap_mode='r')
+        if len(scales) != len(codes):
+            raise ValueError(f"{scales_path} has {len(scales)} rows, {codes_path} has {len(codes)}")
+
+        vectors = None
+        if os.path.exists(embeddings_path):
+            vectors = np.load(embeddings_path, mmap_mode='r')
+            if vectors.shape != codes.shape:
+                raise ValueError(f"{codes_path} does not match {embeddings_path}; convert it again")
+        if product_ids is None:
+            product_ids = read_product_ids(product_ids_path(embeddings_path), len(codes))
+        return cls(codes, scales, product_ids, vectors, rescore_factor)
+
+    def approximate_scores(self, row: int, candidates=None) -> np.ndarray:
+        """Cosine of every row (or of ``candidates``) against ``row``, computed from the quantized codes"""
+        query = np.asarray(self.codes[row], dtype=np.float32) * self.scales[row]
+        if candidates is not None:
+            return (np.asarray(self.codes[candidates], dtype=np.float32) @ query) * self.scales[candidates]
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), SCAN_BLOCK_ROWS):
+            stop = start + SCAN_BLOCK_ROWS
+            scores[start:stop] = (self.codes[start:stop] @ query) * self.scales[start:stop]
+        return scores
+
+    def similar(self, product_id: str, limit: int = 5):
+        """Return (product_ids, scores) of the nearest products by cosine similarity"""
+        row = self.id_to_row.get(product_id)
+        if row is None or limit <= 0:
+            return [], np.zeros(0, dtype=np.float32)
+
+        rows = self._candidates(np.asarray(self.codes[row], dtype=np.float32) * self.scales[row])
+        keep = limit if self.vectors is None else limit * self.rescore_factor
+        top, top_scores = _top_rows(self.approximate_scores(row, rows), row, self.unnamed_rows, keep, rows)
+        if self.vectors is not None and len(top):
+            top, top_scores = self._rescore(row, top, limit)
+        return [self.product_ids[i] for i in top], top_scores
+
+    def _rescore(self, row: int, candidates, limit: int):
+        """Exact float32 cosine of the candidate rows, best ``limit`` first"""
+        query = np.asarray(self.vectors[row], dtype=np.float32)
+        # Sorted reads touch the memory-mapped file in order
+        candidates = np.sort(candidates)
+        block = np.asarray(self.vectors[candidates], dtype=np.float32)
+        norms = np.linalg.norm(block, axis=1) * np.linalg.norm(query)
+        scores = np.divide(block @ query, norms, out=np.zeros(len(block), dtype=np.float32), where=norms > 0)
+        order = np.lexsort((candidates, -scores))[:limit]
+        return candidates[order], scores[order]
+
+
+def compare_to_exact(exact: EmbeddingStore, stores: Dict[str, EmbeddingStore], rows, k: int) -> Dict[str, float]:
+    """Latency per query of each store and of ``exact``, and each store's recall@k against it.
+
+    Product ids must be the row numbers as strings. A returned row counts as
+    a hit when its exact score is at least the k-th best, so ties at the
+    cut-off are not misses.
+    """
+    exact_scores = {}
+    for row in rows:
+        scores = (exact.vectors @ (np.asarray(exact.vectors[row], dtype=np.float32) * exact.inverse_norms[row])) * exact.inverse_norms
+        scores[row] = -np.inf
+        exact_scores[row] = scores
+    expected = max(min(k, len(exact) - 1), 1) * len(rows)
+
+    report = {}
+    for name, store in [('float32', exact)] + list(stores.items()):
+        started = time.perf_counter()
+        results = [store.similar(str(row), k)[0] for row in rows]
+        report[f'{name}_ms_per_query'] = round((time.perf_counter() - started) * 1000 / max(len(rows), 1), 3)
+        if store is exact:
+            continue
+        hits = 0
+        for row, result in zip(rows, results):
+            scores = exact_scores[row]
+            kth = np.partition(scores, len(scores) - k)[len(scores) - k] if k < len(scores) else scores.min()
+            hits += sum(scores[int(neighbour)] >= kth - 1e-6 for neighbour in result)
+        report[f'{name}_recall_at_{k}'] = round(hits / expected, 4)
+    return report
+
+
+def recall_report(embeddings_path: str, precision: str, k: int = 10, queries: int = 200,
+                  rescore_factor: int = 4, seed: int = 0) -> Dict[str, float]:
+    """Recall@k and latency of the quantized copy against exact float32 search"""
+    # Rows stand in for product ids, so every row is a candidate
+    vectors = np.load(embeddings_path, mmap_mode='r')
+    product_ids = [str(row) for row in range(len(vectors))]
+    exact = EmbeddingStore(vectors, product_ids)
+    rescored = QuantizedEmbeddingStore.load(embeddings_path, precision, product_ids=product_ids,
+                                            rescore_factor=rescore_factor)
+    approximate = QuantizedEmbeddingStore(rescored.codes, rescored.scales, product_ids)
+    codes_path, scales_path = quantized_paths(embeddings_path, precision)
+
+    rows = np.random.default_rng(seed).choice(len(product_ids), size=min(queries, len(product_ids)), replace=False)
+    report = {
+        'rows': len(product_ids),
+        'dimensions': int(exact.vectors.shape[1]),
+        'float32_mb': round(os.path.getsize(embeddings_path) / 1e6, 2),
+        f'{precision}_mb': round((os.path.getsize(codes_path) + os.path.getsize(scales_path)) / 1e6, 2),
+    }
+    report.update(compare_to_exact(exact, {precision: approximate, f'{precision}+rescore': rescored}, rows, k))
+    return report
+
+
+def main():
+    """Quantize the product embeddings and report recall against exact search"""
+    parser = argparse.ArgumentParser(description="Quantize product embeddings for KMart ML API")
+    parser.add_argument('--embeddings', default='product_embeddings.npy', help="Full-precision .npy file")
+    parser.add_argument('--precision', choices=('float16', 'int8'), default='int8')
+    parser.add_argument('--k', type=int, default=10, help="Neighbours compared for recall")
+    parser.add_argument('--queries', type=int, default=200, help="Products sampled as queries")
+    parser.add_argument('--rescore-factor', type=int, default=4, help="Candidates rescored per result")
+    parser.add_argument('--report-only', action='store_true', help="Evaluate an existing copy without rewriting it")
+    args = parser.parse_args()
+
+    if not args.report_only:
+        codes_path, _ = write_quantized(args.embeddings, args.precision)
+        print(f"Wrote {codes_path}")
+    report = recall_report(args.embeddings, args.precision, args.k, args.queries, args.rescore_factor)
+    for name, value in report.items():
+        print(f"  {name:<32} {value}")
+
+
+if __name__ == "__main__":
+    main()
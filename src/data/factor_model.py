@@ -0,0 +1,105 @@
+"""
+Matrix-factorization recommender loaded from collaborative_filtering_model.pkl
+"""
+
+import hashlib
+import io
+import pickle
+import numpy as np
+from typing import Dict, List
+
+
+class _PickledModel:
+    """Stand-in for the training library's model class; keeps only its state"""
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            self.__dict__.update(state)
+
+
+class _ModelUnpickler(pickle.Unpickler):
+    """Unpickle an `implicit` model without importing `implicit` at serving time"""
+
+    def find_class(self, module, name):
+        if module.split('.')[0] == 'implicit':
+            return _PickledModel
+        return super().find_class(module, name)
+
+
+def top_items(users, item_factors, limit: int):
+    """Indexes and scores of the ``limit`` best items for each row of user factors, best first"""
+    scores = users @ item_factors.T
+    k = min(limit, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+class FactorModel:
+    """User and item factors as contiguous float32 arrays.
+
+    Item factors are restricted to products present in the catalog and
+    stored with their catalog rows, so a user is scored with a single
+    matrix-vector product. ``signature`` is a hash of the exported files,
+    so results computed offline can be matched to the model that made them.
+    """
+
+    def __init__(self, user_factors, item_factors, user_index: Dict[str, int], item_rows, signature: str = ''):
+        self.user_factors = np.ascontiguousarray(user_factors, dtype=np.float32)
+        self.item_factors = np.ascontiguousarray(item_factors, dtype=np.float32)
+        self.user_index = user_index
+        self.item_rows = np.asarray(item_rows, dtype=np.intp)
+        self.signature = signature
+
+    @classmethod
+    def load(cls, model_path: str, user_map_path: str, item_map_path: str, catalog) -> "FactorModel":
+        """Load factors and id maps, keeping items that exist in the catalog"""
+        digest = hashlib.sha256()
+        contents = []
+        for path in (model_path, user_map_path, item_map_path):
+            with open(path, 'rb') as f:
+                contents.append(f.read())
+            digest.update(contents[-1])
+        model = _ModelUnpickler(io.BytesIO(contents[0])).load()
+        user_map = pickle.loads(contents[1])
+        item_map = pickle.loads(contents[2])
+
+        user_factors = np.asarray(model.user_factors)
+        item_factors = np.asarray(model.item_factors)
+
+        # The id maps go factor index -> raw id; requests arrive with string ids
+        user_index = {
+            str(user_id): int(index) for index, user_id in user_map.items()
+            if 0 <= int(index) < len(user_factors)
+        }
+
+        factor_rows, catalog_rows = [], []
+        for index, product_id in sorted(item_map.items()):
+            row = catalog.row_of(str(product_id))
+            if row is not None and 0 <= int(index) < len(item_factors):
+                factor_rows.append(int(index))
+                catalog_rows.append(row)
+
+        return cls(user_factors, item_factors[factor_rows], user_index, catalog_rows, digest.hexdigest()[:16])
+
+    def recommend_many(self, user_ids: List[str], limit: int):
+        """Score a batch of users with one matrix product.
+
+        Returns one (catalog_rows, scores) pair per user, or None for users
+        without factors.
+        """
+        batch = [None] * len(user_ids)
+        known = [(position, self.user_index[user_id]) for position, user_id in enumerate(user_ids)
+                 if user_id in self.user_index]
+        if not known or limit <= 0 or len(self.item_rows) == 0:
+            for position, _ in known:
+                batch[position] = (self.item_rows[:0], np.zeros(0, dtype=np.float32))
+            return batch
+
+        users = self.user_factors[[index for _, index in known]]
+        top, top_scores = top_items(users, self.item_factors, limit)
+
+        for (position, _), items, item_scores in zip(known, top, top_scores):
+            batch[position] = (self.item_rows[items], item_scores)
+        return batch
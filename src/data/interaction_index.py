@@ -0,0 +1,150 @@
+"""
+Per-user and per-product interaction indexes for KMart ML API
+"""
+
+import bisect
+import copy
+import json
+import math
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+
+def _clean(value):
+    """Blank out NaN/None so records serialize as JSON"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and math.isnan(value):
+        return ''
+    return value
+
+
+def _decode_metadata(raw) -> Dict[str, Any]:
+    if isinstance(raw, dict):
+        # The caller keeps its dict; records must not change with it
+        return copy.deepcopy(raw)
+    if not isinstance(raw, str) or raw in ('', '{}'):
+        return {}
+    try:
+        metadata = json.loads(raw)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+    return metadata if isinstance(metadata, dict) else {}
+
+
+class InteractionIndex:
+    """Decoded interaction records with user and product lookups.
+
+    Records are decoded (metadata JSON, timestamps) once when they are
+    added. Each user and product keeps its record positions in timestamp
+    order, so the most recent ``limit`` interactions cost O(limit).
+
+    Readers do not lock. Records are appended before any position list
+    refers to them, and a batch never changes a position list in place:
+    it builds new lists for the users and products it touches and swaps
+    them in, so a reader always sees a complete list, either before or
+    after the batch.
+    """
+
+    def __init__(self):
+        self.records: List[Dict[str, Any]] = []
+        self.times: List[float] = []
+        self.by_user: Dict[str, List[int]] = {}
+        self.by_product: Dict[str, List[int]] = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def from_dataframe(cls, interaction_df: Optional[pd.DataFrame]) -> "InteractionIndex":
+        """Index an interaction table, oldest first"""
+        index = cls()
+        if interaction_df is None or interaction_df.empty:
+            return index
+
+        ordered = interaction_df.sort_values('timestamp', kind='stable', na_position='first')
+        index.add_many([
+            {
+                'interactionId': row.get('interactionId'),
+                'userId': row.get('userId'),
+                'productId': row.get('productId'),
+                'interactionType': row.get('interactionType'),
+                'timestamp': row.get('timestamp'),
+                'quantity': row.get('quantity'),
+                'rating': row.get('rating'),
+                'review': row.get('review'),
+                'metadata': row.get('metadata'),
+            }
+            for row in ordered.to_dict('records')
+        ])
+        return index
+
+    def add(self, row: Dict[str, Any]) -> int:
+        """Decode and index one interaction row (CSV column names)"""
+        return self.add_many([row])[0]
+
+    def add_many(self, rows: List[Dict[str, Any]]) -> List[int]:
+        """Decode and index rows (CSV column names); returns their positions"""
+        positions = []
+        by_user: Dict[str, List[int]] = {}
+        by_product: Dict[str, List[int]] = {}
+        for row in rows:
+            timestamp = row.get('timestamp')
+            if isinstance(timestamp, str):
+                timestamp = pd.to_datetime(timestamp, errors='coerce')
+            valid_time = isinstance(timestamp, datetime) and not pd.isna(timestamp)
+
+            record = {
+                'interaction_id': _clean(row.get('interactionId')),
+                'user_id': _clean(row.get('userId')),
+                'product_id': _clean(row.get('productId')),
+                'interaction_type': _clean(row.get('interactionType')),
+                'timestamp': timestamp.isoformat() if valid_time else '',
+                'quantity': _clean(row.get('quantity')),
+                'rating': _clean(row.get('rating')),
+                'review': _clean(row.get('review')),
+                'metadata': _decode_metadata(row.get('metadata')),
+            }
+
+            position = len(self.records)
+            self.records.append(record)
+            self.times.append(timestamp.timestamp() if valid_time else float('-inf'))
+            positions.append(position)
+
+            # Copies of the touched lists, made once per batch
+            if record['user_id'] != '':
+                user_id = str(record['user_id'])
+                if user_id not in by_user:
+                    by_user[user_id] = list(self.by_user.get(user_id, ()))
+                self._insert(by_user[user_id], position)
+            if record['product_id'] != '':
+                product_id = str(record['product_id'])
+                if product_id not in by_product:
+                    by_product[product_id] = list(self.by_product.get(product_id, ()))
+                self._insert(by_product[product_id], position)
+
+        self.by_user.update(by_user)
+        self.by_product.update(by_product)
+        return positions
+
+    def _insert(self, positions: List[int], position: int):
+        # Events normally arrive in time order; only late ones pay for a bisect
+        if not positions or self.times[positions[-1]] <= self.times[position]:
+            positions.append(position)
+        else:
+            bisect.insort_right(positions, position, key=self.times.__getitem__)
+
+    def recent_for_user(self, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent interactions of a user, newest first"""
+        return self._recent(self.by_user.get(user_id), limit)
+
+    def recent_for_product(self, product_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent interactions on a product, newest first"""
+        return self._recent(self.by_product.get(product_id), limit)
+
+    def _recent(self, positions: Optional[List[int]], limit: int) -> List[Dict[str, Any]]:
+        if not positions or limit <= 0:
+            return []
+        return [self.records[position] for position in reversed(positions[-limit:])]
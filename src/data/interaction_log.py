@@ -0,0 +1,179 @@
+"""
+Append-only, write-behind interaction log for KMart ML API
+"""
+
+import atexit
+import csv
+import io
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List
+
+import pandas as pd
+
+from src.metrics import INTERACTION_LOG_ROWS
+
+logger = logging.getLogger(__name__)
+
+# Seconds between retries of a failed append, doubling up to the maximum
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30.0
+
+INTERACTION_COLUMNS = [
+    'interactionId', 'userId', 'productId', 'interactionType',
+    'timestamp', 'quantity', 'value', 'rating', 'review',
+    'sentiment', 'socialSharePlatform', 'metadata'
+]
+
+
+def read_interaction_log(path: str) -> pd.DataFrame:
+    """Read the interaction log, with or without a header row"""
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        first_line = f.readline()
+
+    id_types = {'interactionId': str, 'userId': str, 'productId': str}
+    if first_line.startswith('interactionId,'):
+        interaction_df = pd.read_csv(path, dtype=id_types)
+    else:
+        interaction_df = pd.read_csv(path, header=None, names=INTERACTION_COLUMNS, dtype=id_types)
+
+    interaction_df['timestamp'] = pd.to_datetime(interaction_df['timestamp'], errors='coerce')
+    return interaction_df
+
+
+class InteractionLogWriter:
+    """Queue interaction rows and append them to the log from a background thread.
+
+    Rows are written in batches once ``batch_size`` rows are waiting or
+    ``flush_interval`` seconds have passed since the oldest unwritten row,
+    and whatever is left is written on ``close()`` (also run at exit).
+    A failed append keeps its rows queued and is retried with exponential
+    backoff; only rows still failing at ``close()`` are dropped, and that is
+    logged as an error and counted in ``kmart_interaction_log_rows_total``.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path: str, batch_size: int = 100, flush_interval: float = 1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = None
+        self._closed = False
+        # Rows waiting in the writer thread and the error of the last failed append
+        self.pending_rows = 0
+        self.last_error = None
+
+    def start(self):
+        """Start the background writer thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="interaction-log-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def append(self, row: Dict[str, Any]):
+        """Queue a single row for writing"""
+        self.append_many([row])
+
+    def append_many(self, rows: List[Dict[str, Any]]):
+        """Queue rows to be written together"""
+        if self._closed:
+            raise RuntimeError("Interaction log writer is closed")
+        self._queue.put(list(rows))
+
+    def flush(self):
+        """Block until every queued row has been written"""
+        self._queue.join()
+
+    def status(self) -> Dict[str, Any]:
+        """Rows not yet written and whether appends are currently failing"""
+        return {
+            'pending_rows': self.pending_rows,
+            'failing': self.last_error is not None,
+            'last_error': self.last_error
+        }
+
+    def close(self):
+        """Write remaining rows and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(self._STOP)
+            self._thread.join()
+
+    def _run(self):
+        pending = []
+        taken = 0
+        deadline = None
+        retry_at = None
+        retry_delay = RETRY_DELAY
+        while True:
+            wake = retry_at if retry_at is not None else deadline
+            timeout = None if wake is None else max(wake - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            stop = item is self._STOP
+            if item is not None and not stop:
+                pending.extend(item)
+                taken += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            self.pending_rows = len(pending)
+
+            now = time.monotonic()
+            if retry_at is not None:
+                # A failed batch goes out again once its backoff has passed
+                write = stop or now >= retry_at
+            else:
+                write = stop or (deadline is not None and now >= deadline) or len(pending) >= self.batch_size
+            if pending and write:
+                if self._write(pending):
+                    pending = []
+                    retry_at = None
+                    retry_delay = RETRY_DELAY
+                elif stop:
+                    logger.error("Dropped %d interactions that could not be written to %s", len(pending), self.path)
+                    INTERACTION_LOG_ROWS.inc(('dropped',), len(pending))
+                    pending = []
+                else:
+                    retry_at = now + retry_delay
+                    retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+                self.pending_rows = len(pending)
+            if not pending:
+                for _ in range(taken):
+                    self._queue.task_done()
+                taken = 0
+                deadline = None
+
+            if stop:
+                self._queue.task_done()
+                return
+
+    def _write(self, rows: List[Dict[str, Any]]) -> bool:
+        """Append rows to the log; False if the append failed"""
+        try:
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=INTERACTION_COLUMNS, extrasaction='ignore')
+            if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+                writer.writeheader()
+            writer.writerows(rows)
+            # One unbuffered append per batch, so batches from several worker
+            # processes sharing the log never interleave
+            with open(self.path, 'ab', buffering=0) as f:
+                f.write(buffer.getvalue().encode('utf-8'))
+        except Exception as e:
+            logger.warning("Could not save %d interactions to %s, will retry: %s", len(rows), self.path, e)
+            INTERACTION_LOG_ROWS.inc(('failed',), len(rows))
+            self.last_error = str(e)
+            return False
+        INTERACTION_LOG_ROWS.inc(('written',), len(rows))
+        self.last_error = None
+        return True
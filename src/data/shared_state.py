@@ -0,0 +1,189 @@
+"""
+Worker-shared, memory-mapped model state for KMart ML API
+
+Each uvicorn worker is a separate process. Arrays published here are
+written once as ``.npy`` files and every worker maps the same files
+read-only, so the operating system keeps a single copy in page cache.
+Small Python objects (e.g. a fitted vectorizer's vocabulary) are pickled
+alongside and loaded per worker.
+
+Only the catalog's numeric columns and the TF-IDF matrix go through this
+store; product embeddings are memory-mapped from their export files, so
+they are shared the same way. Everything else stays per worker:
+
+- the product table and the catalog's text columns (ids, names, ...)
+- the keyword index and the rendered product fragments
+- the interaction index, trending counters and co-interaction model
+
+The first two are rebuilt identically in every worker and cost memory
+per worker. Interaction state is not shared at all: each worker indexes
+the interactions it saves itself, on top of the log it read at startup,
+so workers still disagree about interactions saved since then until
+they restart.
+
+Build everything once before starting the workers with:
+
+    python -m src.data.shared_state
+"""
+
+import contextlib
+import json
+import os
+import pickle
+import shutil
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows development machines
+    fcntl = None
+
+from src import config
+
+SHARED_STATE_FORMAT = 3
+# Versions kept per group, most recently attached first. Workers still on the
+# previous catalog keep their files while others move to the next one
+KEPT_VERSIONS = 2
+
+
+class SharedStateStore:
+    """Named groups of arrays published once and attached by every worker.
+
+    Each version of a group lives in ``<directory>/<name>/<fingerprint>/``,
+    and its ``manifest.json`` is written last to mark it complete. The first
+    process to find a version missing builds it under a file lock. The
+    others wait, then attach to the result. Attaching also happens under the
+    lock, so a build for another fingerprint can never delete a version
+    while it is being mapped. Only the ``KEPT_VERSIONS`` most recently
+    attached versions are kept.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def attach_or_build(self, name: str, fingerprint: str,
+                        builder: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Attach to group ``name`` at ``fingerprint``, building it first if needed"""
+        group_dir = os.path.join(self.directory, name)
+        os.makedirs(group_dir, exist_ok=True)
+
+        with self._lock(group_dir):
+            version_dir = os.path.join(group_dir, fingerprint)
+            manifest = self._read_manifest(version_dir)
+            if manifest is None:
+                manifest = self._write(version_dir, fingerprint, builder())
+            else:
+                # Marks the version as recently used, which protects it from pruning
+                os.utime(os.path.join(version_dir, 'manifest.json'))
+            values = self._attach(version_dir, manifest)
+            self._prune(group_dir)
+        return values
+
+    @contextlib.contextmanager
+    def _lock(self, group_dir: str):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(group_dir, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_manifest(version_dir: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(version_dir, 'manifest.json'), 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('format') != SHARED_STATE_FORMAT:
+            return None
+        return manifest
+
+    @staticmethod
+    def _write(version_dir: str, fingerprint: str, values: Dict[str, Any]) -> Dict[str, Any]:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        os.makedirs(version_dir)
+
+        arrays, objects = [], []
+        for key, value in values.items():
+            if isinstance(value, np.ndarray):
+                np.save(os.path.join(version_dir, f"{key}.npy"), np.ascontiguousarray(value))
+                arrays.append(key)
+            else:
+                with open(os.path.join(version_dir, f"{key}.pkl"), 'wb') as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                objects.append(key)
+
+        manifest = {
+            'format': SHARED_STATE_FORMAT,
+            'fingerprint': fingerprint,
+            'arrays': arrays,
+            'objects': objects,
+        }
+        temporary_path = os.path.join(version_dir, f"manifest.json.{os.getpid()}")
+        with open(temporary_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temporary_path, os.path.join(version_dir, 'manifest.json'))
+        return manifest
+
+    @staticmethod
+    def _prune(group_dir: str):
+        """Delete all but the most recently attached versions (and incomplete ones)"""
+        versions = []
+        for entry in os.listdir(group_dir):
+            entry_path = os.path.join(group_dir, entry)
+            if not os.path.isdir(entry_path):
+                continue
+            try:
+                used = os.path.getmtime(os.path.join(entry_path, 'manifest.json'))
+            except OSError:
+                used = None
+            versions.append((used, entry_path))
+
+        kept = sorted((version for version in versions if version[0] is not None), reverse=True)[:KEPT_VERSIONS]
+        kept_paths = {path for _, path in kept}
+        # Workers still mapping a deleted version keep its inodes alive until they exit
+        for _, entry_path in versions:
+            if entry_path not in kept_paths:
+                shutil.rmtree(entry_path, ignore_errors=True)
+
+    @staticmethod
+    def _attach(version_dir: str, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        values = {}
+        for key in manifest['arrays']:
+            values[key] = np.load(os.path.join(version_dir, f"{key}.npy"), mmap_mode='r')
+        for key in manifest['objects']:
+            with open(os.path.join(version_dir, f"{key}.pkl"), 'rb') as f:
+                values[key] = pickle.load(f)
+        return values
+
+
+def shared_state_store() -> Optional[SharedStateStore]:
+    """The configured store, or None when workers keep private copies"""
+    if not config.SHARED_STATE_DIR:
+        return None
+    return SharedStateStore(config.SHARED_STATE_DIR)
+
+
+def main():
+    """Build every shared group so workers only have to attach"""
+    if not config.SHARED_STATE_DIR:
+        raise SystemExit("Set KMART_SHARED_STATE_DIR to build shared state")
+
+    from src.data.data_manager import DataManager
+    from src.services.ml_services import MLServices
+
+    data_manager = DataManager()
+    data_manager.load_models()
+    MLServices(data_manager)
+    data_manager.close()
+    print(f"Shared state ready in {config.SHARED_STATE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Immutable data snapshots shared between request threads in KMart ML API
+"""
+
+from dataclasses import dataclass, replace
+from typing import Any, Optional
+
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class DataSnapshot:
+    """One consistent version of the catalog, its models and the interaction table.
+
+    Readers take ``data_manager.snapshot`` once and use only that object for
+    the rest of the request. Writers never mutate a published snapshot; they
+    publish a replacement, which is a single reference assignment.
+    """
+
+    version: int = 0
+    # Content hash of the product table, stable across processes and restarts
+    fingerprint: str = ''
+    product_df: Optional[pd.DataFrame] = None
+    catalog: Any = None
+    embedding_store: Any = None
+    factor_model: Any = None
+    interaction_df: Optional[pd.DataFrame] = None
+    # Search and ranking structures the services built for this catalog
+    indexes: Any = None
+
+    def evolve(self, **changes) -> "DataSnapshot":
+        """Copy of this snapshot with some fields replaced"""
+        return replace(self, **changes)
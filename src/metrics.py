@@ -0,0 +1,207 @@
+"""
+In-process request and stage metrics for KMart ML API, exported in
+Prometheus text format by ``GET /metrics``
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+
+# Upper bounds in seconds; chosen around the API's millisecond-scale handlers
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, label_values: Tuple[str, ...] = (), amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+            for labels, value in values
+        ]
+
+
+class Histogram:
+    """Fixed-bucket histogram per label set; observing is one bisect and three adds"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (non-cumulative, last is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, label_values: Tuple[str, ...], value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, label_values: Tuple[str, ...]):
+        """Observe the wall-clock duration of the enclosed block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(label_values, time.perf_counter() - started)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted(
+                (labels, (list(counts), total, count))
+                for labels, (counts, total, count) in self._series.items()
+            )
+        lines = []
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Every metric the process exports, in registration order"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.counter(
+    'kmart_http_requests_total', 'HTTP requests by route template and status code',
+    ('method', 'route', 'status')
+)
+HTTP_REQUEST_DURATION = registry.histogram(
+    'kmart_http_request_duration_seconds', 'HTTP request latency by route template',
+    ('method', 'route')
+)
+STAGE_DURATION = registry.histogram(
+    'kmart_stage_duration_seconds', 'Time spent in each stage of a service operation',
+    ('component', 'operation', 'stage')
+)
+
+MATERIALIZED_RECOMMENDATIONS = registry.counter(
+    'kmart_materialized_recommendations_total',
+    'Users looked up in the precomputed recommendations: hit, miss or stale',
+    ('result',)
+)
+
+SINGLE_FLIGHT_CALLS = registry.counter(
+    'kmart_single_flight_calls_total',
+    'Service calls that ran a computation or shared one already in flight',
+    ('operation', 'result')
+)
+
+INTERACTION_LOG_ROWS = registry.counter(
+    'kmart_interaction_log_rows_total',
+    'Interaction rows appended to the log (written), in failed appends that are retried, '
+    'or dropped at shutdown after a failed append',
+    ('result',)
+)
+
+
+def stage(component: str, operation: str, name: str):
+    """Time a stage of a service operation, e.g. stage('ml', 'search', 'vectorize')"""
+    return STAGE_DURATION.time((component, operation, name))
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them per route template.
+
+    Routes are labelled by their template (``/products/{product_id}``), so
+    ids never inflate the number of series; unrouted requests share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            route_label = getattr(route, 'path', None) or 'unmatched'
+            method = scope.get('method', '')
+            HTTP_REQUEST_DURATION.observe((method, route_label), time.perf_counter() - started)
+            HTTP_REQUESTS.inc((method, route_label, str(status[0])))
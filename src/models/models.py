@@ -2,6 +2,7 @@
 models for KMart ML API
 """
 
+from datetime import datetime
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 
@@ -14,6 +15,14 @@ class SearchRequest(BaseModel):
     query: str
     num_results: int = 10   
 
+class BatchRecommendationRequest(BaseModel):
+    user_ids: List[str]
+    num_recommendations: int = 10
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    num_results: int = 10
+
 class ProductRecommendation(BaseModel):
     product_id: str
     name: str
@@ -28,12 +37,28 @@ class SearchResult(BaseModel):
     price: Optional[float] = None
     score: float
 
+class BatchRecommendationResult(BaseModel):
+    user_id: str
+    recommendations: List[ProductRecommendation]
+
+class BatchSearchResult(BaseModel):
+    query: str
+    results: List[SearchResult]
+
 class TrendingProduct(BaseModel):
     product_id: str
     name: str
     description: Optional[str] = None
     price: Optional[float] = None
     interaction_count: int
+    trending_score: Optional[float] = None
+
+class AlsoInteractedProduct(BaseModel):
+    product_id: str
+    name: str
+    description: Optional[str] = None
+    price: Optional[float] = None
+    co_interaction_score: float
 
 class SimilarProduct(BaseModel):
     product_id: str
@@ -81,4 +106,19 @@ class SearchInteraction(BaseModel):
 class InteractionResponse(BaseModel):
     success: bool
     message: str
-    interaction_id: Optional[str] = None 
\ No newline at end of file
+    interaction_id: Optional[str] = None
+
+
+class BulkInteraction(BaseModel):
+    user_id: str
+    product_id: str = ''  # Empty for search interactions
+    interaction_type: str  # Any type accepted by the single-event endpoints
+    metadata: Dict[str, Any] = {}
+    timestamp: Optional[datetime] = None  # When the event happened, for events buffered offline; defaults to receipt
+
+class BatchInteractionResponse(BaseModel):
+    success: bool
+    accepted: int
+    rejected: int
+    interaction_ids: List[str] = []
+    errors: List[Dict[str, Any]] = []  # {"line": n, "error": "..."} per rejected line
@@ -0,0 +1,256 @@
+"""
+Item-item co-interaction model for KMart ML API ("customers who viewed,
+liked or carted this also...")
+"""
+
+import threading
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix, diags
+from typing import Dict, List, Optional, Tuple
+
+from src.services.trending import INTERACTION_WEIGHTS
+
+
+def _user_item_weight(raw: float) -> float:
+    """Weight of a user-item pair from its summed interaction weights; unlikes cancel likes"""
+    return float(np.log1p(raw)) if raw > 0 else 0.0
+
+
+class _Base:
+    """Immutable CSR state built from a user x item matrix of summed interaction weights"""
+
+    def __init__(self, raw: csr_matrix, user_to_row: Dict[str, int], num_items: int, neighbours: int):
+        self.raw = raw
+        self.user_to_row = user_to_row
+        self.num_items = num_items
+
+        weights = raw.copy()
+        weights.data = np.log1p(np.maximum(weights.data, 0.0))
+        weights.eliminate_zeros()
+        # Item x item co-occurrence; the diagonal holds each item's squared norm
+        self.co = (weights.T @ weights).tocsr()
+        self.diagonal = self.co.diagonal()
+
+        # Cosine of the item columns, self-pairs dropped, best `neighbours` kept per item
+        inverse_norms = np.divide(1.0, np.sqrt(self.diagonal), out=np.zeros(num_items), where=self.diagonal > 0)
+        cosine = (diags(inverse_norms) @ self.co @ diags(inverse_norms)).tocsr()
+        cosine.setdiag(0)
+        cosine.eliminate_zeros()
+        indptr = np.zeros(num_items + 1, dtype=np.int64)
+        columns, scores = [], []
+        for item in range(num_items):
+            start, end = cosine.indptr[item], cosine.indptr[item + 1]
+            top = _top(cosine.indices[start:end], cosine.data[start:end], neighbours)
+            columns.append(top[0])
+            scores.append(top[1])
+            indptr[item + 1] = indptr[item] + len(top[0])
+        self.neighbour_indptr = indptr
+        self.neighbour_columns = np.concatenate(columns) if columns else np.zeros(0, dtype=np.int32)
+        self.neighbour_scores = np.concatenate(scores) if scores else np.zeros(0)
+
+    def user_weights(self, user_id: str) -> Dict[int, float]:
+        row = self.user_to_row.get(user_id)
+        if row is None:
+            return {}
+        start, end = self.raw.indptr[row], self.raw.indptr[row + 1]
+        return dict(zip(self.raw.indices[start:end].tolist(), self.raw.data[start:end].tolist()))
+
+
+def _top(columns, scores, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Highest scoring columns, ties broken by column"""
+    # Rounding can leave a cancelled pair a hair above zero
+    keep = scores > 1e-9
+    columns, scores = columns[keep], scores[keep]
+    order = np.lexsort((columns, -scores))[:limit]
+    return columns[order], scores[order]
+
+
+class _DeltaLayer:
+    """Co-occurrence changes since a base was built, per item column"""
+
+    def __init__(self):
+        self.co: Dict[int, Dict[int, float]] = {}
+        self.diagonal: Dict[int, float] = {}
+        self.users = set()
+        self.updates = 0
+
+
+class CoInteractionModel:
+    """Item-item neighbours from the interaction log, kept current as events arrive.
+
+    Each user's interactions with an item are summed with
+    ``INTERACTION_WEIGHTS`` (unlikes cancel likes) and damped with log1p
+    into a sparse user x item matrix X; ``X.T @ X`` gives co-occurrence
+    and the top neighbours of every item by cosine are precomputed.
+
+    New events update the affected co-occurrence entries in a delta layer
+    (cost: the number of items the user has interacted with), and items
+    with pending changes are scored from their base row plus the deltas.
+    After ``compact_after`` updates the deltas are folded into a new CSR
+    base on a background thread while a fresh layer takes new events.
+    """
+
+    def __init__(self, item_ids: List[str], base: _Base, neighbours: int = 50, compact_after: int = 10000):
+        self.neighbours = neighbours
+        self.compact_after = compact_after
+        self.item_ids = item_ids
+        self.item_to_col = {item_id: col for col, item_id in enumerate(item_ids)}
+        self._base = base
+        # Absolute summed weights of users changed since the base was built
+        self._user_weights: Dict[str, Dict[int, float]] = {}
+        self._layers = [_DeltaLayer()]
+        self._compacting = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_index(cls, interaction_index, neighbours: int = 50, compact_after: int = 10000) -> "CoInteractionModel":
+        """Build the model from already-loaded interactions"""
+        users, items, weights = [], [], []
+        user_to_row: Dict[str, int] = {}
+        item_to_col: Dict[str, int] = {}
+        for record in interaction_index.records:
+            weight = INTERACTION_WEIGHTS.get(record.get('interaction_type'))
+            user_id, product_id = str(record.get('user_id') or ''), str(record.get('product_id') or '')
+            if weight is None or not user_id or not product_id:
+                continue
+            users.append(user_to_row.setdefault(user_id, len(user_to_row)))
+            items.append(item_to_col.setdefault(product_id, len(item_to_col)))
+            weights.append(weight)
+
+        # Duplicate (user, item) pairs are summed by the conversion
+        raw = coo_matrix(
+            (np.asarray(weights, dtype=np.float64), (np.asarray(users, dtype=np.int64), np.asarray(items, dtype=np.int64))),
+            shape=(len(user_to_row), len(item_to_col))
+        ).tocsr()
+        base = _Base(raw, user_to_row, len(item_to_col), neighbours)
+        return cls(list(item_to_col), base, neighbours, compact_after)
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    def record_event(self, record, event_time: float):
+        """Apply one interaction record (as stored in InteractionIndex)"""
+        weight = INTERACTION_WEIGHTS.get(record.get('interaction_type'))
+        user_id, product_id = str(record.get('user_id') or ''), str(record.get('product_id') or '')
+        if weight is None or not user_id or not product_id:
+            return
+
+        with self._lock:
+            col = self.item_to_col.get(product_id)
+            if col is None:
+                col = self.item_to_col[product_id] = len(self.item_ids)
+                self.item_ids.append(product_id)
+
+            user_weights = self._user_weights.get(user_id)
+            if user_weights is None:
+                user_weights = self._user_weights[user_id] = self._base.user_weights(user_id)
+            old_raw = user_weights.get(col, 0.0)
+            user_weights[col] = old_raw + weight
+            old, new = _user_item_weight(old_raw), _user_item_weight(old_raw + weight)
+
+            layer = self._layers[-1]
+            layer.users.add(user_id)
+            if new != old:
+                change = new - old
+                co_row = layer.co.setdefault(col, {})
+                for other, other_raw in user_weights.items():
+                    other_weight = _user_item_weight(other_raw)
+                    if other == col or other_weight == 0.0:
+                        continue
+                    co_row[other] = co_row.get(other, 0.0) + change * other_weight
+                    other_row = layer.co.setdefault(other, {})
+                    other_row[col] = other_row.get(col, 0.0) + change * other_weight
+                layer.diagonal[col] = layer.diagonal.get(col, 0.0) + new * new - old * old
+                layer.updates += 1
+
+            if sum(delta.updates for delta in self._layers) >= self.compact_after and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self.compact, name="kmart-co-interactions", daemon=True).start()
+
+    def compact(self):
+        """Fold the pending changes into a new CSR base"""
+        with self._lock:
+            self._compacting = True
+            base = self._base
+            frozen_weights = {user_id: dict(weights) for user_id, weights in self._user_weights.items()}
+            num_items = len(self.item_ids)
+            # Events from here on go to a new layer, which stays valid on top of the new base
+            self._layers.append(_DeltaLayer())
+
+        try:
+            rows, columns, values = [], [], []
+            user_to_row = dict(base.user_to_row)
+            untouched = np.ones(base.raw.shape[0], dtype=bool)
+            for user_id, weights in frozen_weights.items():
+                row = user_to_row.setdefault(user_id, len(user_to_row))
+                if row < len(untouched):
+                    untouched[row] = False
+                rows.extend([row] * len(weights))
+                columns.extend(weights)
+                values.extend(weights.values())
+
+            kept = base.raw[np.flatnonzero(untouched)].tocoo() if untouched.any() else None
+            if kept is not None:
+                rows.extend(np.flatnonzero(untouched)[kept.row].tolist())
+                columns.extend(kept.col.tolist())
+                values.extend(kept.data.tolist())
+            raw = coo_matrix(
+                (np.asarray(values, dtype=np.float64), (np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64))),
+                shape=(len(user_to_row), num_items)
+            ).tocsr()
+            new_base = _Base(raw, user_to_row, num_items, self.neighbours)
+        except Exception as e:
+            print(f"Warning: Co-interaction compaction failed: {e}")
+            with self._lock:
+                self._compacting = False
+            return
+
+        with self._lock:
+            current = self._layers[-1]
+            self._base = new_base
+            self._layers = [current]
+            # Users untouched since the freeze are now fully described by the base
+            self._user_weights = {user_id: self._user_weights[user_id] for user_id in current.users}
+            self._compacting = False
+
+    def similar(self, product_id: str, limit: int = 10) -> Tuple[List[str], np.ndarray]:
+        """Return (product_ids, scores) of the items most often co-interacted with, by cosine"""
+        with self._lock:
+            col = self.item_to_col.get(product_id)
+            if col is None or limit <= 0:
+                return [], np.zeros(0)
+            base = self._base
+            if limit <= self.neighbours and col < base.num_items and not self._has_changes(col):
+                start, end = base.neighbour_indptr[col], base.neighbour_indptr[col + 1]
+                columns, scores = base.neighbour_columns[start:end][:limit], base.neighbour_scores[start:end][:limit]
+            else:
+                columns, scores = self._score_row(col, limit)
+            return [self.item_ids[column] for column in columns], scores
+
+    def _has_changes(self, col: int) -> bool:
+        return any(col in layer.co or col in layer.diagonal for layer in self._layers)
+
+    def _diagonal(self, col: int) -> float:
+        value = self._base.diagonal[col] if col < self._base.num_items else 0.0
+        return value + sum(layer.diagonal.get(col, 0.0) for layer in self._layers)
+
+    def _score_row(self, col: int, limit: int):
+        """Cosine of one item against every co-occurring item, from the base row plus deltas"""
+        base = self._base
+        row: Dict[int, float] = {}
+        if col < base.num_items:
+            start, end = base.co.indptr[col], base.co.indptr[col + 1]
+            row = dict(zip(base.co.indices[start:end].tolist(), base.co.data[start:end].tolist()))
+        for layer in self._layers:
+            for other, change in layer.co.get(col, {}).items():
+                row[other] = row.get(other, 0.0) + change
+        row.pop(col, None)
+
+        own = self._diagonal(col)
+        if not row or own <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        columns = np.fromiter(row.keys(), dtype=np.int64, count=len(row))
+        values = np.fromiter(row.values(), dtype=np.float64, count=len(row))
+        norms = np.sqrt(own * np.array([self._diagonal(column) for column in columns.tolist()]))
+        scores = np.divide(values, norms, out=np.zeros(len(values)), where=norms > 0)
+        return _top(columns, scores, limit)
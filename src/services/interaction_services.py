@@ -2,14 +2,22 @@
 Interaction tracking services for KMart ML API
 """
 
-import json
 import pandas as pd
+from pydantic import TypeAdapter, ValidationError
 from typing import List, Dict, Any
 from src.models.models import (
     ProductViewInteraction, FavoritesInteraction, CartInteraction,
-    ChatInteraction, ReviewInteraction, SearchInteraction, InteractionResponse
+    ChatInteraction, ReviewInteraction, SearchInteraction, InteractionResponse,
+    BulkInteraction, BatchInteractionResponse
 )
 
+# Interaction types accepted by /interactions/batch, as in the single-event endpoints
+BULK_INTERACTION_TYPES = {
+    'view', 'view_details', 'like', 'unlike', 'add_to_cart', 'chat_message', 'rating', 'search'
+}
+
+_bulk_adapter = TypeAdapter(List[BulkInteraction])
+
 class InteractionServices:
     def __init__(self, data_manager):
         self.data_manager = data_manager
@@ -246,31 +254,119 @@ class InteractionServices:
         except Exception as e:
             raise Exception(f"Error tracking search interaction: {str(e)}")
     
-    def get_user_interactions(self, user_id: str, limit: int = 50) -> Dict[str, Any]:
-        """Get all interactions for a specific user"""
+    def track_batch(self, payload: bytes) -> BatchInteractionResponse:
+        """Track a newline-delimited JSON batch of mixed interactions in one append"""
         try:
-            user_interactions = self.data_manager.interaction_df[self.data_manager.interaction_df['userId'] == user_id]
-            user_interactions = user_interactions.sort_values('timestamp', ascending=False).head(limit)
+            lines = [(number, line) for number, line in enumerate(payload.splitlines(), start=1) if line.strip()]
+            events, errors = self._validate_bulk(lines)
+            
+            # Enrich all product events with one join against the catalog columns
+            catalog = self.data_manager.snapshot.catalog
+            product_rows = pd.Series([event.product_id for _, event in events], dtype=object).map(catalog.id_to_row)
             
             interactions = []
-            for _, row in user_interactions.iterrows():
-                # Safely parse metadata JSON
-                try:
-                    metadata = json.loads(row.get('metadata', '{}')) if pd.notna(row.get('metadata')) and row.get('metadata') != '{}' else {}
-                except (json.JSONDecodeError, TypeError):
-                    metadata = {}
+            for (number, event), row in zip(events, product_rows):
+                if event.interaction_type not in BULK_INTERACTION_TYPES:
+                    errors.append({'line': number, 'error': f"Invalid interaction type '{event.interaction_type}'"})
+                    continue
+                if event.interaction_type != 'search' and not event.product_id:
+                    errors.append({'line': number, 'error': "product_id is required"})
+                    continue
+                
+                metadata = dict(event.metadata)
+                if event.interaction_type != 'search' and not pd.isna(row):
+                    row = int(row)
+                    metadata.update(self._product_metadata(
+                        event.interaction_type, metadata,
+                        catalog.names[row], catalog.category_of(row), float(catalog.prices[row])
+                    ))
                 
-                interaction = {
-                    'interaction_id': row['interactionId'],
-                    'product_id': row['productId'],
-                    'interaction_type': row['interactionType'],
-                    'timestamp': row['timestamp'].isoformat(),
-                    'quantity': row.get('quantity', ''),
-                    'rating': row.get('rating', ''),
-                    'review': row.get('review', ''),
+                interaction_data = {
+                    'user_id': event.user_id,
+                    'product_id': event.product_id if event.interaction_type != 'search' else '',
+                    'interaction_type': event.interaction_type,
                     'metadata': metadata
                 }
-                interactions.append(interaction)
+                if event.interaction_type == 'add_to_cart':
+                    interaction_data['quantity'] = metadata.get('quantity', 1)
+                elif event.interaction_type == 'rating':
+                    interaction_data['rating'] = metadata.get('rating_value', 0)
+                    interaction_data['review'] = metadata.get('review_text', '')
+                if event.timestamp is not None:
+                    interaction_data['timestamp'] = event.timestamp
+                interactions.append(interaction_data)
+            
+            interaction_ids = self.data_manager.save_interactions(interactions) if interactions else []
+            
+            return BatchInteractionResponse(
+                success=not errors,
+                accepted=len(interaction_ids),
+                rejected=len(errors),
+                interaction_ids=interaction_ids,
+                errors=sorted(errors, key=lambda error: error['line'])
+            )
+        
+        except Exception as e:
+            raise Exception(f"Error tracking interaction batch: {str(e)}")
+    
+    def _validate_bulk(self, lines):
+        """Validate all lines in one pass, falling back to per-line checks on failure"""
+        if not lines:
+            return [], []
+        try:
+            events = _bulk_adapter.validate_json(b'[' + b','.join(line for _, line in lines) + b']')
+            # Every non-blank line yields at least one element, so equal counts mean
+            # one object per line; a line like `{...},{...}` is caught below instead
+            if len(events) == len(lines):
+                return [(number, event) for (number, _), event in zip(lines, events)], []
+        except ValidationError:
+            pass
+        
+        events, errors = [], []
+        for number, line in lines:
+            try:
+                events.append((number, BulkInteraction.model_validate_json(line)))
+            except ValidationError as e:
+                errors.append({'line': number, 'error': str(e.errors(include_url=False)[0]['msg'])})
+        return events, errors
+    
+    @staticmethod
+    def _product_metadata(interaction_type: str, metadata: Dict[str, Any], name: str, category: str, price: float) -> Dict[str, Any]:
+        """Product fields the single-event endpoints add to each interaction type"""
+        if interaction_type in ('view', 'view_details'):
+            return {'product_name': name, 'category': category, 'price': price,
+                    'source': metadata.get('source', 'flutter_app')}
+        if interaction_type in ('like', 'unlike'):
+            return {'product_name': name, 'category': category, 'price': price}
+        if interaction_type == 'add_to_cart':
+            return {'product_name': name, 'category': category, 'price': price,
+                    'quantity': metadata.get('quantity', 1)}
+        if interaction_type == 'chat_message':
+            return {'product_name': name,
+                    'seller_info': metadata.get('seller_info', ''),
+                    'message_length': metadata.get('message_length', 0),
+                    'chat_room_id': metadata.get('chat_room_id', '')}
+        if interaction_type == 'rating':
+            return {'product_name': name, 'category': category,
+                    'rating_value': metadata.get('rating_value', 0),
+                    'previous_rating': metadata.get('previous_rating', None)}
+        return {}
+    
+    def get_user_interactions(self, user_id: str, limit: int = 50) -> Dict[str, Any]:
+        """Get all interactions for a specific user"""
+        try:
+            interactions = []
+            for record in self.data_manager.get_user_interactions(user_id, limit):
+                interactions.append({
+                    'interaction_id': record['interaction_id'],
+                    'product_id': record['product_id'],
+                    'interaction_type': record['interaction_type'],
+                    'timestamp': record['timestamp'],
+                    'quantity': record['quantity'],
+                    'rating': record['rating'],
+                    'review': record['review'],
+                    'metadata': record['metadata']
+                })
             
             return {
                 'user_id': user_id,
@@ -284,28 +380,18 @@ class InteractionServices:
     def get_product_interactions(self, product_id: str, limit: int = 50) -> Dict[str, Any]:
         """Get all interactions for a specific product"""
         try:
-            product_interactions = self.data_manager.interaction_df[self.data_manager.interaction_df['productId'] == product_id]
-            product_interactions = product_interactions.sort_values('timestamp', ascending=False).head(limit)
-            
             interactions = []
-            for _, row in product_interactions.iterrows():
-                # Safely parse metadata JSON
-                try:
-                    metadata = json.loads(row.get('metadata', '{}')) if pd.notna(row.get('metadata')) and row.get('metadata') != '{}' else {}
-                except (json.JSONDecodeError, TypeError):
-                    metadata = {}
-                
-                interaction = {
-                    'interaction_id': row['interactionId'],
-                    'user_id': row['userId'],
-                    'interaction_type': row['interactionType'],
-                    'timestamp': row['timestamp'].isoformat(),
-                    'quantity': row.get('quantity', ''),
-                    'rating': row.get('rating', ''),
-                    'review': row.get('review', ''),
-                    'metadata': metadata
-                }
-                interactions.append(interaction)
+            for record in self.data_manager.get_product_interactions(product_id, limit):
+                interactions.append({
+                    'interaction_id': record['interaction_id'],
+                    'user_id': record['user_id'],
+                    'interaction_type': record['interaction_type'],
+                    'timestamp': record['timestamp'],
+                    'quantity': record['quantity'],
+                    'rating': record['rating'],
+                    'review': record['review'],
+                    'metadata': record['metadata']
+                })
             
             return {
                 'product_id': product_id,
@@ -314,4 +400,4 @@ class InteractionServices:
             }
         
         except Exception as e:
-            raise Exception(f"Error getting product interactions: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Error getting product interactions: {str(e)}")
@@ -0,0 +1,116 @@
+"""
+Inverted keyword index used as the search fallback in KMart ML API
+"""
+
+import bisect
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# A hit in the product name counts this much more than one in the description
+NAME_WEIGHT = 2.0
+# Prefix expansions (e.g. "lap" -> "laptop") score below exact token matches
+PREFIX_PENALTY = 0.8
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased alphanumeric tokens of a text"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class KeywordIndex:
+    """Token -> posting list of catalog rows, built once per catalog.
+
+    Queries match when every query token is found in a product, either
+    exactly or as the prefix of one of its tokens. Matches are ranked by a
+    TF-IDF style score scaled into (0, 1].
+    """
+
+    def __init__(self, names: Sequence[str], descriptions: Sequence[str]):
+        postings: Dict[str, Dict[int, float]] = {}
+        for row, (name, description) in enumerate(zip(names, descriptions)):
+            for token, weight in self._row_weights(name, description).items():
+                postings.setdefault(token, {})[row] = weight
+        self._finish(postings, len(names))
+
+    @staticmethod
+    def _row_weights(name: str, description: str) -> Counter:
+        weights = Counter()
+        for token in tokenize(name or ''):
+            weights[token] += NAME_WEIGHT
+        for token in tokenize(description or ''):
+            weights[token] += 1.0
+        return weights
+
+    def _finish(self, postings: Dict[str, Dict[int, float]], num_rows: int):
+        num_rows = max(num_rows, 1)
+        self.postings = postings
+        self.vocabulary = sorted(postings)
+        self.idf = {
+            token: math.log(1.0 + num_rows / len(rows)) for token, rows in postings.items()
+        }
+
+    def extended(self, names: Sequence[str], descriptions: Sequence[str], first_new_row: int) -> "KeywordIndex":
+        """New index with rows from ``first_new_row`` on added; this one is left untouched.
+
+        Only the posting lists of tokens in the new rows are copied, so
+        appending a few products costs far less than a rebuild.
+        """
+        postings = dict(self.postings)
+        copied = set()
+        for row in range(first_new_row, len(names)):
+            for token, weight in self._row_weights(names[row], descriptions[row]).items():
+                if token not in copied:
+                    postings[token] = dict(postings.get(token, {}))
+                    copied.add(token)
+                postings[token][row] = weight
+
+        index = KeywordIndex.__new__(KeywordIndex)
+        index._finish(postings, len(names))
+        return index
+
+    def _expand(self, token: str) -> List[Tuple[str, float]]:
+        """Index tokens matching a query token, with their match factor"""
+        matches = []
+        if token in self.postings:
+            matches.append((token, 1.0))
+        if len(token) < 2:
+            return matches
+        position = bisect.bisect_right(self.vocabulary, token)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(token):
+            matches.append((self.vocabulary[position], PREFIX_PENALTY))
+            position += 1
+        return matches
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[int, float]]:
+        """Return (row, score) pairs of products matching every query token"""
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens or limit <= 0:
+            return []
+
+        totals = None
+        best_possible = 0.0
+        for token in query_tokens:
+            term_scores: Dict[int, float] = {}
+            for candidate, factor in self._expand(token):
+                idf = self.idf[candidate]
+                for row, weight in self.postings[candidate].items():
+                    score = factor * idf * (1.0 + math.log(weight))
+                    if score > term_scores.get(row, 0.0):
+                        term_scores[row] = score
+            if not term_scores:
+                return []
+            best_possible += max(term_scores.values())
+
+            if totals is None:
+                totals = term_scores
+            else:
+                totals = {row: totals[row] + score for row, score in term_scores.items() if row in totals}
+                if not totals:
+                    return []
+
+        ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [(row, score / best_possible) for row, score in ranked]
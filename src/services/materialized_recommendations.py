@@ -0,0 +1,229 @@
+"""
+Precomputed top-N recommendations for KMart ML API
+
+A batch job scores users with the collaborative filtering model across a
+process pool and writes their best items to fixed-width memory-mapped
+arrays, so ``/recommendations`` answers those users with a lookup:
+
+    python -m src.services.materialized_recommendations
+    python -m src.services.materialized_recommendations --most-active 100000 --top-n 50
+
+Layout of ``KMART_MATERIALIZED_RECS_DIR``:
+
+    users.npy    user id of each entry (fixed-width unicode), the offset index
+    rows.npy     int32 (users, top_n) catalog rows, best first, -1 past the end
+    scores.npy   float32 (users, top_n) model scores
+    meta.json    format, catalog fingerprint and model signature it was built for
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # pragma: no cover - installed with scikit-learn
+    threadpool_limits = None
+
+from src import config
+from src.data.factor_model import top_items
+
+MATERIALIZED_FORMAT = 1
+# Users per task sent to a worker process
+CHUNK_USERS = 4096
+
+# Set in each worker process by _init_worker
+_worker_state = {}
+
+
+class MaterializedRecommendations:
+    """Memory-mapped top-N rows and scores per user, with a user id -> offset map.
+
+    Entries are only served while the snapshot still has the catalog and
+    model they were computed from, and for requests of at most ``top_n``.
+    """
+
+    def __init__(self, user_ids, rows, scores, meta: Dict):
+        self.rows = rows
+        self.scores = scores
+        self.meta = meta
+        self.top_n = rows.shape[1]
+        self.offsets = {user_id: offset for offset, user_id in enumerate(user_ids.tolist())}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["MaterializedRecommendations"]:
+        """Map a written store, or None if there is none in the current format"""
+        try:
+            with open(os.path.join(directory, 'meta.json')) as f:
+                meta = json.load(f)
+            if meta.get('format') != MATERIALIZED_FORMAT:
+                return None
+            return cls(
+                np.load(os.path.join(directory, 'users.npy')),
+                np.load(os.path.join(directory, 'rows.npy'), mmap_mode='r'),
+                np.load(os.path.join(directory, 'scores.npy'), mmap_mode='r'),
+                meta
+            )
+        except (OSError, ValueError):
+            return None
+
+    def current_for(self, fingerprint: str, model) -> bool:
+        """Whether the entries were computed for this catalog and model and are not too old"""
+        if model is None or self.meta.get('fingerprint') != fingerprint:
+            return False
+        if self.meta.get('model_signature') != model.signature:
+            return False
+        max_age = config.MATERIALIZED_RECS_MAX_AGE_SECONDS
+        return max_age <= 0 or time.time() - self.meta.get('built_at', 0) <= max_age
+
+    def lookup(self, user_id: str, limit: int):
+        """(rows, scores) of a user's best ``limit`` items, or None if the user has no entry"""
+        offset = self.offsets.get(user_id)
+        if offset is None or limit > self.top_n:
+            return None
+        # Same clamp as live scoring: a negative bound would slice from the end
+        rows = self.rows[offset, :max(limit, 0)]
+        count = int(np.count_nonzero(rows >= 0))
+        return rows[:count].astype(np.intp), self.scores[offset, :count]
+
+
+def select_users(model, interaction_index=None, most_active: int = 0) -> List[str]:
+    """Users with factors, all of them or the ``most_active`` by logged interactions"""
+    if most_active <= 0 or interaction_index is None:
+        return sorted(model.user_index, key=model.user_index.get)
+    activity = sorted(
+        ((len(positions), user_id) for user_id, positions in interaction_index.by_user.items()
+         if user_id in model.user_index),
+        key=lambda item: (-item[0], item[1])
+    )
+    return [user_id for _, user_id in activity[:most_active]]
+
+
+def _init_worker(item_factors, item_rows, top_n: int, rows_path: str, scores_path: str):
+    # The pool provides the parallelism; a multi-threaded BLAS per worker would oversubscribe the cores
+    if threadpool_limits is not None:
+        _worker_state['blas_limit'] = threadpool_limits(limits=1, user_api='blas')
+    _worker_state.update(
+        item_factors=item_factors,
+        item_rows=item_rows,
+        top_n=top_n,
+        rows=np.load(rows_path, mmap_mode='r+'),
+        scores=np.load(scores_path, mmap_mode='r+')
+    )
+
+
+def _score_chunk(start: int, users) -> int:
+    """Score one block of users and write it to the shared output files"""
+    state = _worker_state
+    top, top_scores = top_items(users, state['item_factors'], state['top_n'])
+    end = start + len(users)
+    state['rows'][start:end, :top.shape[1]] = state['item_rows'][top]
+    state['scores'][start:end, :top.shape[1]] = top_scores
+    return len(users)
+
+
+def _score_users(model, user_ids: List[str], top_n: int, rows_path: str, scores_path: str,
+                 workers: int, chunk_users: int):
+    factor_indexes = np.array([model.user_index[user_id] for user_id in user_ids], dtype=np.int64)
+    initargs = (model.item_factors, model.item_rows.astype(np.int32), top_n, rows_path, scores_path)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+        # A few chunks in flight per worker bounds the user factors waiting in the queue
+        pending = deque()
+        for start in range(0, len(user_ids), chunk_users):
+            users = model.user_factors[factor_indexes[start:start + chunk_users]]
+            pending.append(pool.submit(_score_chunk, start, users))
+            if len(pending) >= 2 * workers:
+                pending.popleft().result()
+        while pending:
+            pending.popleft().result()
+
+
+def write_store(directory: str, model, fingerprint: str, user_ids: List[str], top_n: int,
+                workers: int = 0, chunk_users: int = CHUNK_USERS) -> Dict:
+    """Score ``user_ids`` in a process pool and write the store atomically; returns its meta"""
+    started = time.perf_counter()
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.recs-', dir=parent)
+    try:
+        width = max((len(user_id) for user_id in user_ids), default=1)
+        np.save(os.path.join(staging, 'users.npy'), np.array(user_ids, dtype=f'<U{width}'))
+        rows_path = os.path.join(staging, 'rows.npy')
+        scores_path = os.path.join(staging, 'scores.npy')
+        rows = np.lib.format.open_memmap(rows_path, mode='w+', dtype=np.int32, shape=(len(user_ids), top_n))
+        rows[:] = -1
+        scores = np.lib.format.open_memmap(scores_path, mode='w+', dtype=np.float32, shape=(len(user_ids), top_n))
+        rows.flush()
+        scores.flush()
+        del rows, scores
+
+        if user_ids and len(model.item_rows):
+            _score_users(model, user_ids, top_n, rows_path, scores_path, workers or os.cpu_count() or 1, chunk_users)
+
+        meta = {
+            'format': MATERIALIZED_FORMAT,
+            'fingerprint': fingerprint,
+            'model_signature': model.signature,
+            'users': len(user_ids),
+            'top_n': top_n,
+            'built_at': time.time(),
+            'seconds': round(time.perf_counter() - started, 3)
+        }
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(staging, directory)
+        return meta
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def main():
+    """Materialize recommendations for the current catalog and collaborative filtering model"""
+    from src.data.data_manager import DataManager
+
+    parser = argparse.ArgumentParser(description="Precompute KMart ML API recommendations")
+    parser.add_argument('--top-n', type=int, default=config.MATERIALIZED_RECS_TOP_N,
+                        help="Items stored per user; larger requests are scored live")
+    parser.add_argument('--most-active', type=int, default=0,
+                        help="Only the users with the most logged interactions (default: every user with factors)")
+    parser.add_argument('--workers', type=int, default=0, help="Worker processes (default: CPU count)")
+    parser.add_argument('--chunk-users', type=int, default=CHUNK_USERS, help="Users per worker task")
+    args = parser.parse_args()
+
+    if not config.MATERIALIZED_RECS_DIR:
+        raise SystemExit("Set KMART_MATERIALIZED_RECS_DIR to materialize recommendations")
+
+    data_manager = DataManager()
+    data_manager.load_models()
+    snapshot = data_manager.snapshot
+    data_manager.close()
+    model = snapshot.factor_model
+    if model is None:
+        print("Skipping materialized recommendations: no collaborative filtering model")
+        return
+
+    user_ids = select_users(model, data_manager.interaction_index, args.most_active)
+    if not user_ids:
+        print("Skipping materialized recommendations: no users with factors")
+        return
+    meta = write_store(config.MATERIALIZED_RECS_DIR, model, snapshot.fingerprint, user_ids,
+                       args.top_n, args.workers, args.chunk_users)
+    print(f"Wrote {config.MATERIALIZED_RECS_DIR}: top {meta['top_n']} for {meta['users']} users "
+          f"in {meta['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,131 +3,402 @@ ML services for KMart ML API - Optimized for Render deployment
 """
 
 import numpy as np
+from dataclasses import dataclass
 from scipy.sparse import csr_matrix
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
-from src.models.models import ProductRecommendation, SearchResult, TrendingProduct, SimilarProduct
+from typing import List, Any, Optional
+from src.models.models import ProductRecommendation, SearchResult, TrendingProduct, SimilarProduct, AlsoInteractedProduct
+from src.services.trending import TrendingCounter
+from src.services.co_interactions import CoInteractionModel
+from src.services.query_cache import QueryCache, normalize_query
+from src.services.keyword_index import KeywordIndex
+from src.services.product_fragments import ProductFragments, json_string
+from src.services.tfidf_index import load_or_build_tfidf
+from src.services.materialized_recommendations import MaterializedRecommendations
+from src.services.single_flight import SingleFlight
+from src.data.shared_state import shared_state_store
+from src import config
+from src.startup import StartupReport, startup_report
+from src.metrics import stage, MATERIALIZED_RECOMMENDATIONS
+
+@dataclass(frozen=True)
+class CatalogIndexes:
+    """Search and ranking structures built for one catalog version.
+
+    Published in the data snapshot next to the catalog they index, so a
+    request never pairs the rows of one catalog with an index of another.
+    """
+    
+    tfidf_vectorizer: Any = None
+    tfidf_matrix: Any = None
+    keyword_index: Any = None
+    # Cold-start recommendations: rows ranked by rating and interaction volume
+    popular_rows: Any = None
+    popular_scores: Any = None
+    # Pre-encoded JSON of each row's static fields, for the response fast path
+    fragments: Any = None
+    # Offline top-N per user; served only while it matches the snapshot's catalog and model
+    recommendations: Any = None
 
 class MLServices:
     def __init__(self, data_manager):
         self.data_manager = data_manager
-        # Initialize TF-IDF for text search (lighter alternative to transformers)
-        self.tfidf_vectorizer = None
-        self.tfidf_matrix = None
-        self._initialize_tfidf()
+        self.search_cache = QueryCache(
+            max_entries=config.SEARCH_CACHE_MAX_ENTRIES,
+            max_bytes=config.SEARCH_CACHE_MAX_BYTES,
+            ttl_seconds=config.SEARCH_CACHE_TTL_SECONDS
+        )
+        # Identical requests running at the same time share one computation
+        self.flights = SingleFlight(enabled=config.SINGLE_FLIGHT_ENABLED)
+        # Windowed interaction counters, rebuilt from the log and fed by new events
+        with startup_report.phase('fit', 'trending'):
+            self.trending = TrendingCounter.from_index(data_manager.interaction_index)
+        data_manager.add_interaction_listener(self.trending.record_event)
+        # Item-item co-interaction neighbours, kept current by the same events
+        with startup_report.phase('fit', 'co_interactions'):
+            self.co_interactions = CoInteractionModel.from_index(
+                data_manager.interaction_index,
+                neighbours=config.CO_INTERACTION_NEIGHBOURS,
+                compact_after=config.CO_INTERACTION_COMPACT_AFTER
+            )
+        data_manager.add_interaction_listener(self.co_interactions.record_event)
+        # Indexes for the loaded catalog; catalog reloads build theirs the same way
+        data_manager.publish(indexes=self.build_indexes(data_manager.snapshot, report=startup_report))
+        data_manager.set_index_builder(self.build_indexes)
+        # Results computed against the previous catalog/model are stale
+        self.search_cache.invalidate(self.data_manager.catalog_version)
     
-    def _initialize_tfidf(self):
-        """Initialize TF-IDF vectorizer for text search"""
+    def build_indexes(self, snapshot, previous=None, first_new_row=None,
+                      report: Optional[StartupReport] = None) -> CatalogIndexes:
+        """Build the catalog-derived structures for a snapshot, off the request path.
+        
+        With ``first_new_row``, ``snapshot``'s catalog is ``previous``'s plus
+        appended rows, and TF-IDF, the keyword index and the product
+        fragments are extended instead of rebuilt. Phases are timed into
+        ``report``: the startup report for the first build, the reload's
+        own report for a catalog reload.
+        """
+        if report is None:
+            report = StartupReport()
+        base = previous.indexes if previous is not None and first_new_row is not None else None
+        tfidf_vectorizer, tfidf_matrix = self._build_tfidf(snapshot, report, base, first_new_row)
+        with report.phase('fit', 'keyword_index'):
+            keyword_index = self._build_keyword_index(snapshot.catalog, base, first_new_row)
+        with report.phase('fit', 'popularity'):
+            popular_rows, popular_scores = self._rank_popularity(snapshot.catalog)
+        with report.phase('fit', 'product_fragments'):
+            if base is not None and base.fragments is not None:
+                fragments = base.fragments.extended(snapshot.catalog, first_new_row)
+            else:
+                fragments = ProductFragments.build(snapshot.catalog)
+        with report.phase('load', 'materialized_recommendations'):
+            recommendations = self._load_materialized_recommendations(snapshot)
+        return CatalogIndexes(
+            tfidf_vectorizer=tfidf_vectorizer,
+            tfidf_matrix=tfidf_matrix,
+            keyword_index=keyword_index,
+            popular_rows=popular_rows,
+            popular_scores=popular_scores,
+            fragments=fragments,
+            recommendations=recommendations
+        )
+    
+    def _build_tfidf(self, snapshot, report: StartupReport, base=None, first_new_row=None):
+        """TF-IDF vectorizer and product matrix for a snapshot, or (None, None) on failure"""
         try:
-            # Combine product names and descriptions for TF-IDF
-            texts = []
-            for _, product in self.data_manager.product_df.iterrows():
-                name = product.get('name', '')
-                description = product.get('description', '')
-                texts.append(f"{name} {description}")
+            extend_from = None
+            if base is not None and base.tfidf_vectorizer is not None:
+                extend_from = (base.tfidf_vectorizer, base.tfidf_matrix, first_new_row)
+            
+            def build():
+                return load_or_build_tfidf(snapshot.product_df, snapshot.fingerprint, extend_from, report)
             
-            self.tfidf_vectorizer = TfidfVectorizer(
-                max_features=1000,
-                stop_words='english',
-                ngram_range=(1, 2)
+            store = shared_state_store()
+            if store is None:
+                fitted = build()
+            else:
+                # Fitted once per catalog; every worker maps the same CSR arrays
+                fitted = store.attach_or_build('tfidf', snapshot.fingerprint, build)
+            
+            matrix = csr_matrix(
+                (fitted['data'], fitted['indices'], fitted['indptr']),
+                shape=tuple(int(size) for size in fitted['shape']),
+                copy=False
             )
-            self.tfidf_matrix = self.tfidf_vectorizer.fit_transform(texts)
+            return fitted['vectorizer'], matrix
         except Exception as e:
             print(f"Warning: TF-IDF initialization failed: {e}")
+            return None, None
+    
+    def _build_keyword_index(self, catalog, base=None, first_new_row=None):
+        """Build the inverted index behind the keyword search fallback"""
+        try:
+            if base is not None and base.keyword_index is not None:
+                return base.keyword_index.extended(catalog.names, catalog.descriptions, first_new_row)
+            return KeywordIndex(catalog.names, catalog.descriptions)
+        except Exception as e:
+            print(f"Warning: Keyword index initialization failed: {e}")
+            return None
+    
+    def _load_materialized_recommendations(self, snapshot):
+        """Map the precomputed recommendations, if the batch job has written them"""
+        if not config.MATERIALIZED_RECS_DIR or snapshot.factor_model is None:
+            return None
+        store = MaterializedRecommendations.load(config.MATERIALIZED_RECS_DIR)
+        if store is not None and not store.current_for(snapshot.fingerprint, snapshot.factor_model):
+            print("Warning: Materialized recommendations are stale, scoring live until "
+                  "`python -m src.services.materialized_recommendations` is run again")
+        return store
+    
+    def _rank_popularity(self, catalog):
+        """Rank products by interaction volume and rating for cold-start users"""
+        counts = np.zeros(len(catalog), dtype=np.float64)
+        
+        interaction_df = self.data_manager.interaction_df
+        if interaction_df is not None and 'productId' in interaction_df.columns:
+            for product_id, count in interaction_df['productId'].value_counts().items():
+                row = catalog.row_of(product_id)
+                if row is not None:
+                    counts[row] += count
+        
+        # Rating amplified by engagement; products without interactions rank by rating
+        scores = catalog.ratings * (1.0 + np.log1p(counts))
+        order = np.lexsort((np.arange(len(scores)), -scores))
+        return order, scores[order]
     
     def get_recommendations(self, user_id: str, num_recommendations: int = 5) -> List[ProductRecommendation]:
-        """Get product recommendations for a user"""
+        """Get personalized product recommendations for a user"""
+        return self.get_recommendations_batch([user_id], num_recommendations)[0]
+    
+    def get_recommendations_batch(self, user_ids: List[str], num_recommendations: int = 5) -> List[List[ProductRecommendation]]:
+        """Get recommendations for several users, scoring known users in one matrix product"""
         try:
-            # Simple popularity-based recommendations for now
-            # In production, you'd want to implement proper collaborative filtering
-            
-            # Get top products by rating/price ratio
-            recommendations = []
-            products = self.data_manager.product_df.copy()
+            snapshot, scored = self._recommend_batch(user_ids, num_recommendations)
+            catalog = snapshot.catalog
             
-            # Calculate a simple score based on rating and price
-            products['score'] = products['rating'].fillna(3.0) / (products['price'].fillna(10.0) + 1)
-            top_products = products.nlargest(num_recommendations, 'score')
+            batch = []
+            with stage('ml', 'recommendations', 'serialize'):
+                for rows, scores in scored:
+                    recommendations = []
+                    for row, score in zip(rows, scores):
+                        recommendations.append(ProductRecommendation(
+                            product_id=catalog.ids[row],
+                            name=catalog.names[row],
+                            description=catalog.descriptions[row],
+                            price=float(catalog.prices[row]),
+                            score=float(score)
+                        ))
+                    batch.append(recommendations)
             
-            for _, product in top_products.iterrows():
-                price = self.data_manager.extract_price(product)
-                
-                recommendations.append(ProductRecommendation(
-                    product_id=product.get('id', ''),
-                    name=product.get('name', 'Unknown Product'),
-                    description=product.get('description', ''),
-                    price=price,
-                    score=float(product['score'])
-                ))
-            
-            return recommendations
+            return batch
         
         except Exception as e:
             raise Exception(f"Error getting recommendations: {str(e)}")
     
-    def search_products(self, query: str, num_results: int = 5) -> List[SearchResult]:
-        """Search products using TF-IDF similarity"""
+    def recommendations_json(self, user_id: str, num_recommendations: int = 5) -> str:
+        """get_recommendations as a JSON array, assembled from the product fragments"""
         try:
-            if self.tfidf_vectorizer is None or self.tfidf_matrix is None:
-                # Fallback to simple text search
-                return self._simple_text_search(query, num_results)
+            snapshot, scored = self._recommend_batch([user_id], num_recommendations)
+            rows, scores = scored[0]
+            with stage('ml', 'recommendations', 'serialize'):
+                return snapshot.indexes.fragments.render(rows, score=scores)
+        
+        except Exception as e:
+            raise Exception(f"Error getting recommendations: {str(e)}")
+    
+    def recommendations_batch_json(self, user_ids: List[str], num_recommendations: int = 5) -> str:
+        """get_recommendations_batch as the JSON array of BatchRecommendationResult objects"""
+        try:
+            snapshot, scored = self._recommend_batch(user_ids, num_recommendations)
+            fragments = snapshot.indexes.fragments
+            with stage('ml', 'recommendations', 'serialize'):
+                return '[' + ','.join(
+                    f'{{"user_id":{json_string(user_id)},"recommendations":{fragments.render(rows, score=scores)}}}'
+                    for user_id, (rows, scores) in zip(user_ids, scored)
+                ) + ']'
+        
+        except Exception as e:
+            raise Exception(f"Error getting recommendations: {str(e)}")
+    
+    def _recommend_batch(self, user_ids: List[str], limit: int):
+        """The snapshot used and (rows, scores) per user, shared with identical concurrent calls"""
+        return self.flights.do(
+            'recommendations', (tuple(user_ids), limit),
+            lambda: self._recommend_batch_uncoalesced(user_ids, limit)
+        )
+    
+    def _recommend_batch_uncoalesced(self, user_ids: List[str], limit: int):
+        snapshot = self.data_manager.snapshot
+        with stage('ml', 'recommendations', 'lookup'):
+            scored = self._materialized_rows(snapshot, user_ids, limit)
+        with stage('ml', 'recommendations', 'score'):
+            return snapshot, self._recommend_rows(snapshot.factor_model, snapshot.indexes, user_ids, limit, scored)
+    
+    def _materialized_rows(self, snapshot, user_ids: List[str], limit: int):
+        """Precomputed (rows, scores) per user, None where the user has to be scored live"""
+        store = snapshot.indexes.recommendations
+        if store is None:
+            return [None] * len(user_ids)
+        if not store.current_for(snapshot.fingerprint, snapshot.factor_model):
+            MATERIALIZED_RECOMMENDATIONS.inc(('stale',), len(user_ids))
+            return [None] * len(user_ids)
+        
+        scored = [store.lookup(user_id, limit) for user_id in user_ids]
+        hits = sum(entry is not None for entry in scored)
+        if hits:
+            MATERIALIZED_RECOMMENDATIONS.inc(('hit',), hits)
+        if hits < len(user_ids):
+            MATERIALIZED_RECOMMENDATIONS.inc(('miss',), len(user_ids) - hits)
+        return scored
+    
+    def _recommend_rows(self, model, indexes, user_ids: List[str], limit: int, precomputed=None):
+        """Collaborative filtering rows for known users, popularity for everyone else.
+        
+        Users with a ``precomputed`` entry are not scored again.
+        """
+        # A negative slice bound would drop rows from the end instead of returning none
+        limit = max(limit, 0)
+        scored = list(precomputed) if precomputed is not None else [None] * len(user_ids)
+        live = [position for position, entry in enumerate(scored) if entry is None]
+        if live and model is not None:
+            for position, user_scores in zip(live, model.recommend_many([user_ids[position] for position in live], limit)):
+                scored[position] = user_scores
+        
+        batch = []
+        for user_scores in scored:
+            if user_scores is None:
+                batch.append((indexes.popular_rows[:limit], indexes.popular_scores[:limit]))
+                continue
             
-            # Transform query using TF-IDF
-            query_vector = self.tfidf_vectorizer.transform([query])
+            rows, scores = user_scores
+            if len(rows) >= limit:
+                batch.append((rows, scores))
+                continue
             
-            # Calculate similarities
-            similarities = cosine_similarity(query_vector, self.tfidf_matrix)[0]
-            top_indices = similarities.argsort()[::-1][:num_results]
+            # Fewer factored items than requested: pad with popular products, unscored
+            padding = indexes.popular_rows[~np.isin(indexes.popular_rows, rows)][:limit - len(rows)]
+            batch.append((
+                np.concatenate([rows, padding]),
+                np.concatenate([scores.astype(np.float64), np.zeros(len(padding))])
+            ))
+        return batch
+    
+    def search_products(self, query: str, num_results: int = 5) -> List[SearchResult]:
+        """Search products using TF-IDF similarity, serving repeated queries from cache"""
+        return self.search_products_batch([query], num_results)[0]
+    
+    def search_products_batch(self, queries: List[str], num_results: int = 5) -> List[List[SearchResult]]:
+        """Search several queries with one TF-IDF transform and one sparse matrix product"""
+        snapshot, ranked = self._search_batch(queries, num_results)
+        with stage('ml', 'search', 'serialize'):
+            return [self._search_results(snapshot.catalog, rows, scores) for rows, scores in ranked]
+    
+    def search_products_json(self, query: str, num_results: int = 5) -> str:
+        """search_products as a JSON array, assembled from the product fragments"""
+        snapshot, ranked = self._search_batch([query], num_results)
+        rows, scores = ranked[0]
+        with stage('ml', 'search', 'serialize'):
+            return snapshot.indexes.fragments.render(rows, score=scores)
+    
+    def search_products_batch_json(self, queries: List[str], num_results: int = 5) -> str:
+        """search_products_batch as the JSON array of BatchSearchResult objects"""
+        snapshot, ranked = self._search_batch(queries, num_results)
+        fragments = snapshot.indexes.fragments
+        with stage('ml', 'search', 'serialize'):
+            return '[' + ','.join(
+                f'{{"query":{json_string(query)},"results":{fragments.render(rows, score=scores)}}}'
+                for query, (rows, scores) in zip(queries, ranked)
+            ) + ']'
+    
+    def _search_batch(self, queries: List[str], num_results: int):
+        """The snapshot used and (rows, scores) per query, from cache where possible.
+        
+        Concurrent calls with the same normalized queries share one lookup
+        and computation, so a burst of misses scores a query once.
+        """
+        return self.flights.do(
+            'search', (tuple(normalize_query(query) for query in queries), num_results),
+            lambda: self._search_batch_uncoalesced(queries, num_results)
+        )
+    
+    def _search_batch_uncoalesced(self, queries: List[str], num_results: int):
+        snapshot = self.data_manager.snapshot
+        version = snapshot.version
+        batch = [None] * len(queries)
+        
+        # Cache misses grouped by key, so repeated queries in a batch are scored once
+        misses = {}
+        with stage('ml', 'search', 'cache_lookup'):
+            for position, query in enumerate(queries):
+                cache_key = (normalize_query(query), num_results)
+                cached = self.search_cache.get(cache_key, version)
+                if cached is not None:
+                    batch[position] = cached
+                else:
+                    misses.setdefault(cache_key, []).append(position)
+        
+        if misses:
+            miss_queries = [queries[positions[0]] for positions in misses.values()]
+            computed = self._search_rows_uncached(snapshot.catalog, snapshot.indexes, miss_queries, num_results)
+            for (cache_key, positions), (rows, scores) in zip(misses.items(), computed):
+                self.search_cache.put(cache_key, (rows, scores), version, size=64 + rows.nbytes + scores.nbytes)
+                for position in positions:
+                    batch[position] = (rows, scores)
+        
+        return snapshot, batch
+    
+    def _search_rows_uncached(self, catalog, indexes, queries: List[str], num_results: int):
+        """Rank products by TF-IDF similarity; (rows, scores) per query"""
+        try:
+            if indexes.tfidf_vectorizer is None or indexes.tfidf_matrix is None:
+                # Fallback to simple text search
+                return [self._simple_text_search(catalog, indexes, query, num_results) for query in queries]
             
-            results = []
-            for idx in top_indices:
-                if similarities[idx] > 0:  # Only include relevant results
-                    product_info = self.data_manager.product_df.iloc[idx]
-                    price = self.data_manager.extract_price(product_info)
-                    
-                    results.append(SearchResult(
-                        product_id=product_info.get('id', ''),
-                        name=product_info.get('name', 'Unknown Product'),
-                        description=product_info.get('description', ''),
-                        price=price,
-                        score=float(similarities[idx])
-                    ))
+            # Transform all queries at once; rows of both matrices are L2-normalized,
+            # so the sparse product holds the cosine similarities
+            with stage('ml', 'search', 'vectorize'):
+                query_matrix = indexes.tfidf_vectorizer.transform(queries)
+            with stage('ml', 'search', 'score'):
+                similarities = (query_matrix @ indexes.tfidf_matrix.T).tocsr()
             
-            return results
+            top = []
+            with stage('ml', 'search', 'topk'):
+                for position in range(len(queries)):
+                    start, end = similarities.indptr[position], similarities.indptr[position + 1]
+                    rows = similarities.indices[start:end]
+                    scores = similarities.data[start:end]
+                    relevant = scores > 0  # Only include relevant results
+                    top.append(self._top_k(rows[relevant], scores[relevant], num_results))
+            return top
         
         except Exception as e:
             # Fallback to simple search
-            return self._simple_text_search(query, num_results)
+            return [self._simple_text_search(catalog, indexes, query, num_results) for query in queries]
+    
+    def _search_results(self, catalog, rows, scores) -> List[SearchResult]:
+        """Build search results for catalog rows"""
+        results = []
+        for row, score in zip(rows, scores):
+            results.append(SearchResult(
+                product_id=catalog.ids[row],
+                name=catalog.names[row],
+                description=catalog.descriptions[row],
+                price=float(catalog.prices[row]),
+                score=float(score)
+            ))
+        return results
     
-    def _simple_text_search(self, query: str, num_results: int = 5) -> List[SearchResult]:
-        """Simple text-based search as fallback"""
+    def _simple_text_search(self, catalog, indexes, query: str, num_results: int = 5):
+        """Keyword search over the inverted index, used when TF-IDF is unavailable"""
         try:
-            query_lower = query.lower()
-            results = []
+            keyword_index = indexes.keyword_index
+            if keyword_index is None:
+                keyword_index = KeywordIndex(catalog.names, catalog.descriptions)
             
-            for _, product in self.data_manager.product_df.iterrows():
-                name = product.get('name', '').lower()
-                description = product.get('description', '').lower()
-                
-                # Simple keyword matching
-                if query_lower in name or query_lower in description:
-                    price = self.data_manager.extract_price(product)
-                    score = 0.5  # Default score for simple search
-                    
-                    results.append(SearchResult(
-                        product_id=product.get('id', ''),
-                        name=product.get('name', 'Unknown Product'),
-                        description=product.get('description', ''),
-                        price=price,
-                        score=score
-                    ))
-                    
-                    if len(results) >= num_results:
-                        break
-            
-            return results
+            with stage('ml', 'search', 'keyword_fallback'):
+                matches = keyword_index.search(query, num_results)
+            rows = np.asarray([row for row, _ in matches], dtype=np.intp)
+            scores = np.asarray([score for _, score in matches], dtype=np.float64)
+            return rows, scores
         
         except Exception as e:
             raise Exception(f"Error in simple text search: {str(e)}")
@@ -135,25 +406,19 @@ class MLServices:
     def get_trending_products(self, days: int = 7, limit: int = 10) -> List[TrendingProduct]:
         """Get trending products based on recent interactions"""
         try:
-            # Simple trending based on product ratings and recent activity
-            products = self.data_manager.product_df.copy()
-            
-            # Calculate trending score (rating * recent activity factor)
-            products['trending_score'] = products['rating'].fillna(3.0) * 1.1  # Simple trending factor
-            
-            top_trending = products.nlargest(limit, 'trending_score')
+            snapshot = self.data_manager.snapshot
+            catalog = snapshot.catalog
+            rows, trending_scores, interaction_counts = self._trending_rows(snapshot, days, limit)
             
             trending_products = []
-            for _, product in top_trending.iterrows():
-                price = self.data_manager.extract_price(product)
-                
+            for row, trending_score, interaction_count in zip(rows, trending_scores, interaction_counts):
                 trending_products.append(TrendingProduct(
-                    product_id=product.get('id', ''),
-                    name=product.get('name', 'Unknown Product'),
-                    description=product.get('description', ''),
-                    price=price,
-                    trending_score=float(product['trending_score']),
-                    days_trending=days
+                    product_id=catalog.ids[row],
+                    name=catalog.names[row],
+                    description=catalog.descriptions[row],
+                    price=float(catalog.prices[row]),
+                    interaction_count=interaction_count,
+                    trending_score=trending_score
                 ))
             
             return trending_products
@@ -161,58 +426,208 @@ class MLServices:
         except Exception as e:
             raise Exception(f"Error getting trending products: {str(e)}")
     
+    def trending_products_json(self, days: int = 7, limit: int = 10) -> str:
+        """get_trending_products as a JSON array, assembled from the product fragments"""
+        try:
+            snapshot = self.data_manager.snapshot
+            rows, trending_scores, interaction_counts = self._trending_rows(snapshot, days, limit)
+            return snapshot.indexes.fragments.render(
+                rows, interaction_count=interaction_counts, trending_score=trending_scores
+            )
+        
+        except Exception as e:
+            raise Exception(f"Error getting trending products: {str(e)}")
+    
+    def _trending_rows(self, snapshot, days: int, limit: int):
+        """Rows, trending scores and interaction counts, topped up from the popularity ranking"""
+        # Rows are only shared between calls reading the same catalog version
+        return self.flights.do(
+            'trending', (snapshot.version, days, limit),
+            lambda: self._trending_rows_uncoalesced(snapshot, days, limit)
+        )
+    
+    def _trending_rows_uncoalesced(self, snapshot, days: int, limit: int):
+        catalog = snapshot.catalog
+        rows, trending_scores, interaction_counts = [], [], []
+        
+        with stage('ml', 'trending', 'topk'):
+            top = self.trending.top(days, limit)
+        
+        for product_id, trending_score, interaction_count in top:
+            row = catalog.row_of(product_id)
+            if row is None:
+                continue
+            rows.append(row)
+            trending_scores.append(float(trending_score))
+            interaction_counts.append(int(interaction_count))
+        
+        # Quiet window: fill up with the popularity ranking
+        seen_rows = set(rows)
+        for row in snapshot.indexes.popular_rows.tolist():
+            if len(rows) >= limit:
+                break
+            if row in seen_rows:
+                continue
+            rows.append(row)
+            trending_scores.append(0.0)
+            interaction_counts.append(0)
+        
+        return rows, trending_scores, interaction_counts
+    
     def get_similar_products(self, product_id: str, limit: int = 5) -> List[SimilarProduct]:
-        """Get similar products based on category and price range"""
+        """Get similar products from embeddings, falling back to category and price range"""
         try:
-            # Find the target product
-            target_product = None
-            for _, product in self.data_manager.product_df.iterrows():
-                if product.get('id') == product_id:
-                    target_product = product
-                    break
-            
-            if target_product is None:
-                raise Exception("Product not found")
-            
-            target_price = self.data_manager.extract_price(target_product)
-            target_category = target_product.get('category', '')
-            
-            # Find similar products based on category and price
-            similar_products = []
-            for _, product in self.data_manager.product_df.iterrows():
-                if product.get('id') != product_id:  # Exclude the target product
-                    price = self.data_manager.extract_price(product)
-                    category = product.get('category', '')
-                    
-                    # Calculate similarity score
-                    price_similarity = 1.0 / (1.0 + abs(price - target_price) / max(price, target_price, 1))
-                    category_similarity = 1.0 if category == target_category else 0.3
-                    
-                    similarity_score = (price_similarity + category_similarity) / 2
-                    
-                    if similarity_score > 0.3:  # Only include reasonably similar products
-                        similar_products.append({
-                            'product': product,
-                            'score': similarity_score
-                        })
-            
-            # Sort by similarity score and return top results
-            similar_products.sort(key=lambda x: x['score'], reverse=True)
+            snapshot, rows, scores = self._similar_rows(product_id, limit)
+            catalog = snapshot.catalog
             
             results = []
-            for item in similar_products[:limit]:
-                product = item['product']
-                price = self.data_manager.extract_price(product)
-                
-                results.append(SimilarProduct(
-                    product_id=product.get('id', ''),
-                    name=product.get('name', 'Unknown Product'),
-                    description=product.get('description', ''),
-                    price=price,
-                    similarity_score=float(item['score'])
-                ))
+            with stage('ml', 'similar_products', 'serialize'):
+                for row, score in zip(rows, scores):
+                    results.append(SimilarProduct(
+                        product_id=catalog.ids[row],
+                        name=catalog.names[row],
+                        description=catalog.descriptions[row],
+                        price=float(catalog.prices[row]),
+                        similarity_score=float(score)
+                    ))
             
             return results
         
         except Exception as e:
-            raise Exception(f"Error getting similar products: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Error getting similar products: {str(e)}")
+    
+    def similar_products_json(self, product_id: str, limit: int = 5) -> str:
+        """get_similar_products as a JSON array, assembled from the product fragments"""
+        try:
+            snapshot, rows, scores = self._similar_rows(product_id, limit)
+            with stage('ml', 'similar_products', 'serialize'):
+                return snapshot.indexes.fragments.render(rows, similarity_score=scores)
+        
+        except Exception as e:
+            raise Exception(f"Error getting similar products: {str(e)}")
+    
+    def _similar_rows(self, product_id: str, limit: int):
+        """The snapshot used and the rows and scores most similar to a product"""
+        snapshot = self.data_manager.snapshot
+        catalog = snapshot.catalog
+        target_row = catalog.row_of(product_id)
+        
+        if target_row is None:
+            raise Exception("Product not found")
+        
+        weight = config.SIMILAR_PRODUCTS_CO_INTERACTION_WEIGHT
+        # Blending can promote content matches below the cut, so fetch more of them
+        content_limit = limit * 2 if weight > 0 else limit
+        with stage('ml', 'similar_products', 'score'):
+            rows, scores = self._embedding_similar_rows(snapshot.embedding_store, catalog, product_id, content_limit)
+            if rows is None:
+                rows, scores = self._score_similar_rows(catalog, target_row, content_limit)
+        if weight > 0:
+            with stage('ml', 'similar_products', 'co_interactions'):
+                rows, scores = self._blend_co_interactions(catalog, product_id, rows, scores, limit, weight)
+        return snapshot, rows[:limit], scores[:limit]
+    
+    def _blend_co_interactions(self, catalog, product_id: str, rows, scores, limit: int, weight: float):
+        """Mix content similarity with co-interaction cosine; a product missing one signal scores 0 on it"""
+        co_ids, co_scores = self.co_interactions.similar(product_id, limit * 2)
+        co_rows, co_scores = self._rows_in_catalog(catalog, co_ids, co_scores, limit * 2)
+        if len(co_rows) == 0:
+            return rows, scores
+        
+        combined = {row: (1.0 - weight) * score for row, score in zip(rows.tolist(), scores.tolist())}
+        for row, score in zip(co_rows.tolist(), co_scores.tolist()):
+            combined[row] = combined.get(row, 0.0) + weight * score
+        blended_rows = np.fromiter(combined.keys(), dtype=np.intp, count=len(combined))
+        blended_scores = np.fromiter(combined.values(), dtype=np.float64, count=len(combined))
+        return self._top_k(blended_rows, blended_scores, limit)
+    
+    def get_also_interacted(self, product_id: str, limit: int = 10) -> List[AlsoInteractedProduct]:
+        """Products the users who interacted with this one also viewed, liked or carted"""
+        try:
+            snapshot, rows, scores = self._also_interacted_rows(product_id, limit)
+            catalog = snapshot.catalog
+            return [
+                AlsoInteractedProduct(
+                    product_id=catalog.ids[row],
+                    name=catalog.names[row],
+                    description=catalog.descriptions[row],
+                    price=float(catalog.prices[row]),
+                    co_interaction_score=float(score)
+                )
+                for row, score in zip(rows, scores)
+            ]
+        
+        except Exception as e:
+            raise Exception(f"Error getting co-interacted products: {str(e)}")
+    
+    def also_interacted_json(self, product_id: str, limit: int = 10) -> str:
+        """get_also_interacted as a JSON array, assembled from the product fragments"""
+        try:
+            snapshot, rows, scores = self._also_interacted_rows(product_id, limit)
+            return snapshot.indexes.fragments.render(rows, co_interaction_score=scores)
+        
+        except Exception as e:
+            raise Exception(f"Error getting co-interacted products: {str(e)}")
+    
+    def _also_interacted_rows(self, product_id: str, limit: int):
+        """The snapshot used and the catalog rows most co-interacted with a product"""
+        snapshot = self.data_manager.snapshot
+        catalog = snapshot.catalog
+        if catalog.row_of(product_id) is None:
+            raise Exception("Product not found")
+        
+        with stage('ml', 'also_interacted', 'score'):
+            # Over-fetch a little in case some neighbours are no longer in the catalog
+            product_ids, scores = self.co_interactions.similar(product_id, limit + 5)
+            rows, scores = self._rows_in_catalog(catalog, product_ids, scores, limit)
+        return snapshot, rows, scores
+    
+    def _embedding_similar_rows(self, store, catalog, product_id: str, limit: int):
+        """Nearest catalog rows by embedding cosine, or (None, None) if unavailable"""
+        if config.SIMILAR_PRODUCTS_MODE != "embeddings" or store is None or store.row_of(product_id) is None:
+            return None, None
+        
+        # Over-fetch a little in case some neighbours are no longer in the catalog
+        neighbour_ids, neighbour_scores = store.similar(product_id, limit + 5)
+        return self._rows_in_catalog(catalog, neighbour_ids, neighbour_scores, limit)
+    
+    @staticmethod
+    def _rows_in_catalog(catalog, product_ids, scores, limit: int):
+        """Catalog rows of the first ``limit`` product ids still in the catalog, with their scores"""
+        rows, kept = [], []
+        for product_id, score in zip(product_ids, scores):
+            if len(rows) >= limit:
+                break
+            row = catalog.row_of(product_id)
+            if row is not None:
+                rows.append(row)
+                kept.append(score)
+        return np.asarray(rows, dtype=np.intp), np.asarray(kept, dtype=np.float64)
+    
+    def _score_similar_rows(self, catalog, target_row: int, limit: int):
+        """Score every catalog row against the target and return the top rows"""
+        prices = catalog.prices
+        target_price = prices[target_row]
+        
+        # Price closeness relative to the larger of the two prices
+        price_similarity = 1.0 / (1.0 + np.abs(prices - target_price) / np.maximum(np.maximum(prices, target_price), 1.0))
+        category_similarity = np.where(catalog.category_codes == catalog.category_codes[target_row], 1.0, 0.3)
+        scores = (price_similarity + category_similarity) / 2
+        
+        # Exclude the target itself (and duplicates of its id) and weak matches
+        candidate_mask = (catalog.ids != catalog.ids[target_row]) & (scores > 0.3)
+        candidates = np.flatnonzero(candidate_mask)
+        return self._top_k(candidates, scores[candidates], limit)
+    
+    @staticmethod
+    def _top_k(rows, scores, limit: int):
+        """Pick the highest scoring rows, ties broken by catalog order"""
+        if limit <= 0 or len(rows) == 0:
+            return rows[:0], scores[:0]
+        if len(rows) > limit:
+            # Partial selection, widened to keep every row tied with the cut-off
+            kth = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+            keep = scores >= kth
+            rows, scores = rows[keep], scores[keep]
+        order = np.lexsort((rows, -scores))[:limit]
+        return rows[order], scores[order]
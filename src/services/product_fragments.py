@@ -0,0 +1,68 @@
+"""
+Pre-encoded product JSON for KMart ML API responses
+"""
+
+import json
+import math
+from typing import List, Sequence
+
+_encode_string = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def json_string(value: str) -> str:
+    """A str as a JSON string literal, encoded the way the API's JSON responses are"""
+    return _encode_string(value)
+
+
+def json_float(value: float) -> str:
+    """A float as JSON; NaN and infinities become null, as the response models serialize them"""
+    return float.__repr__(value) if math.isfinite(value) else 'null'
+
+
+def _json_number(value) -> str:
+    if isinstance(value, float):
+        return json_float(value)
+    return str(value)
+
+
+class ProductFragments:
+    """The static fields of every catalog row as a ready-made JSON object body.
+
+    ``product_id``, ``name``, ``description`` and ``price`` are encoded once
+    per catalog version; a response is then assembled by joining the
+    fragments of its rows with the per-request values (scores, counts).
+    """
+
+    def __init__(self, fragments: List[str]):
+        self.fragments = fragments
+
+    @staticmethod
+    def _encode_rows(catalog, start: int = 0) -> List[str]:
+        return [
+            f'"product_id":{json_string(product_id)},"name":{json_string(name)},'
+            f'"description":{json_string(description)},"price":{json_float(price)}'
+            for product_id, name, description, price in zip(
+                catalog.ids[start:], catalog.names[start:],
+                catalog.descriptions[start:], catalog.prices[start:].tolist()
+            )
+        ]
+
+    @classmethod
+    def build(cls, catalog) -> "ProductFragments":
+        return cls(cls._encode_rows(catalog))
+
+    def extended(self, catalog, first_new_row: int) -> "ProductFragments":
+        """Fragments for ``catalog``, whose rows before ``first_new_row`` are unchanged"""
+        return ProductFragments(self.fragments[:first_new_row] + self._encode_rows(catalog, first_new_row))
+
+    def render(self, rows: Sequence[int], **fields) -> str:
+        """JSON array of the rows' objects, each followed by ``fields`` (name -> one value per row)"""
+        columns = [
+            (f',"{name}":', [_json_number(value) for value in (values.tolist() if hasattr(values, 'tolist') else values)])
+            for name, values in fields.items()
+        ]
+        objects = []
+        for position, row in enumerate(rows):
+            tail = ''.join(prefix + values[position] for prefix, values in columns)
+            objects.append('{' + self.fragments[row] + tail + '}')
+        return '[' + ','.join(objects) + ']'
@@ -0,0 +1,111 @@
+"""
+Bounded LRU cache for query results in KMart ML API
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a search query"""
+    return ' '.join(query.lower().split())
+
+
+class QueryCache:
+    """LRU cache with a TTL and limits on entry count and estimated bytes.
+
+    Entries are tagged with the catalog version they were computed for.
+    A lookup or store under a newer version drops everything cached before
+    it; one under an older version (a request that started before a
+    reload) is a miss and stores nothing.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 8 * 1024 * 1024,
+                 ttl_seconds: float = 300.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.version = None
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, version: Any = None) -> Optional[Any]:
+        """Cached value for key, or None on a miss"""
+        with self._lock:
+            if not self._advance(version):
+                self.misses += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at <= self.clock():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, version: Any, size: int):
+        """Store a value computed for the given catalog version, with its size in bytes"""
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            if not self._advance(version):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, self.clock() + self.ttl_seconds)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, version: Any = None):
+        """Drop every entry, e.g. after the catalog or model is reloaded"""
+        with self._lock:
+            self._reset(version)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+            }
+
+    def _advance(self, version) -> bool:
+        """Move to ``version`` if it is newer; False if it is older than the cached entries"""
+        if version == self.version:
+            return True
+        if version is not None and self.version is not None and version < self.version:
+            return False
+        self._reset(version)
+        return True
+
+    def _reset(self, version):
+        self._entries.clear()
+        self._bytes = 0
+        self.version = version
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
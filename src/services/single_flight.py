@@ -0,0 +1,67 @@
+"""
+Request coalescing ("single flight") for KMart ML API
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from src.metrics import SINGLE_FLIGHT_CALLS
+
+
+class _Call:
+    """One computation in progress and the callers waiting for it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one computation per key at a time and shares it with concurrent callers.
+
+    The first caller for a key computes; callers arriving with the same key
+    before it finishes wait and receive the same result, or the same
+    exception. Nothing is kept afterwards, so unlike a cache this never
+    serves an old result: it only merges identical work already running,
+    such as the burst of equal requests after a cache invalidation or
+    catalog reload.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls: Dict[Tuple[str, Hashable], _Call] = {}
+
+    def do(self, operation: str, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """``compute()``, or the result of an identical call already in flight"""
+        if not self.enabled:
+            return compute()
+
+        flight_key = (operation, key)
+        with self._lock:
+            call = self._calls.get(flight_key)
+            leader = call is None
+            if leader:
+                call = self._calls[flight_key] = _Call()
+
+        if not leader:
+            SINGLE_FLIGHT_CALLS.inc((operation, 'coalesced'))
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        SINGLE_FLIGHT_CALLS.inc((operation, 'computed'))
+        try:
+            call.result = compute()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Later callers start a fresh computation
+            with self._lock:
+                del self._calls[flight_key]
+            call.done.set()
+
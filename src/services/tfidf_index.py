@@ -0,0 +1,213 @@
+"""
+Persisted TF-IDF index for KMart ML API
+
+Fitting TF-IDF over the catalog dominates cold start, so the fitted model
+is saved under ``<artifact dir>/<catalog fingerprint>/``:
+
+    tfidf_matrix.npz   product x term matrix (scipy sparse)
+    vocabulary.json    terms as a JSON list, in column order
+    idf.npy            inverse document frequencies, in column order
+    params.json        artifact format and vectorizer settings
+
+A matching artifact is loaded as is; a new catalog fingerprint triggers a
+refit, or extends the previous matrix when products were only appended.
+Either way the result is saved as the new fingerprint's artifact, so a
+worker that reloaded the catalog and one started fresh on it serve the
+same matrix, and the artifacts of other fingerprints are removed. Prebuild it at deploy time with:
+
+    python -m src.services.tfidf_index
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from typing import Any, Dict, Optional
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from src import config
+from src.startup import StartupReport
+
+TFIDF_ARTIFACT_FORMAT = 2
+
+TFIDF_PARAMS = {
+    'max_features': 1000,
+    'stop_words': 'english',
+    'ngram_range': [1, 2],
+}
+
+
+def _new_vectorizer(vocabulary=None) -> TfidfVectorizer:
+    return TfidfVectorizer(
+        max_features=TFIDF_PARAMS['max_features'],
+        stop_words=TFIDF_PARAMS['stop_words'],
+        ngram_range=tuple(TFIDF_PARAMS['ngram_range']),
+        vocabulary=vocabulary
+    )
+
+
+def product_texts(product_df):
+    """Name and description of every product, as indexed by TF-IDF"""
+    names = product_df['name'].fillna('').astype(str) if 'name' in product_df.columns else ''
+    descriptions = product_df['description'].fillna('').astype(str) if 'description' in product_df.columns else ''
+    return (names + ' ' + descriptions).tolist()
+
+
+def fit_tfidf(product_df):
+    """Fit a vectorizer over the catalog; returns (vectorizer, CSR matrix)"""
+    vectorizer = _new_vectorizer()
+    matrix = vectorizer.fit_transform(product_texts(product_df)).tocsr()
+    return vectorizer, matrix
+
+
+def can_extend_tfidf(vectorizer: TfidfVectorizer, product_df, first_new_row: int) -> bool:
+    """Whether appending rows with the old vocabulary matches what a refit would index.
+
+    A vocabulary below ``max_features`` would take in any new term on a
+    refit, so extending is only allowed when the new rows bring none; a full
+    vocabulary keeps its most frequent terms, which a few rows rarely change.
+    """
+    if len(vectorizer.vocabulary_) >= TFIDF_PARAMS['max_features']:
+        return True
+    analyze = vectorizer.build_analyzer()
+    texts = product_texts(product_df.iloc[first_new_row:])
+    return all(term in vectorizer.vocabulary_ for text in texts for term in analyze(text))
+
+
+def extend_tfidf(vectorizer: TfidfVectorizer, matrix, product_df, first_new_row: int):
+    """Append rows for products from ``first_new_row`` on, keeping vocabulary and idf"""
+    texts = product_texts(product_df.iloc[first_new_row:])
+    return sparse.vstack([matrix[:first_new_row], vectorizer.transform(texts)], format='csr')
+
+
+def save_tfidf(directory: str, vectorizer: TfidfVectorizer, matrix):
+    """Write an artifact directory atomically"""
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.tfidf-', dir=parent)
+    try:
+        sparse.save_npz(os.path.join(staging, 'tfidf_matrix.npz'), matrix)
+        np.save(os.path.join(staging, 'idf.npy'), vectorizer.idf_)
+        with open(os.path.join(staging, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+            json.dump(vectorizer.get_feature_names_out().tolist(), f, ensure_ascii=False)
+        with open(os.path.join(staging, 'params.json'), 'w') as f:
+            json.dump({'format': TFIDF_ARTIFACT_FORMAT, 'params': TFIDF_PARAMS}, f)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(staging, directory)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def load_tfidf(directory: str):
+    """Load an artifact; returns (vectorizer, CSR matrix) or None if absent or outdated"""
+    try:
+        with open(os.path.join(directory, 'params.json'), 'r') as f:
+            header = json.load(f)
+        if header.get('format') != TFIDF_ARTIFACT_FORMAT or header.get('params') != TFIDF_PARAMS:
+            return None
+        with open(os.path.join(directory, 'vocabulary.json'), 'r', encoding='utf-8') as f:
+            vocabulary = json.load(f)
+        idf = np.load(os.path.join(directory, 'idf.npy'))
+        matrix = sparse.load_npz(os.path.join(directory, 'tfidf_matrix.npz')).tocsr()
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        # Truncated or corrupt files count as no artifact and are rebuilt
+        return None
+
+    if not isinstance(vocabulary, list) or len(vocabulary) != len(idf) or matrix.shape[1] != len(idf):
+        return None
+    vectorizer = _new_vectorizer(vocabulary)
+    vectorizer.idf_ = idf
+    return vectorizer, matrix
+
+
+def artifact_path(fingerprint: str, artifact_dir: Optional[str] = None) -> str:
+    """Directory of the artifact for a catalog fingerprint"""
+    return os.path.join(artifact_dir or config.TFIDF_ARTIFACT_DIR, fingerprint)
+
+
+def prune_tfidf_artifacts(fingerprint: str, artifact_dir: Optional[str] = None):
+    """Remove the artifacts of every catalog fingerprint but ``fingerprint``"""
+    artifact_dir = artifact_dir or config.TFIDF_ARTIFACT_DIR
+    try:
+        names = os.listdir(artifact_dir)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(artifact_dir, name)
+        # Staging directories of writers still running start with a dot
+        if name == fingerprint or name.startswith('.') or not os.path.exists(os.path.join(path, 'params.json')):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def load_or_build_tfidf(product_df, fingerprint: str, extend_from=None,
+                        report: Optional[StartupReport] = None) -> Dict[str, Any]:
+    """Fitted TF-IDF for the catalog, from its artifact when one matches.
+
+    ``extend_from`` is a (vectorizer, matrix, first_new_row) triple for a
+    catalog that only appended products to the one the matrix was built
+    for; the new rows are then transformed instead of refitting everything.
+    Loading and fitting are timed into ``report`` when one is given.
+    """
+    if report is None:
+        report = StartupReport()
+    directory = artifact_path(fingerprint) if config.TFIDF_ARTIFACT_DIR else None
+
+    with report.phase('load', 'tfidf_artifact'):
+        loaded = load_tfidf(directory) if directory else None
+    if loaded is not None:
+        vectorizer, matrix = loaded
+    else:
+        if extend_from is not None and can_extend_tfidf(extend_from[0], product_df, extend_from[2]):
+            vectorizer, base_matrix, first_new_row = extend_from
+            with report.phase('fit', 'tfidf_extend'):
+                matrix = extend_tfidf(vectorizer, base_matrix, product_df, first_new_row)
+        else:
+            with report.phase('fit', 'tfidf'):
+                vectorizer, matrix = fit_tfidf(product_df)
+        # An extended matrix keeps the old idf, so it is saved too: workers
+        # starting on this catalog later load it instead of refitting
+        if directory:
+            try:
+                save_tfidf(directory, vectorizer, matrix)
+                prune_tfidf_artifacts(fingerprint)
+            except OSError as e:
+                print(f"Warning: Could not save TF-IDF artifact: {e}")
+
+    return {
+        'vectorizer': vectorizer,
+        'data': matrix.data,
+        'indices': matrix.indices,
+        'indptr': matrix.indptr,
+        'shape': np.asarray(matrix.shape, dtype=np.int64)
+    }
+
+
+def main():
+    """Prebuild the artifact for the current product catalog"""
+    from src.data.data_manager import DataManager
+
+    if not config.TFIDF_ARTIFACT_DIR:
+        raise SystemExit("Set KMART_TFIDF_ARTIFACT_DIR to build the TF-IDF artifact")
+
+    data_manager = DataManager()
+    data_manager.load_models()
+    snapshot = data_manager.snapshot
+    data_manager.close()
+    directory = artifact_path(snapshot.fingerprint)
+    if load_tfidf(directory) is not None:
+        print(f"TF-IDF artifact already up to date: {directory}")
+        return
+    vectorizer, matrix = fit_tfidf(snapshot.product_df)
+    save_tfidf(directory, vectorizer, matrix)
+    prune_tfidf_artifacts(snapshot.fingerprint)
+    print(f"TF-IDF artifact written: {directory} ({matrix.shape[0]} products, {matrix.shape[1]} terms)")
+
+
+if __name__ == "__main__":
+    main()
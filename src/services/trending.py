@@ -0,0 +1,113 @@
+"""
+Windowed trending counters for KMart ML API
+"""
+
+import heapq
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+# How much each interaction type counts towards trending
+INTERACTION_WEIGHTS = {
+    'view': 1.0,
+    'view_details': 2.0,
+    'like': 3.0,
+    'unlike': -3.0,
+    'add_to_cart': 4.0,
+    'chat_message': 3.0,
+    'rating': 3.0,
+}
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+class _BucketRing:
+    """Fixed ring of time buckets, each mapping product id -> [score, count]"""
+
+    def __init__(self, num_slots: int, width: int):
+        self.width = width
+        self.keys = [None] * num_slots
+        self.buckets: List[Dict[str, List[float]]] = [{} for _ in range(num_slots)]
+
+    def add(self, product_id: str, weight: float, event_time: float, now: float):
+        key = int(event_time // self.width)
+        if key > int(now // self.width) or key <= int(now // self.width) - len(self.keys):
+            return
+        slot = key % len(self.keys)
+        if self.keys[slot] != key:
+            if self.keys[slot] is not None and self.keys[slot] > key:
+                return  # slot already reused by a newer bucket
+            self.keys[slot] = key
+            self.buckets[slot] = {}
+        entry = self.buckets[slot].setdefault(product_id, [0.0, 0])
+        entry[0] += weight
+        entry[1] += 1
+
+    def window(self, num_buckets: int, now: float):
+        """Buckets covering the last ``num_buckets`` widths up to ``now``"""
+        newest = int(now // self.width)
+        for key in range(newest - min(num_buckets, len(self.keys)) + 1, newest + 1):
+            slot = key % len(self.keys)
+            if self.keys[slot] == key:
+                yield self.buckets[slot]
+
+
+class TrendingCounter:
+    """Per-product interaction counts in hourly and daily buckets.
+
+    Each event touches one hourly and one daily bucket. A query sums the
+    buckets inside the window (hourly up to ``hourly_slots`` hours, daily
+    beyond that), so cost depends on the window and the number of active
+    products rather than the size of the interaction log.
+    """
+
+    def __init__(self, hourly_slots: int = 48, daily_slots: int = 90, clock=time.time):
+        self.clock = clock
+        self.hourly = _BucketRing(hourly_slots, HOUR)
+        self.daily = _BucketRing(daily_slots, DAY)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_index(cls, interaction_index, **kwargs) -> "TrendingCounter":
+        """Rebuild counters from already-loaded interactions"""
+        counter = cls(**kwargs)
+        for record, event_time in zip(interaction_index.records, interaction_index.times):
+            counter.record_event(record, event_time)
+        return counter
+
+    def record_event(self, record, event_time: float):
+        """Count one interaction record (as stored in InteractionIndex)"""
+        product_id = record.get('product_id')
+        weight = INTERACTION_WEIGHTS.get(record.get('interaction_type'))
+        if not product_id or weight is None:
+            return
+        now = self.clock()
+        with self._lock:
+            self.hourly.add(str(product_id), weight, event_time, now)
+            self.daily.add(str(product_id), weight, event_time, now)
+
+    def top(self, days: int = 7, limit: int = 10, now: Optional[float] = None) -> List[Tuple[str, float, int]]:
+        """Return (product_id, trending_score, interaction_count) for the window"""
+        if limit <= 0 or days <= 0:
+            return []
+        now = self.clock() if now is None else now
+        hours = days * 24
+        with self._lock:
+            if hours <= len(self.hourly.keys):
+                buckets = list(self.hourly.window(hours, now))
+            else:
+                buckets = list(self.daily.window(days, now))
+            totals: Dict[str, List[float]] = {}
+            for bucket in buckets:
+                for product_id, (score, count) in bucket.items():
+                    total = totals.setdefault(product_id, [0.0, 0])
+                    total[0] += score
+                    total[1] += count
+
+        ranked = heapq.nlargest(
+            limit,
+            ((score, count, product_id) for product_id, (score, count) in totals.items() if score > 0),
+            key=lambda item: (item[0], item[1])
+        )
+        return [(product_id, score, int(count)) for score, count, product_id in ranked]
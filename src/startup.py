@@ -0,0 +1,57 @@
+"""
+Startup phase timing for KMart ML API
+"""
+
+import contextlib
+import json
+import threading
+import time
+from typing import Any, Dict
+
+# Taken when the app first imports this module, i.e. right after process start
+PROCESS_STARTED = time.monotonic()
+
+
+class StartupReport:
+    """Wall-clock seconds per startup phase, grouped by kind.
+
+    Kinds are ``import`` (per module), ``load`` (per artifact) and ``fit``
+    (models trained at boot, e.g. TF-IDF without a saved artifact).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.ready_after = None
+
+    @contextlib.contextmanager
+    def phase(self, kind: str, name: str):
+        """Time the enclosed block as phase ``name`` of ``kind``"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, name, time.perf_counter() - started)
+
+    def record(self, kind: str, name: str, seconds: float):
+        with self._lock:
+            self.phases.setdefault(kind, {})[name] = round(seconds, 4)
+
+    def mark_ready(self):
+        """Record how long the process took to become ready for traffic"""
+        self.ready_after = round(time.monotonic() - PROCESS_STARTED, 4)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            phases = {kind: dict(names) for kind, names in self.phases.items()}
+        return {
+            'ready_after_seconds': self.ready_after,
+            'totals': {kind: round(sum(names.values()), 4) for kind, names in phases.items()},
+            'phases': phases,
+        }
+
+    def log(self):
+        print(f"Startup report: {json.dumps(self.as_dict(), sort_keys=True)}")
+
+
+startup_report = StartupReport()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Co-interaction model check for KMart ML API: the model updated event by
+event, with and without compaction, matches a full rebuild
+"""
+
+import random
+import sys
+import time
+
+import numpy as np
+
+
+def test_co_interactions_incremental(users=60, products=40, events=3000, seed=7):
+    """The co-interaction model updated event by event must match a rebuild from the same log"""
+    from src.data.interaction_index import InteractionIndex
+    from src.services.co_interactions import CoInteractionModel
+    from src.services.trending import INTERACTION_WEIGHTS
+    
+    print("\n1. Testing incremental co-interaction model against a full rebuild...")
+    rng = random.Random(seed)
+    types = list(INTERACTION_WEIGHTS)
+    rows = [
+        {
+            'userId': f"user_{rng.randrange(users)}",
+            # Some products only appear after the model is built
+            'productId': f"prod_{rng.randrange(products if number > events // 2 else products // 2)}",
+            'interactionType': rng.choice(types),
+            'timestamp': f"2024-01-01T00:00:{number % 60:02d}",
+            'metadata': '{}'
+        }
+        for number in range(events)
+    ]
+    errors = []
+    
+    def compare(model, label):
+        rebuilt = CoInteractionModel.from_index(index, neighbours=products)
+        mismatched = 0
+        for product_id in rebuilt.item_ids:
+            expected_ids, expected_scores = rebuilt.similar(product_id, products)
+            actual_ids, actual_scores = model.similar(product_id, products)
+            expected = dict(zip(expected_ids, np.asarray(expected_scores).tolist()))
+            actual = dict(zip(actual_ids, np.asarray(actual_scores).tolist()))
+            if expected.keys() != actual.keys() or not all(
+                np.isclose(actual[key], expected[key], rtol=1e-9, atol=1e-9) for key in expected
+            ):
+                mismatched += 1
+        print(f"   {label}: {len(rebuilt.item_ids)} products, {mismatched} with different neighbours")
+        if mismatched:
+            errors.append(f"{label}: {mismatched} products differ from the rebuild")
+    
+    for compact_after in (10 ** 9, 200):
+        index = InteractionIndex()
+        index.add_many(rows[:events // 2])
+        model = CoInteractionModel.from_index(index, neighbours=products, compact_after=compact_after)
+        for position in index.add_many(rows[events // 2:]):
+            model.record_event(index.records[position], index.times[position])
+        # Background compactions started by record_event
+        deadline = time.time() + 30
+        while model._compacting and time.time() < deadline:
+            time.sleep(0.05)
+        label = "deltas only" if compact_after == 10 ** 9 else "with background compactions"
+        compare(model, label)
+        model.compact()
+        compare(model, f"{label}, compacted")
+    
+    print(f"   {'OK' if not errors else 'FAILED'}")
+    return not errors
+
+
+if __name__ == "__main__":
+    print("Running co-interaction model check...")
+    sys.exit(0 if test_co_interactions_incremental() else 1)
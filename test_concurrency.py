@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Concurrency check for KMart ML API: snapshot readers against concurrent
+interaction writers and catalog reloads, run in-process against a
+temporary copy of the interaction log
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+
+def test_snapshot_readers(writers=4, batches=40, batch_size=5):
+    """Readers must only ever see whole snapshots and whole interaction batches"""
+    from src.data import data_manager as data_manager_module
+    from src.data.interaction_log import read_interaction_log
+    
+    print("\n1. Testing snapshot readers against concurrent writers...")
+    workdir = tempfile.mkdtemp(prefix='kmart-check-')
+    log_path = os.path.join(workdir, 'interactions.csv')
+    if os.path.exists(data_manager_module.INTERACTION_LOG_PATH):
+        shutil.copy(data_manager_module.INTERACTION_LOG_PATH, log_path)
+    original = data_manager_module.INTERACTION_LOG_PATH, data_manager_module.INTERACTION_CHUNK_SIZE
+    # A small chunk size publishes a new interaction table every few batches
+    data_manager_module.INTERACTION_LOG_PATH = log_path
+    data_manager_module.INTERACTION_CHUNK_SIZE = 7
+    errors = []
+    try:
+        manager = data_manager_module.DataManager()
+        manager.load_models()
+        initial_rows = len(manager.interaction_df)
+        product_ids = [str(product_id) for product_id in manager.catalog.ids[:10]]
+        users = [f"check_writer_{number}" for number in range(writers)]
+        done = threading.Event()
+        
+        def write(user_id):
+            try:
+                for _ in range(batches):
+                    manager.save_interactions([
+                        {'user_id': user_id, 'product_id': random.choice(product_ids), 'interaction_type': 'view'}
+                        for _ in range(batch_size)
+                    ])
+            except Exception as e:
+                errors.append(f"writer {user_id}: {e}")
+        
+        def reload():
+            try:
+                while not done.is_set():
+                    manager.reload_catalog(force=True)
+                    manager.interaction_df
+            except Exception as e:
+                errors.append(f"reloader: {e}")
+        
+        def read():
+            last_version, last_rows = 0, 0
+            last_counts = {user_id: 0 for user_id in users}
+            try:
+                while not done.is_set():
+                    snapshot = manager.snapshot
+                    if snapshot.version < last_version:
+                        errors.append(f"snapshot version went back from {last_version} to {snapshot.version}")
+                    if len(snapshot.catalog) != len(snapshot.product_df):
+                        errors.append("snapshot catalog and product table disagree")
+                    rows = len(snapshot.interaction_df)
+                    if rows < last_rows:
+                        errors.append(f"interaction table shrank from {last_rows} to {rows}")
+                    last_version, last_rows = snapshot.version, rows
+                    
+                    index = manager.interaction_index
+                    for user_id in users:
+                        positions = index.by_user.get(user_id, [])
+                        if len(positions) % batch_size or len(positions) < last_counts[user_id]:
+                            errors.append(f"{user_id}: saw {len(positions)} interactions, a partial batch")
+                        if any(index.records[position]['user_id'] != user_id for position in positions):
+                            errors.append(f"{user_id}: position list points at another user's record")
+                        times = [index.times[position] for position in positions]
+                        if times != sorted(times):
+                            errors.append(f"{user_id}: positions out of time order")
+                        last_counts[user_id] = len(positions)
+            except Exception as e:
+                errors.append(f"reader: {e}")
+        
+        threads = [threading.Thread(target=write, args=(user_id,)) for user_id in users]
+        helpers = [threading.Thread(target=reload), threading.Thread(target=read), threading.Thread(target=read)]
+        started = time.perf_counter()
+        for thread in helpers + threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        done.set()
+        for thread in helpers:
+            thread.join()
+        manager.close()
+        
+        total = writers * batches * batch_size
+        for user_id in users:
+            saved = len(manager.interaction_index.by_user.get(user_id, []))
+            if saved != batches * batch_size:
+                errors.append(f"{user_id}: {saved} indexed interactions, expected {batches * batch_size}")
+        if len(manager.interaction_df) != initial_rows + total:
+            errors.append(f"interaction table has {len(manager.interaction_df)} rows, expected {initial_rows + total}")
+        logged = len(read_interaction_log(log_path))
+        if logged != initial_rows + total:
+            errors.append(f"interaction log has {logged} rows, expected {initial_rows + total}")
+        
+        print(f"   {total} interactions from {writers} writers, snapshot version {manager.snapshot.version}, "
+              f"{time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        errors.append(str(e))
+    finally:
+        data_manager_module.INTERACTION_LOG_PATH, data_manager_module.INTERACTION_CHUNK_SIZE = original
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    for error in sorted(set(errors))[:10]:
+        print(f"   Error: {error}")
+    print(f"   {'OK' if not errors else 'FAILED'}")
+    return not errors
+
+
+if __name__ == "__main__":
+    print("Running concurrency checks...")
+    sys.exit(0 if test_snapshot_readers() else 1)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Request coalescing check for KMart ML API: identical concurrent calls
+through SingleFlight run one computation
+"""
+
+import sys
+import threading
+import time
+
+
+def test_single_flight(callers=16):
+    """N identical concurrent calls compute once; every caller gets the result or the exception"""
+    from src.services.single_flight import SingleFlight
+    
+    print("\n1. Testing request coalescing...")
+    errors = []
+    flights = SingleFlight()
+    
+    def run(compute):
+        calls, results = [], []
+        barrier = threading.Barrier(callers)
+        
+        def counted():
+            calls.append(1)
+            # Long enough for every caller to arrive while the first one computes
+            time.sleep(0.5)
+            return compute()
+        
+        def call():
+            barrier.wait()
+            try:
+                results.append(flights.do('check', 'same-key', counted))
+            except Exception as e:
+                results.append(e)
+        
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(calls), results
+    
+    calls, results = run(lambda: object())
+    print(f"   {callers} callers, {calls} computation(s)")
+    if calls != 1:
+        errors.append(f"expected 1 computation, got {calls}")
+    if len(results) != callers or any(result is not results[0] for result in results):
+        errors.append("callers did not all receive the same result")
+    
+    failure = ValueError("check failure")
+    
+    def fail():
+        raise failure
+    
+    calls, results = run(fail)
+    print(f"   {callers} failing callers, {calls} computation(s)")
+    if calls != 1:
+        errors.append(f"expected 1 failing computation, got {calls}")
+    if len(results) != callers or any(result is not failure for result in results):
+        errors.append("not every waiter received the exception")
+    
+    # Nothing is kept once the flight has landed
+    calls, _ = run(lambda: object())
+    if calls != 1:
+        errors.append(f"a later burst should compute again once, got {calls}")
+    
+    for error in errors:
+        print(f"   Error: {error}")
+    print(f"   {'OK' if not errors else 'FAILED'}")
+    return not errors
+
+
+if __name__ == "__main__":
+    print("Running request coalescing check...")
+    sys.exit(0 if test_single_flight() else 1)